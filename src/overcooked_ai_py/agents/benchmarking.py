@@ -268,9 +268,19 @@ class AgentEvaluator(object):
         return dict_traj
 
     @staticmethod
-    def load_traj_from_json(filename):
+    def load_traj_from_json(filename, recipe_context=None):
+        """
+        Loads trajectories saved with `save_traj_as_json`. The states of each episode use `recipe_context` if
+        given, otherwise the recipe context of an MDP built from the episode's mdp_params
+        """
         traj_dict = load_from_json(filename)
-        traj_dict["ep_states"] = [[OvercookedState.from_dict(ob) for ob in curr_ep_obs] for curr_ep_obs in traj_dict["ep_states"]]
+        ep_recipe_contexts = [
+            recipe_context or OvercookedGridworld(**mdp_params).recipe_context for mdp_params in traj_dict["mdp_params"]
+        ]
+        traj_dict["ep_states"] = [
+            [OvercookedState.from_dict(ob, ep_recipe_context) for ob in curr_ep_obs]
+            for curr_ep_obs, ep_recipe_context in zip(traj_dict["ep_states"], ep_recipe_contexts)
+        ]
         traj_dict["ep_actions"] = [[tuple(tuple(a) if type(a) is list else a for a in j_a) for j_a in ep_acts] for ep_acts in traj_dict["ep_actions"]]
         return traj_dict
 
@@ -323,13 +333,19 @@ class AgentEvaluator(object):
         return trajs
 
     @staticmethod
-    def add_observations_to_trajs_in_metadata(trajs, encoding_fn):
-        """Adds processed observations (for both agent indices) in the metadatas"""
+    def add_observations_to_trajs_in_metadata(trajs, encoding_fn, batched=False):
+        """
+        Adds processed observations (for both agent indices) in the metadatas. If batched, encoding_fn encodes
+        all states of a trajectory at once (e.g. OvercookedGridworld.lossless_state_encoding_batch)
+        """
         def metadata_fn(data):
             traj_ep_states = data[0]
             obs_metadata = []
             for one_traj_states in traj_ep_states:
-                obs_metadata.append([encoding_fn(s) for s in one_traj_states])
+                if batched:
+                    obs_metadata.append(encoding_fn(list(one_traj_states)))
+                else:
+                    obs_metadata.append([encoding_fn(s) for s in one_traj_states])
             return "ep_obs_for_both_agents", obs_metadata
         return AgentEvaluator.add_metadata_to_traj(trajs, metadata_fn, ["ep_states"])
 
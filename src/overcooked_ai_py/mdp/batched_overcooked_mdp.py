@@ -0,0 +1,379 @@
+import numpy as np
+from overcooked_ai_py.mdp.actions import Action, Direction
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedState, PlayerState, ObjectState, SoupState, Recipe, \
+    OvercookedStateCodec, EVENT_TYPES
+
+
+class BatchedOvercookedGridworld(object):
+    """
+    N states of one OvercookedGridworld stored as NumPy arrays, that `step` advances all at once with
+    array operations. Transitions, sparse and shaped rewards and event flags are exactly the ones of
+    OvercookedGridworld.get_state_transition, including resolving the interacts of the players one
+    after the other and collisions.
+
+    Every player has a position (OvercookedGridworld.get_position_index), an orientation (index into
+    Direction.INDEX_TO_DIRECTION) and a held object. Non-held objects can only be on terrain, so
+    every non floor cell gets an object slot (`object_positions`). Objects are stored as their
+    index in OBJECT_NAMES (0 for no object), and soups additionally as their ingredient counts (in
+    the order of Recipe.ALL_INGREDIENTS), their cooking tick and their ingredient sequence packed in
+    base len(Recipe.ALL_INGREDIENTS) + 1, which restores the order of the ingredients when states
+    are converted back to OvercookedStates. All states of a batch must have the same orders.
+    """
+
+    OBJECT_NAMES = OvercookedStateCodec.OBJECT_NAMES
+    TERRAIN_TYPES = (' ', 'X', 'O', 'T', 'D', 'P', 'S')
+
+    def __init__(self, mdp, states):
+        """
+        mdp (OvercookedGridworld): The layout and dynamics of all states
+        states (list(OvercookedState)): The initial states of the batch
+        """
+        if not states:
+            raise ValueError("A batch needs at least one state")
+        self.mdp = mdp
+        self.recipe_context = mdp.recipe_context
+        self.num_players = mdp.num_players
+        self.num_states = len(states)
+        self._all_orders = states[0].all_orders
+        self._bonus_orders = states[0].bonus_orders
+        self._setup_layout()
+        self._setup_recipe_tables(states[0])
+
+        n, p, c, i = self.num_states, self.num_players, len(self.object_positions), len(Recipe.ALL_INGREDIENTS)
+        self.timestep = np.zeros(n, dtype=np.int64)
+        self.player_positions = np.zeros((n, p), dtype=np.int64)
+        self.player_orientations = np.zeros((n, p), dtype=np.int64)
+        self.held_objects = np.zeros((n, p), dtype=np.int8)
+        self.held_soup_counts = np.zeros((n, p, i), dtype=np.int8)
+        self.held_soup_ticks = np.zeros((n, p), dtype=np.int64)
+        self.held_soup_sequences = np.zeros((n, p), dtype=np.int64)
+        self.objects = np.zeros((n, c), dtype=np.int8)
+        self.soup_counts = np.zeros((n, c, i), dtype=np.int8)
+        self.soup_ticks = np.zeros((n, c), dtype=np.int64)
+        self.soup_sequences = np.zeros((n, c), dtype=np.int64)
+        for idx, state in enumerate(states):
+            self.set_state(idx, state)
+
+    def _setup_layout(self):
+        mdp = self.mdp
+        self.object_positions = tuple((x, y) for y, row in enumerate(mdp.terrain_mtx) for x, terrain_type in enumerate(row) if terrain_type != ' ')
+        self._terrain = np.array([self.TERRAIN_TYPES.index(terrain_type) for row in mdp.terrain_mtx for terrain_type in row], dtype=np.int8)
+        self._slots = np.full(mdp.width * mdp.height, -1, dtype=np.int64)
+        for slot, pos in enumerate(self.object_positions):
+            self._slots[self._flat_index(pos)] = slot
+        self._counter_slots = np.array([self._slots[self._flat_index(pos)] for pos in mdp.get_counter_locations()], dtype=np.int64)
+        self._pot_slots = np.array([self._slots[self._flat_index(pos)] for pos in mdp.get_pot_locations()], dtype=np.int64)
+        # Flat index offsets of moving in every direction, 0 for STAY and INTERACT
+        self._action_offsets = np.array([dx + dy * mdp.width for dx, dy in Direction.INDEX_TO_DIRECTION] + [0, 0], dtype=np.int64)
+
+        self._codes = { name : code for code, name in enumerate(self.OBJECT_NAMES) if name is not None }
+        self._soup_code = self._codes['soup']
+        self._dish_code = self._codes['dish']
+        self._onion_code = self._codes[Recipe.ONION]
+        # Ingredient index (in Recipe.ALL_INGREDIENTS) of every object code, -1 for non-ingredients
+        self._ingredient_of_code = np.array([Recipe.ALL_INGREDIENTS.index(name) if name in Recipe.ALL_INGREDIENTS else -1 for name in self.OBJECT_NAMES], dtype=np.int64)
+        self._sequence_base = len(Recipe.ALL_INGREDIENTS) + 1
+
+    def _setup_recipe_tables(self, state):
+        """
+        Tables indexed by the soup index of soups: 0 for soups without ingredients and recipe id + 1
+        otherwise, see `_soup_indices`. Values are looked up through the mdp (and the orders of the batch)
+        so that they are exactly the ones of OvercookedGridworld.get_state_transition
+        """
+        mdp, context = self.mdp, self.recipe_context
+        max_num_ingredients = context.max_num_ingredients
+        num_ingredients = len(Recipe.ALL_INGREDIENTS)
+        self._count_strides = (max_num_ingredients + 1)**np.arange(num_ingredients)
+        self._soup_index_of_counts = np.zeros((max_num_ingredients + 1)**num_ingredients, dtype=np.int64)
+        for recipe in context.all_recipes:
+            counts = np.array([recipe.ingredients.count(ingredient) for ingredient in Recipe.ALL_INGREDIENTS])
+            self._soup_index_of_counts[np.dot(counts, self._count_strides)] = recipe.id + 1
+
+        recipes = [None] + [Recipe.from_id(recipe_id) for recipe_id in range(len(context.all_recipes))]
+        self._cook_times = np.array([0] + [context.recipe_time(recipe) for recipe in recipes[1:]], dtype=np.int64)
+        self._delivery_values = np.array([0] + [mdp.get_recipe_value(state, recipe) for recipe in recipes[1:]], dtype=np.float64)
+        self._optimal_values = np.array([mdp.get_recipe_value(state, mdp.get_optimal_possible_recipe(state, recipe)) for recipe in recipes], dtype=np.float64)
+
+    def _flat_index(self, pos):
+        return self.mdp.get_position_index(pos)
+
+    def _position(self, flat_index):
+        return self.mdp.get_position_from_index(int(flat_index))
+
+    def _soup_indices(self, counts):
+        return self._soup_index_of_counts[np.dot(counts, self._count_strides)]
+
+    def _soups_ready(self, codes, counts, ticks):
+        return (codes == self._soup_code) & (ticks >= 0) & (ticks >= self._cook_times[self._soup_indices(counts)])
+
+    ##########################
+    # STATE CONVERSION UTILS #
+    ##########################
+
+    def set_state(self, idx, state):
+        """Overwrites state `idx` of the batch with the OvercookedState `state`"""
+        if len(state.players) != self.num_players:
+            raise ValueError("Expected a state with {} players, got {}".format(self.num_players, len(state.players)))
+        if state.all_orders != self._all_orders or state.bonus_orders != self._bonus_orders:
+            raise ValueError("All states of a batch must have the same orders")
+        self.timestep[idx] = state.timestep
+        for player_idx, player in enumerate(state.players):
+            self.player_positions[idx, player_idx] = self._flat_index(player.position)
+            self.player_orientations[idx, player_idx] = Direction.DIRECTION_TO_INDEX[player.orientation]
+            self._set_object(idx, player.held_object, self.held_objects[:, player_idx], self.held_soup_counts[:, player_idx],
+                             self.held_soup_ticks[:, player_idx], self.held_soup_sequences[:, player_idx])
+
+        self.objects[idx] = 0
+        self.soup_counts[idx] = 0
+        self.soup_ticks[idx] = 0
+        self.soup_sequences[idx] = 0
+        for pos, obj in state.objects.items():
+            slot = self._slots[self._flat_index(pos)]
+            if slot < 0:
+                raise ValueError("Object {} isn't on terrain".format(obj))
+            self._set_object(idx, obj, self.objects[:, slot], self.soup_counts[:, slot], self.soup_ticks[:, slot], self.soup_sequences[:, slot])
+
+    def _set_object(self, idx, obj, codes, counts, ticks, sequences):
+        counts[idx] = 0
+        ticks[idx] = 0
+        sequences[idx] = 0
+        if obj is None:
+            codes[idx] = 0
+            return
+        if obj.name not in self._codes:
+            raise ValueError("Unknown object {}".format(obj))
+        codes[idx] = self._codes[obj.name]
+        if obj.name == 'soup':
+            ticks[idx] = obj._cooking_tick
+            sequence = 0
+            for ingredient in reversed(obj.ingredients):
+                ingredient_idx = Recipe.ALL_INGREDIENTS.index(ingredient)
+                counts[idx, ingredient_idx] += 1
+                sequence = sequence * self._sequence_base + ingredient_idx + 1
+            sequences[idx] = sequence
+
+    def get_state(self, idx):
+        """Returns state `idx` of the batch as an OvercookedState"""
+        players = []
+        for player_idx in range(self.num_players):
+            position = self._position(self.player_positions[idx, player_idx])
+            orientation = Direction.INDEX_TO_DIRECTION[self.player_orientations[idx, player_idx]]
+            held_object = self._get_object(position, self.held_objects[idx, player_idx], self.held_soup_ticks[idx, player_idx], self.held_soup_sequences[idx, player_idx])
+            players.append(PlayerState(position, orientation, held_object))
+
+        objects = {}
+        for slot in np.flatnonzero(self.objects[idx]):
+            pos = self.object_positions[slot]
+            objects[pos] = self._get_object(pos, self.objects[idx, slot], self.soup_ticks[idx, slot], self.soup_sequences[idx, slot])
+        return OvercookedState(players, objects, bonus_orders=self._bonus_orders, all_orders=self._all_orders,
+                               timestep=int(self.timestep[idx]), recipe_context=self.recipe_context)
+
+    def get_states(self):
+        return [self.get_state(idx) for idx in range(self.num_states)]
+
+    def _get_object(self, pos, code, tick, sequence):
+        if not code:
+            return None
+        if code != self._soup_code:
+            return ObjectState(self.OBJECT_NAMES[code], pos)
+        ingredients = []
+        sequence = int(sequence)
+        while sequence:
+            sequence, digit = divmod(sequence, self._sequence_base)
+            ingredients.append(ObjectState(Recipe.ALL_INGREDIENTS[digit - 1], pos))
+        return SoupState(pos, ingredients, int(tick), self.recipe_context)
+
+    ###################
+    # STEP PROCESSING #
+    ###################
+
+    def step(self, joint_actions):
+        """
+        Applies one joint action to every state of the batch in place.
+
+        joint_actions: (num_states, num_players) array of action indices (see Action.ACTION_TO_INDEX)
+
+        Returns the infos of OvercookedGridworld.get_state_transition, with (num_states, num_players)
+        arrays in place of the per player lists
+        """
+        joint_actions = np.asarray(joint_actions, dtype=np.int64)
+        if joint_actions.shape != (self.num_states, self.num_players):
+            raise ValueError("Expected joint actions of shape {}, got {}".format((self.num_states, self.num_players), joint_actions.shape))
+
+        events_infos = { event : np.zeros((self.num_states, self.num_players), dtype=bool) for event in EVENT_TYPES }
+        sparse_reward = np.zeros((self.num_states, self.num_players))
+        shaped_reward = np.zeros((self.num_states, self.num_players))
+
+        # Like in get_state_transition, all interacts are logged against the pot states from before the step
+        pot_states = self._get_pot_status_counts()
+        interact_idx = Action.ACTION_TO_INDEX[Action.INTERACT]
+        for player_idx in range(self.num_players):
+            rows = np.flatnonzero(joint_actions[:, player_idx] == interact_idx)
+            if len(rows):
+                self._resolve_interacts(player_idx, rows, pot_states, events_infos, sparse_reward, shaped_reward)
+
+        self._resolve_movement(joint_actions)
+        self._step_environment_effects()
+        return {
+            "event_infos": events_infos,
+            "sparse_reward_by_agent": sparse_reward,
+            "shaped_reward_by_agent": shaped_reward,
+        }
+
+    def _get_pot_status_counts(self):
+        """Number of pots per state that get_full_pots and get_non_empty_pots would return"""
+        codes = self.objects[:, self._pot_slots]
+        counts = self.soup_counts[:, self._pot_slots]
+        ticks = self.soup_ticks[:, self._pot_slots]
+        num_ingredients = counts.sum(axis=-1)
+        idle = (codes == self._soup_code) & (ticks < 0)
+        ready = self._soups_ready(codes, counts, ticks)
+        cooking = (codes == self._soup_code) & (ticks >= 0) & ~ready
+        full = ready | cooking | (idle & (num_ingredients == self.recipe_context.max_num_ingredients))
+        partially_full = idle & (num_ingredients >= 1) & (num_ingredients < self.recipe_context.max_num_ingredients)
+        return {
+            "full": full.sum(axis=1),
+            "non_empty": (ready | cooking | partially_full).sum(axis=1)
+        }
+
+    def _resolve_interacts(self, player_idx, rows, pot_states, events_infos, sparse_reward, shaped_reward):
+        """Resolves the interacts of player `player_idx` in the states `rows`, see OvercookedGridworld.resolve_interacts"""
+        t = self.TERRAIN_TYPES
+        i_pos = self.player_positions[rows, player_idx] + self._action_offsets[self.player_orientations[rows, player_idx]]
+        terrain = self._terrain[i_pos]
+        slots = np.maximum(self._slots[i_pos], 0)
+        held = self.held_objects[rows, player_idx]
+        holding = held != 0
+        cell = np.where(self._slots[i_pos] >= 0, self.objects[rows, slots], 0)
+        cell_counts = self.soup_counts[rows, slots]
+        cell_ticks = self.soup_ticks[rows, slots]
+        cell_soup = cell == self._soup_code
+        cell_num_ingredients = cell_counts.sum(axis=-1)
+        held_ingredients = self._ingredient_of_code[held]
+
+        counter = terrain == t.index('X')
+        drop = counter & holding & (cell == 0)
+        counter_pickup = counter & ~holding & (cell != 0)
+        onion_pickup = (terrain == t.index('O')) & ~holding
+        tomato_pickup = (terrain == t.index('T')) & ~holding
+        dish_pickup = (terrain == t.index('D')) & ~holding
+        pot = terrain == t.index('P')
+        begin_cooking = pot & ~holding & cell_soup & (cell_ticks < 0) & (cell_num_ingredients > 0)
+        soup_pickup = pot & (held == self._dish_code) & self._soups_ready(cell, cell_counts, cell_ticks)
+        pot_has_room = (cell == 0) | (cell_soup & (cell_ticks < 0) & (cell_num_ingredients < self.recipe_context.max_num_ingredients))
+        potting = pot & (held_ingredients >= 0) & pot_has_room
+        delivery = (terrain == t.index('S')) & (held == self._soup_code)
+
+        # Usefulness of pickups and drops, see OvercookedGridworld.is_dish_pickup_useful and co
+        if self.num_players == 2:
+            other_held = self.held_objects[rows, 1 - player_idx]
+            all_pots_full = pot_states["full"][rows] == len(self._pot_slots)
+            dishes_on_counters = (self.objects[rows][:, self._counter_slots] == self._dish_code).sum(axis=1)
+            player_dishes = (self.held_objects[rows] == self._dish_code).sum(axis=1)
+            useful = {
+                "ingredient_pickup": ~(all_pots_full & (other_held != self._dish_code)),
+                "dish_pickup": (dishes_on_counters == 0) & (player_dishes < pot_states["non_empty"][rows]),
+                "ingredient_drop": all_pots_full & (other_held != self._dish_code),
+                "dish_drop": (pot_states["full"][rows] == 0) & (other_held != self._onion_code)
+            }
+        else:
+            no_rows = np.zeros(len(rows), dtype=bool)
+            useful = { "ingredient_pickup": no_rows, "dish_pickup": no_rows, "ingredient_drop": no_rows, "dish_drop": no_rows }
+
+        def log(event, mask):
+            events_infos[event][rows[mask], player_idx] = True
+
+        for code, name in enumerate(self.OBJECT_NAMES):
+            if name is None:
+                continue
+            useful_kind = "dish" if name == "dish" else "ingredient" if name in Recipe.ALL_INGREDIENTS else None
+            for action, mask, obj_codes in (("drop", drop, held), ("pickup", counter_pickup, cell)):
+                is_obj = mask & (obj_codes == code)
+                log("{}_{}".format(name, action), is_obj)
+                if useful_kind:
+                    log("useful_{}_{}".format(name, action), is_obj & useful["{}_{}".format(useful_kind, action)])
+        log("onion_pickup", onion_pickup)
+        log("useful_onion_pickup", onion_pickup & useful["ingredient_pickup"])
+        log("dish_pickup", dish_pickup)
+        log("useful_dish_pickup", dish_pickup & useful["dish_pickup"])
+        log("soup_pickup", soup_pickup)
+        log("soup_delivery", delivery)
+
+        rewards = self.mdp.reward_shaping_params
+        shaped_reward[rows, player_idx] += np.where(dish_pickup & useful["dish_pickup"], rewards["DISH_PICKUP_REWARD"], 0)
+        shaped_reward[rows, player_idx] += np.where(soup_pickup, rewards["SOUP_PICKUP_REWARD"], 0)
+        shaped_reward[rows, player_idx] += np.where(potting, rewards["PLACEMENT_IN_POT_REW"], 0)
+        sparse_reward[rows, player_idx] += np.where(delivery, self._delivery_values[self._soup_indices(self.held_soup_counts[rows, player_idx])], 0)
+
+        # Potting outcomes, see OvercookedGridworld.log_object_potting
+        potting_rows, potting_slots = rows[potting], slots[potting]
+        potting_ingredients = held_ingredients[potting]
+        old_counts = cell_counts[potting]
+        new_counts = old_counts.copy()
+        new_counts[np.arange(len(potting_rows)), potting_ingredients] += 1
+        old_values = self._optimal_values[self._soup_indices(old_counts)]
+        new_values = self._optimal_values[self._soup_indices(new_counts)]
+        outcomes = {
+            "optimal": old_values == new_values,
+            "viable": new_values > 0,
+            "catastrophic": (old_values > 0) & (new_values == 0),
+            "useless": old_values == 0
+        }
+        for ingredient_idx, ingredient in enumerate(Recipe.ALL_INGREDIENTS):
+            potting_ingredient = potting_ingredients == ingredient_idx
+            events_infos["potting_{}".format(ingredient)][potting_rows[potting_ingredient], player_idx] = True
+            for outcome, outcome_mask in outcomes.items():
+                events_infos["{}_{}_potting".format(outcome, ingredient)][potting_rows[potting_ingredient & outcome_mask], player_idx] = True
+
+        # Perform the interacts
+        self._move_objects(rows[drop], player_idx, slots[drop], to_counter=True)
+        self._move_objects(rows[counter_pickup], player_idx, slots[counter_pickup], to_counter=False)
+        self.held_objects[rows[onion_pickup], player_idx] = self._onion_code
+        self.held_objects[rows[tomato_pickup], player_idx] = self._codes[Recipe.TOMATO]
+        self.held_objects[rows[dish_pickup], player_idx] = self._dish_code
+        self.soup_ticks[rows[begin_cooking], slots[begin_cooking]] = 0
+        # The dish the soup is picked up with is replaced by the soup
+        self._move_objects(rows[soup_pickup], player_idx, slots[soup_pickup], to_counter=False)
+
+        # Pots without a soup get an empty one first, which is never full
+        self.objects[potting_rows, potting_slots] = self._soup_code
+        self.soup_ticks[potting_rows, potting_slots] = -1
+        self.soup_sequences[potting_rows, potting_slots] += (potting_ingredients + 1) * self._sequence_base**cell_num_ingredients[potting]
+        self.soup_counts[potting_rows, potting_slots, potting_ingredients] += 1
+        self._clear_held_objects(potting_rows, player_idx)
+        self._clear_held_objects(rows[delivery], player_idx)
+
+    def _move_objects(self, rows, player_idx, slots, to_counter):
+        """Moves the objects held by `player_idx` to `slots` (or the other way round) in the states `rows`"""
+        held_arrays = (self.held_objects, self.held_soup_counts, self.held_soup_ticks, self.held_soup_sequences)
+        slot_arrays = (self.objects, self.soup_counts, self.soup_ticks, self.soup_sequences)
+        for held_array, slot_array in zip(held_arrays, slot_arrays):
+            if to_counter:
+                slot_array[rows, slots] = held_array[rows, player_idx]
+                held_array[rows, player_idx] = 0
+            else:
+                held_array[rows, player_idx] = slot_array[rows, slots]
+                slot_array[rows, slots] = 0
+
+    def _clear_held_objects(self, rows, player_idx):
+        for held_array in (self.held_objects, self.held_soup_counts, self.held_soup_ticks, self.held_soup_sequences):
+            held_array[rows, player_idx] = 0
+
+    def _resolve_movement(self, joint_actions):
+        """See OvercookedGridworld.resolve_movement. If any players collide, all players keep their positions"""
+        old_positions = self.player_positions
+        moves = self.mdp.movement_table[old_positions, self.player_orientations, joint_actions]
+        new_positions = moves[..., 0]
+        self.player_orientations = moves[..., 1]
+
+        collision = np.zeros(self.num_states, dtype=bool)
+        for idx0 in range(self.num_players):
+            for idx1 in range(idx0 + 1, self.num_players):
+                collision |= new_positions[:, idx0] == new_positions[:, idx1]
+                collision |= (new_positions[:, idx0] == old_positions[:, idx1]) & (old_positions[:, idx0] == new_positions[:, idx1])
+        self.player_positions = np.where(collision[:, None], old_positions, new_positions)
+
+    def _step_environment_effects(self):
+        self.timestep += 1
+        cooking = (self.objects == self._soup_code) & (self.soup_ticks >= 0) & ~self._soups_ready(self.objects, self.soup_counts, self.soup_ticks)
+        self.soup_ticks += cooking
@@ -3,7 +3,7 @@ import numpy as np
 import random, copy
 from overcooked_ai_py.utils import rnd_int_uniform, rnd_uniform
 from overcooked_ai_py.mdp.actions import Action, Direction
-from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, Recipe
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, Recipe, RecipeContext
 
 EMPTY = ' '
 COUNTER = 'X'
@@ -173,17 +173,17 @@ class LayoutGenerator(object):
         returns onchanged copy of mdp_params when there is no "generate_all_orders" and "generate_bonus_orders" keys inside mdp_params
         """
         mdp_params = copy.deepcopy(mdp_params)
+        recipe_context = RecipeContext({})
         if mdp_params.get("generate_all_orders"):
             all_orders_kwargs = copy.deepcopy(mdp_params["generate_all_orders"])
 
             if all_orders_kwargs.get("recipes"):
-                 all_orders_kwargs["recipes"] = [Recipe.from_dict(r) for r in all_orders_kwargs["recipes"]]
+                 all_orders_kwargs["recipes"] = [recipe_context.recipe_from_dict(r) for r in all_orders_kwargs["recipes"]]
         
-            all_recipes = Recipe.generate_random_recipes(**all_orders_kwargs)
+            all_recipes = Recipe.generate_random_recipes(recipe_context=recipe_context, **all_orders_kwargs)
             mdp_params["start_all_orders"] = [r.to_dict() for r in all_recipes]
         else:
-            Recipe.configure({})
-            all_recipes = Recipe.ALL_RECIPES
+            all_recipes = recipe_context.all_recipes
 
         if mdp_params.get("generate_bonus_orders"):
             bonus_orders_kwargs = copy.deepcopy(mdp_params["generate_bonus_orders"])
@@ -191,7 +191,7 @@ class LayoutGenerator(object):
             if not bonus_orders_kwargs.get("recipes"): 
                 bonus_orders_kwargs["recipes"] = all_recipes
 
-            bonus_recipes = Recipe.generate_random_recipes(**bonus_orders_kwargs)
+            bonus_recipes = Recipe.generate_random_recipes(recipe_context=recipe_context, **bonus_orders_kwargs)
             mdp_params["start_bonus_orders"] = [r.to_dict() for r in bonus_recipes]
         return mdp_params
 
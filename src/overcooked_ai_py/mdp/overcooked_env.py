@@ -1,9 +1,11 @@
 import gym, tqdm
 import time
 import numpy as np
+from collections import OrderedDict
 from overcooked_ai_py.utils import mean_and_std_err, append_dictionaries
 from overcooked_ai_py.mdp.actions import Action
-from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, EVENT_TYPES
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, EventInfos, EVENT_TYPES, LOSSLESS_URGENCY_STEPS
+from overcooked_ai_py.agents.agent import AgentGroup
 from overcooked_ai_py.planning.planners import MediumLevelActionManager, MotionPlanner, NO_COUNTERS_PARAMS
 
 DEFAULT_ENV_PARAMS = {
@@ -12,6 +14,103 @@ DEFAULT_ENV_PARAMS = {
 
 MAX_HORIZON = 1e10
 
+
+class OvercookedEnvSnapshot(object):
+    """
+    Token returned by OvercookedEnv.snapshot. Holds the env's mdp and state by reference (states aren't modified
+    by transitions), copies of the cumulative rewards and the head of the env's event log.
+    """
+    __slots__ = ('mdp', 'state', 'cumulative_rewards', 'event_log')
+
+    def __init__(self, mdp, state, cumulative_rewards, event_log):
+        self.mdp = mdp
+        self.state = state
+        self.cumulative_rewards = cumulative_rewards
+        self.event_log = event_log
+
+class _ObservationCacheKey(object):
+    """
+    Key of an ObservationCache entry: a state compared without its timestep, plus the extra (hashable) values
+    the observation depends on
+    """
+    __slots__ = ('state', 'extra', '_hash')
+
+    def __init__(self, state, extra):
+        self.state = state
+        self.extra = extra
+        self._hash = hash((hash(state), extra))
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return self._hash == other._hash and self.extra == other.extra and self.state.time_independent_equal(other.state)
+
+
+class ObservationCache(object):
+    """
+    Bounded LRU cache of state observations (arrays, or tuples of arrays), used by OvercookedEnv to make
+    repeated encodings of the same state free. Keys are states compared without their timestep, together
+    with whatever else the observation depends on (e.g. whether the lossless urgency layer is set).
+
+    Cached arrays are made read-only, as they are returned to every caller that hits the entry.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        max_bytes (int):    Maximum total size of the cached arrays. The least recently used entries are
+                            evicted once it is exceeded
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, state, extra, compute_fn):
+        """
+        Returns the cached observation of `state` for `extra`, calling `compute_fn(state)` on misses
+        """
+        key = _ObservationCacheKey(state, extra)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        obs = compute_fn(state)
+        num_bytes = ObservationCache._freeze(obs)
+        if num_bytes <= self.max_bytes:
+            self._entries[key] = (obs, num_bytes)
+            self.num_bytes += num_bytes
+            while self.num_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.num_bytes -= evicted_bytes
+        return obs
+
+    def clear(self):
+        """
+        Drops all entries. The hit and miss counters are kept
+        """
+        self._entries.clear()
+        self.num_bytes = 0
+
+    @staticmethod
+    def _freeze(obs):
+        """
+        Makes the arrays in obs read-only and returns their total size in bytes
+        """
+        if isinstance(obs, np.ndarray):
+            obs.flags.writeable = False
+            return obs.nbytes
+        if isinstance(obs, (tuple, list)):
+            return sum(ObservationCache._freeze(x) for x in obs)
+        return 0
+
+
 class OvercookedEnv(object):
     """
     An environment wrapper for the OvercookedGridworld Markov Decision Process.
@@ -46,13 +145,14 @@ class OvercookedEnv(object):
     TIMESTEP_TRAJ_KEYS = ["ep_states", "ep_actions", "ep_rewards", "ep_dones", "ep_infos"]
     EPISODE_TRAJ_KEYS = ["ep_returns", "ep_lengths", "mdp_params", "env_params", "metadatas"]
     DEFAULT_TRAJ_KEYS = TIMESTEP_TRAJ_KEYS + EPISODE_TRAJ_KEYS + ["metadatas"]
+    CUMULATIVE_REWARD_KEYS = ["cumulative_sparse_rewards_by_agent", "cumulative_shaped_rewards_by_agent"]
 
 
     #########################
     # INSTANTIATION METHODS #
     #########################
 
-    def __init__(self, mdp_generator_fn, start_state_fn=None, horizon=MAX_HORIZON, mlam_params=NO_COUNTERS_PARAMS, info_level=1, num_mdp=1, initial_info={}):
+    def __init__(self, mdp_generator_fn, start_state_fn=None, horizon=MAX_HORIZON, mlam_params=NO_COUNTERS_PARAMS, info_level=1, num_mdp=1, initial_info={}, event_level=None, obs_cache_max_bytes=0):
         """
         mdp_generator_fn (callable):    A no-argument function that returns a OvercookedGridworld instance
         start_state_fn (callable):      Function that returns start state for the MDP, called at each environment reset
@@ -61,6 +161,10 @@ class OvercookedEnv(object):
         info_level (int):               Change amount of logging
         num_mdp (int):                  the number of mdp if we are using a list of mdps
         initial_info (dict):            the initial outside information feed into the generator function
+        event_level (int):              Which events are logged into game_stats, one of EVENT_LEVELS. Defaults
+                                        to the event level of the mdp
+        obs_cache_max_bytes (int):      Memory cap of the LRU cache of the *_mdp observation wrappers (e.g.
+                                        lossless_state_encoding_mdp). 0 disables the cache
 
         TODO: Potentially make changes based on this discussion
         https://github.com/HumanCompatibleAI/overcooked_ai/pull/22#discussion_r416786847
@@ -77,6 +181,9 @@ class OvercookedEnv(object):
         self.mlam_params = mlam_params
         self.start_state_fn = start_state_fn
         self.info_level = info_level
+        self.event_level = event_level
+        self.obs_cache_max_bytes = obs_cache_max_bytes
+        self.obs_cache = ObservationCache(obs_cache_max_bytes) if obs_cache_max_bytes > 0 else None
         self.reset(outside_info=initial_info)
         if self.horizon >= MAX_HORIZON and self.info_level > 0:
             print("Environment has (near-)infinite horizon and no terminal states. \
@@ -101,7 +208,7 @@ class OvercookedEnv(object):
         return self._mp
 
     @staticmethod
-    def from_mdp(mdp, start_state_fn=None, horizon=MAX_HORIZON, mlam_params=NO_COUNTERS_PARAMS, info_level=1):
+    def from_mdp(mdp, start_state_fn=None, horizon=MAX_HORIZON, mlam_params=NO_COUNTERS_PARAMS, info_level=1, event_level=None, obs_cache_max_bytes=0):
         """
         Create an OvercookedEnv directly from a OvercookedGridworld mdp
         rather than a mdp generating function.
@@ -114,7 +221,9 @@ class OvercookedEnv(object):
             horizon=horizon,
             mlam_params=mlam_params,
             info_level=info_level,
-            num_mdp=1
+            num_mdp=1,
+            event_level=event_level,
+            obs_cache_max_bytes=obs_cache_max_bytes
         )
 
 
@@ -133,6 +242,8 @@ class OvercookedEnv(object):
             "start_state_fn": self.start_state_fn,
             "horizon": self.horizon,
             "info_level": self.info_level,
+            "event_level": self.event_level,
+            "obs_cache_max_bytes": self.obs_cache_max_bytes,
             "_variable_mdp": self.variable_mdp
         }
 
@@ -143,7 +254,9 @@ class OvercookedEnv(object):
             start_state_fn=self.start_state_fn,
             horizon=self.horizon,
             info_level=self.info_level,
-            num_mdp=self.num_mdp
+            num_mdp=self.num_mdp,
+            event_level=self.event_level,
+            obs_cache_max_bytes=self.obs_cache_max_bytes
         )
 
 
@@ -213,8 +326,8 @@ class OvercookedEnv(object):
             ep_length: length of rollout
         """
         assert not self.is_done()
-        if joint_agent_action_info is None: joint_agent_action_info = [{}, {}]
-        next_state, mdp_infos = self.mdp.get_state_transition(self.state, joint_action, display_phi, self.mp)
+        if joint_agent_action_info is None: joint_agent_action_info = [{} for _ in range(self.mdp.num_players)]
+        next_state, mdp_infos = self.mdp.get_state_transition(self.state, joint_action, display_phi, self.mp, self.event_level)
 
         # Update game_stats 
         self._update_game_stats(mdp_infos)
@@ -229,17 +342,141 @@ class OvercookedEnv(object):
         timestep_sparse_reward = sum(mdp_infos["sparse_reward_by_agent"])
         return (next_state, timestep_sparse_reward, done, env_info)
 
+    def step_n(self, joint_action_sequence):
+        """
+        Performs the joint actions of joint_action_sequence one after the other, until the sequence
+        runs out or the episode is done. Ticks in which the players change nothing, so that only
+        the cooking soups progress, are skipped over analytically (see OvercookedGridworld.fast_forward).
+        The final state, cumulative rewards and game_stats are the same as if `step` was called
+        for every joint action.
+
+        Returns (next_state, sparse reward, done, env_info), where the rewards are summed over the
+        ticks that were performed and env_info["num_steps"] is how many of them there were
+        """
+        start_timestep = self.state.timestep
+        sparse_r_by_agent = [0] * self.mdp.num_players
+        shaped_r_by_agent = [0] * self.mdp.num_players
+        # Joint action that was found to do nothing in the current state. It keeps doing nothing
+        # until the next soup is done
+        noop_joint_action = None
+        idx = 0
+        while idx < len(joint_action_sequence) and not self.is_done():
+            joint_action = joint_action_sequence[idx]
+
+            if joint_action == noop_joint_action or self.mdp.is_noop_joint_action(self.state, joint_action):
+                run_length = 1
+                while idx + run_length < len(joint_action_sequence) and joint_action_sequence[idx + run_length] == joint_action:
+                    run_length += 1
+                num_steps = self._fast_forward(run_length)
+                idx += num_steps
+                noop_joint_action = joint_action if num_steps == run_length else None
+                continue
+
+            ticks_until_soup_ready = self.mdp.get_ticks_until_soup_ready(self.state)
+            prev_state = self.state
+            _, _, _, env_info = self.step(joint_action)
+            sparse_r_by_agent = [r + step_r for r, step_r in zip(sparse_r_by_agent, env_info["sparse_r_by_agent"])]
+            shaped_r_by_agent = [r + step_r for r, step_r in zip(shaped_r_by_agent, env_info["shaped_r_by_agent"])]
+            idx += 1
+
+            noop_joint_action = None
+            if ticks_until_soup_ready != 1 and self.mdp.only_cooking_progressed(prev_state, self.state) and \
+                    not any(env_info["sparse_r_by_agent"]) and not any(env_info["shaped_r_by_agent"]):
+                noop_joint_action = joint_action
+
+        return self._multi_step_output(start_timestep, sparse_r_by_agent, shaped_r_by_agent)
+
+    def advance_until_event(self, joint_action, max_steps=None):
+        """
+        Repeats joint_action until something other than cooking happens, a soup is done, the
+        episode is done or max_steps ticks have passed. If joint_action changes nothing in the
+        current state (e.g. all players stay), all ticks until then are skipped over at once.
+        Otherwise a single tick is performed.
+
+        Returns the same as `step_n`
+        """
+        start_timestep = self.state.timestep
+        sparse_r_by_agent = [0] * self.mdp.num_players
+        shaped_r_by_agent = [0] * self.mdp.num_players
+        if max_steps is None:
+            max_steps = self.horizon - self.state.timestep
+
+        if not self.mdp.is_noop_joint_action(self.state, joint_action):
+            prev_state = self.state
+            _, _, _, env_info = self.step(joint_action)
+            sparse_r_by_agent = [r + step_r for r, step_r in zip(sparse_r_by_agent, env_info["sparse_r_by_agent"])]
+            shaped_r_by_agent = [r + step_r for r, step_r in zip(shaped_r_by_agent, env_info["shaped_r_by_agent"])]
+            max_steps -= 1
+            # Interacts that did nothing (e.g. with an empty counter) are only found by trying them
+            if not self.mdp.only_cooking_progressed(prev_state, self.state) or any(env_info["sparse_r_by_agent"]) or \
+                    any(env_info["shaped_r_by_agent"]) or self.mdp.get_ticks_until_soup_ready(prev_state) == 1:
+                return self._multi_step_output(start_timestep, sparse_r_by_agent, shaped_r_by_agent)
+
+        if not self.is_done() and max_steps > 0:
+            self._fast_forward(max_steps)
+        return self._multi_step_output(start_timestep, sparse_r_by_agent, shaped_r_by_agent)
+
+    def _fast_forward(self, max_steps):
+        """
+        Skips up to max_steps ticks in which the players change nothing, stopping early once a
+        soup is done or the episode is over. Returns the number of ticks skipped
+        """
+        num_steps = min(max_steps, self.horizon - self.state.timestep)
+        ticks_until_soup_ready = self.mdp.get_ticks_until_soup_ready(self.state)
+        if ticks_until_soup_ready is not None:
+            num_steps = min(num_steps, ticks_until_soup_ready)
+        num_steps = int(num_steps)
+        self.state = self.mdp.fast_forward(self.state, num_steps)
+        return num_steps
+
+    def _multi_step_output(self, start_timestep, sparse_r_by_agent, shaped_r_by_agent):
+        env_info = {
+            "sparse_r_by_agent": sparse_r_by_agent,
+            "shaped_r_by_agent": shaped_r_by_agent,
+            "num_steps": self.state.timestep - start_timestep
+        }
+        done = self.is_done()
+        if done: self._add_episode_info(env_info)
+        return (self.state, sum(sparse_r_by_agent), done, env_info)
+
     def lossless_state_encoding_mdp(self, state):
         """
         Wrapper of the mdp's lossless_encoding
         """
-        return self.mdp.lossless_state_encoding(state, self.horizon)
+        if self.obs_cache is None:
+            return self.mdp.lossless_state_encoding(state, self.horizon)
+        return self.obs_cache.get(state, ("lossless", self._is_urgent(state)),
+                                  lambda s: self.mdp.lossless_state_encoding(s, self.horizon))
+
+    def lossless_state_encoding_sparse_mdp(self, state):
+        """
+        Wrapper of the mdp's lossless_state_encoding_sparse
+        """
+        if self.obs_cache is None:
+            return self.mdp.lossless_state_encoding_sparse(state, self.horizon)
+        return self.obs_cache.get(state, ("lossless_sparse", self._is_urgent(state)),
+                                  lambda s: self.mdp.lossless_state_encoding_sparse(s, self.horizon))
 
     def featurize_state_mdp(self, state):
         """
         Wrapper of the mdp's featurize_state
         """
-        return self.mdp.featurize_state(state, self.mlam, self.horizon)
+        if self.obs_cache is None:
+            return self.mdp.featurize_state(state, self.mlam, self.horizon)
+        return self.obs_cache.get(state, ("featurize",), lambda s: self.mdp.featurize_state(s, self.mlam, self.horizon))
+
+    def _is_urgent(self, state):
+        # The only part of the lossless encodings that depends on the timestep
+        return self.horizon - state.timestep < LOSSLESS_URGENCY_STEPS
+
+    def _set_mdp(self, mdp):
+        # Cached observations stay valid for as long as the mdp instance does (e.g. across resets of an env
+        # created with from_mdp)
+        if self.obs_cache is not None and mdp is not getattr(self, "mdp", None):
+            self.obs_cache.clear()
+        self.mdp = mdp
+        self._mlam = None
+        self._mp = None
 
     def reset(self, regen_mdp=True, outside_info={}):
         """
@@ -253,25 +490,82 @@ class OvercookedEnv(object):
                                  you need to have a "initial_info" dictionary with the same keys in the "env_params"
         """
         if regen_mdp:
-            self.mdp = self.mdp_generator_fn(outside_info)
-            self._mlam = None
-            self._mp = None
+            self._set_mdp(self.mdp_generator_fn(outside_info))
         if self.start_state_fn is None:
             self.state = self.mdp.get_standard_start_state()
         else:
             self.state = self.start_state_fn()
+        self._reset_game_stats()
 
+    def _reset_game_stats(self):
         events_dict = { k : [ [] for _ in range(self.mdp.num_players) ] for k in EVENT_TYPES }
         rewards_dict = {
             "cumulative_sparse_rewards_by_agent": np.array([0] * self.mdp.num_players),
             "cumulative_shaped_rewards_by_agent": np.array([0] * self.mdp.num_players)
         }
         self.game_stats = {**events_dict, **rewards_dict}
+        self._event_log = None
+
+    def _copy_game_stats(self):
+        return { k : [list(agent_events) for agent_events in v] if k in EVENT_TYPES else v.copy() for k, v in self.game_stats.items() }
 
     def is_done(self):
         """Whether the episode is over."""
         return self.state.timestep >= self.horizon or self.mdp.is_terminal(self.state)
 
+    def snapshot(self):
+        """
+        Captures the mdp, state (with its timestep) and game_stats of the environment in O(num_players), without
+        copying the mdp or planners, so that `restore` can go back to them. E.g. for lookahead search:
+
+        > token = env.snapshot()
+        > for joint_action in candidates:
+        >     env.step(joint_action)
+        >     ...
+        >     env.restore(token)
+        """
+        cumulative_rewards = { k : self.game_stats[k].copy() for k in self.CUMULATIVE_REWARD_KEYS }
+        return OvercookedEnvSnapshot(self.mdp, self.state, cumulative_rewards, self._event_log)
+
+    def restore(self, token):
+        """
+        Resets the environment to a `snapshot`. game_stats is updated in place, undoing and redoing only the
+        events that differ between the current event log and the snapshot's, so any snapshot can be restored
+        (not just ones taken earlier in the current episode).
+        """
+        if token.mdp is not self.mdp:
+            self._set_mdp(token.mdp)
+        self.state = token.state
+        for k, cumulative_reward in token.cumulative_rewards.items():
+            self.game_stats[k] = cumulative_reward.copy()
+        self._rewind_event_log(token.event_log)
+
+    def _rewind_event_log(self, target):
+        """
+        The event log is a linked list of (parent, length, event_type, agent_idx, timestep) nodes with one node
+        for every event appended to game_stats, so snapshots can share it. Rewinding pops the events of the
+        current log up to the common ancestor with `target` from game_stats and appends those of `target`
+        """
+        log_len = lambda node: 0 if node is None else node[1]
+        current, redo, self._event_log = self._event_log, [], target
+        while log_len(current) > log_len(target):
+            current = self._pop_event(current)
+        while log_len(target) > log_len(current):
+            redo.append(target)
+            target = target[0]
+        while current is not target:
+            current = self._pop_event(current)
+            redo.append(target)
+            target = target[0]
+        for node in reversed(redo):
+            _, _, event_type, agent_idx, timestep = node
+            self.game_stats[event_type][agent_idx].append(timestep)
+
+    def _pop_event(self, node):
+        _, _, event_type, agent_idx, _ = node
+        self.game_stats[event_type][agent_idx].pop()
+        return node[0]
+
     def potential(self, mlam, state=None, gamma=0.99):
         """
         Return the potential of the environment's current state, if no state is provided
@@ -318,12 +612,12 @@ class OvercookedEnv(object):
         self.game_stats["cumulative_sparse_rewards_by_agent"] += np.array(infos["sparse_reward_by_agent"])
         self.game_stats["cumulative_shaped_rewards_by_agent"] += np.array(infos["shaped_reward_by_agent"])
 
-        for event_type, bool_list_by_agent in infos["event_infos"].items():
-            # For each event type, store the timestep if it occurred
-            event_occurred_by_idx = [int(x) for x in bool_list_by_agent]
-            for idx, event_by_agent in enumerate(event_occurred_by_idx):
-                if event_by_agent:
-                    self.game_stats[event_type][idx].append(self.state.timestep)
+        # For each event type, store the timestep if it occurred (and log it for `restore`)
+        for idx, event_bitmask in enumerate(infos["event_bitmasks"]):
+            for event_type in EventInfos.iter_events(event_bitmask):
+                self.game_stats[event_type][idx].append(self.state.timestep)
+                log_len = 1 if self._event_log is None else self._event_log[1] + 1
+                self._event_log = (self._event_log, log_len, event_type, idx, self.state.timestep)
 
 
     ####################
@@ -361,15 +655,8 @@ class OvercookedEnv(object):
             print(self, file=f)
             f.close()
         while not done:
-            s_t = self.state
-
-            # Getting actions and action infos (optional) for both agents
-            joint_action_and_infos = agent_pair.joint_action(s_t)
-            a_t, a_info_t = zip(*joint_action_and_infos)
-            assert all(a in Action.ALL_ACTIONS for a in a_t)
-            assert all(type(a_info) is dict for a_info in a_info_t)
-
-            s_tp1, r_t, done, info = self.step(a_t, a_info_t, display_phi)
+            s_t, a_t, r_t, done, info = self._run_agents_step(agent_pair, display_phi)
+            s_tp1 = self.state
             trajectory.append((s_t, a_t, r_t, done, info))
 
             if display and self.state.timestep < display_until:
@@ -385,6 +672,95 @@ class OvercookedEnv(object):
         total_shaped = sum(self.game_stats["cumulative_shaped_rewards_by_agent"])
         return np.array(trajectory), self.state.timestep, total_sparse, total_shaped
 
+    def _run_agents_step(self, agent_pair, display_phi=False):
+        """Steps the environment with the joint action of agent_pair, returning (s_t, a_t, r_t, done_t, info_t)"""
+        s_t = self.state
+
+        # Getting actions and action infos (optional) for both agents
+        joint_action_and_infos = agent_pair.joint_action(s_t)
+        a_t, a_info_t = zip(*joint_action_and_infos)
+        assert all(a in Action.ALL_ACTIONS for a in a_t)
+        assert all(type(a_info) is dict for a_info in a_info_t)
+
+        _, r_t, done, info = self.step(a_t, a_info_t, display_phi)
+        return s_t, a_t, r_t, done, info
+
+    def branch_rollouts(self, state, agent_pairs_or_seeds, horizon, agent_pair=None, include_final_state=False, metadata_fn=None):
+        """
+        Runs one branch of at most `horizon` steps from `state` for every entry of `agent_pairs_or_seeds`, and
+        returns the branches in the standard trajectories format (see get_rollouts), e.g. to re-run the end
+        of an episode with different partners. The environment and the global np.random state are left as they were.
+
+        state (OvercookedState or OvercookedEnvSnapshot): Where all branches start. Starting from a `snapshot`
+            taken during an episode shares its prefix (state and game_stats) between branches, so each branch
+            only costs its own steps and its episode info contains the game_stats of the whole episode.
+            OvercookedStates start with empty game_stats at their timestep
+        agent_pairs_or_seeds (list): AgentGroups to run branches with, or ints, which run a branch with
+            `agent_pair` after seeding np.random with them (e.g. to resample the actions of stochastic agents)
+        horizon (int): The maximum length of the branches, which also end when the environment is done
+
+        Branch returns and lengths only count the steps of the branch, and the last done of every branch is True.
+        """
+        metadata_fn = (lambda x: {}) if metadata_fn is None else metadata_fn
+        original_token = self.snapshot()
+        if isinstance(state, OvercookedEnvSnapshot):
+            branch_token = state
+        else:
+            self.state = state
+            self._reset_game_stats()
+            branch_token = self.snapshot()
+
+        trajectories = { k:[] for k in self.DEFAULT_TRAJ_KEYS }
+        # Seeded branches reseed np.random, the global random state is restored once all branches ran
+        random_state = np.random.get_state()
+        try:
+            for agent_pair_or_seed in agent_pairs_or_seeds:
+                self.restore(branch_token)
+                if isinstance(agent_pair_or_seed, AgentGroup):
+                    branch_agent_pair = agent_pair_or_seed
+                else:
+                    assert agent_pair is not None, "Seeded branches need an agent_pair"
+                    np.random.seed(agent_pair_or_seed)
+                    branch_agent_pair = agent_pair
+                branch_agent_pair.reset()
+                branch_agent_pair.set_mdp(self.mdp)
+
+                assert not self.is_done(), "Can't branch from a state where the environment is done"
+                trajectory, done = [], False
+                end_timestep = self.state.timestep + horizon
+                while not done:
+                    s_t, a_t, r_t, done, info = self._run_agents_step(branch_agent_pair)
+                    if self.state.timestep >= end_timestep and not done:
+                        done = True
+                        self._add_episode_info(info)
+                    if done:
+                        # Restoring other branches modifies game_stats in place
+                        info["episode"]["ep_game_stats"] = self._copy_game_stats()
+                    trajectory.append((s_t, a_t, r_t, done, info))
+                branch_length, branch_sparse = len(trajectory), sum(t[2] for t in trajectory)
+                if include_final_state:
+                    trajectory.append((self.state, (None,) * self.mdp.num_players, 0, True, None))
+
+                rollout_info = (np.array(trajectory), branch_length, branch_sparse)
+                obs, actions, rews, dones, infos = rollout_info[0].T
+                trajectories["ep_states"].append(obs)
+                trajectories["ep_actions"].append(actions)
+                trajectories["ep_rewards"].append(rews)
+                trajectories["ep_dones"].append(dones)
+                trajectories["ep_infos"].append(infos)
+                trajectories["ep_returns"].append(branch_sparse)
+                trajectories["ep_lengths"].append(branch_length)
+                trajectories["mdp_params"].append(self.mdp.mdp_params)
+                trajectories["env_params"].append(self.env_params)
+                trajectories["metadatas"].append(metadata_fn(rollout_info))
+        finally:
+            np.random.set_state(random_state)
+            self.restore(original_token)
+
+        trajectories = {k: np.array(v) for k, v in trajectories.items()}
+        trajectories["metadatas"] = append_dictionaries(trajectories["metadatas"])
+        return trajectories
+
     def get_rollouts(self, agent_pair, num_games, display=False, dir=None, final_state=False, display_phi=False,
                      display_until=np.Inf, metadata_fn=None, metadata_info_fn=None, info=True):
         """
@@ -564,9 +940,16 @@ class Overcooked(gym.Env):
     def _setup_observation_space(self):
         dummy_mdp = self.base_env.mdp
         dummy_state = dummy_mdp.get_standard_start_state()
-        obs_shape = self.featurize_fn(dummy_mdp, dummy_state)[0].shape
-        high = np.ones(obs_shape) * max(dummy_mdp.soup_cooking_time, dummy_mdp.num_items_for_soup, 5)
-        return gym.spaces.Box(high * 0, high, dtype=np.float32)
+        obs = self.featurize_fn(dummy_mdp, dummy_state)[0]
+        if obs.dtype == bool:
+            return gym.spaces.Box(np.zeros(obs.shape, dtype=bool), np.ones(obs.shape, dtype=bool), dtype=bool)
+        recipe_context = dummy_mdp.recipe_context
+        max_cook_time = max(recipe_context.recipe_time(recipe) for recipe in recipe_context.all_recipes)
+        high = np.ones(obs.shape) * max(max_cook_time, recipe_context.max_num_ingredients, 5)
+        # Compact observation types (e.g. lossless encodings with dtype=np.uint8) are declared as they are,
+        # wider ones as np.float32
+        dtype = obs.dtype if obs.dtype.itemsize < 8 else np.float32
+        return gym.spaces.Box(high * 0, high, dtype=dtype)
 
     def step(self, action):
         """
@@ -1,7 +1,7 @@
-import itertools, copy
+import itertools, copy, threading
 import numpy as np
-from functools import reduce
-from collections import defaultdict, Counter
+from collections import defaultdict, OrderedDict
+from collections.abc import Mapping
 from overcooked_ai_py.utils import pos_distance, read_layout_dict
 from overcooked_ai_py.mdp.actions import Action, Direction
 
@@ -21,49 +21,78 @@ class Recipe:
     ALL_RECIPES_CACHE = {}
     STR_REP = {'tomato': "†", 'onion': "ø"}
 
-    _computed = False
-    _configured = False
+    # Integer ids of every recipe allowed by some RecipeContext. Ids are handed out in order of recipe
+    # size, so a recipe has the same id in every context. `_id_successors` maps each id to the ids of
+    # the recipes obtained by adding one more ingredient
+    _RECIPE_IDS = {}
+    _id_recipes = []
+    _id_successors = []
+    _registry_lock = threading.Lock()
+
     _conf = {}
+    _context = None
     
     def __new__(cls, ingredients):
-        if not cls._configured:
-            raise ValueError("Recipe class must be configured before recipes can be created")
+        cls._check_ingredients(ingredients, cls.default_context.max_num_ingredients)
+        return cls._intern(ingredients)
+
+    @classmethod
+    def _check_ingredients(cls, ingredients, max_num_ingredients):
         # Some basic argument verification
         if not ingredients or not hasattr(ingredients, '__iter__') or len(ingredients) == 0:
             raise ValueError("Invalid input recipe. Must be ingredients iterable with non-zero length")
         for elem in ingredients:
             if not elem in cls.ALL_INGREDIENTS:
                 raise ValueError("Invalid ingredient: {0}. Recipe can only contain ingredients {1}".format(elem, cls.ALL_INGREDIENTS))
-        if not len(ingredients) <= cls.MAX_NUM_INGREDIENTS:
-            raise ValueError("Recipe of length {0} is invalid. Recipe can contain at most {1} ingredients".format(len(ingredients), cls.MAX_NUM_INGREDIENTS))
+        if not len(ingredients) <= max_num_ingredients:
+            raise ValueError("Recipe of length {0} is invalid. Recipe can contain at most {1} ingredients".format(len(ingredients), max_num_ingredients))
+
+    @classmethod
+    def _intern(cls, ingredients):
         key = hash(tuple(sorted(ingredients)))
         if key in cls.ALL_RECIPES_CACHE:
             return cls.ALL_RECIPES_CACHE[key]
-        cls.ALL_RECIPES_CACHE[key] = super(Recipe, cls).__new__(cls)
-        return cls.ALL_RECIPES_CACHE[key]
+        recipe = super(Recipe, cls).__new__(cls)
+        recipe._ingredients = tuple(sorted(ingredients))
+        recipe._id = cls._RECIPE_IDS[recipe._ingredients]
+        cls.ALL_RECIPES_CACHE[key] = recipe
+        return recipe
 
-    def __init__(self, ingredients):
-        self._ingredients = ingredients
+    @classmethod
+    def _register_recipes(cls, max_num_ingredients):
+        """Hands out ids to all recipes of up to `max_num_ingredients` ingredients that don't have one yet"""
+        with cls._registry_lock:
+            num_registered = len(cls._RECIPE_IDS)
+            for i in range(max_num_ingredients):
+                for ingredient_list in itertools.combinations_with_replacement(sorted(cls.ALL_INGREDIENTS), i + 1):
+                    if ingredient_list not in cls._RECIPE_IDS:
+                        cls._RECIPE_IDS[ingredient_list] = len(cls._RECIPE_IDS)
+                        cls._id_recipes.append(cls._intern(ingredient_list))
+            if len(cls._RECIPE_IDS) == num_registered:
+                return
+
+            id_successors = []
+            for ingredient_list in cls._RECIPE_IDS:
+                successors = {}
+                for ingredient in cls.ALL_INGREDIENTS:
+                    successor_ingredients = tuple(sorted(ingredient_list + (ingredient,)))
+                    if successor_ingredients in cls._RECIPE_IDS:
+                        successors[ingredient] = cls._RECIPE_IDS[successor_ingredients]
+                id_successors.append(successors)
+            cls._id_successors = id_successors
 
     def __getnewargs__(self):
         return (self._ingredients,)
 
     def __int__(self):
-        num_tomatoes = len([_ for _ in self.ingredients if _ == Recipe.TOMATO])
-        num_onions = len([_ for _ in self.ingredients if _ == Recipe.ONION])
-
-        mixed_mask = int(bool(num_tomatoes * num_onions))
-        mixed_shift = (Recipe.MAX_NUM_INGREDIENTS + 1)**len(Recipe.ALL_INGREDIENTS)
-        encoding = num_onions + (Recipe.MAX_NUM_INGREDIENTS + 1) * num_tomatoes
-
-        return mixed_mask * encoding * mixed_shift + encoding
+        return self.default_context.recipe_key(self)
 
     def __hash__(self):
-        return hash(self.ingredients)
+        return hash(self._ingredients)
 
     def __eq__(self, other):
-        # The ingredients property already returns sorted items, so equivalence check is sufficient
-        return self.ingredients == other.ingredients
+        # Recipes are cached, and the ingredients property already returns sorted items, so equivalence check is sufficient
+        return self is other or self.ingredients == other.ingredients
 
     def __ne__(self, other):
         return not self == other
@@ -94,14 +123,31 @@ class Recipe:
         return Recipe(ingredients_cpy)
 
     @classmethod
-    def _compute_all_recipes(cls):
-        for i in range(cls.MAX_NUM_INGREDIENTS):
-            for ingredient_list in itertools.combinations_with_replacement(cls.ALL_INGREDIENTS, i + 1):
-                cls(ingredient_list)
+    def from_id(cls, recipe_id):
+        return cls._id_recipes[recipe_id]
+
+    @classmethod
+    def id_of(cls, ingredients):
+        """Returns the id of the recipe made of the `ingredients` names, or None if there is no such recipe"""
+        return cls._RECIPE_IDS.get(tuple(sorted(ingredients)))
+
+    @classmethod
+    def id_with_ingredient(cls, recipe_id, ingredient):
+        """
+        Returns the id of the recipe obtained by adding `ingredient` to recipe `recipe_id`, or to no
+        ingredients at all if `recipe_id` is None
+        """
+        if recipe_id is None:
+            return cls._RECIPE_IDS.get((ingredient,))
+        return cls._id_successors[recipe_id].get(ingredient)
+
+    @property
+    def id(self):
+        return self._id
 
     @property
     def ingredients(self):
-        return tuple(sorted(self._ingredients))
+        return self._ingredients
 
     @ingredients.setter
     def ingredients(self, _):
@@ -109,27 +155,13 @@ class Recipe:
 
     @property
     def value(self):
-        if self._delivery_reward:
-            return self._delivery_reward
-        if self._value_mapping and self in self._value_mapping:
-            return self._value_mapping[self]
-        if self._onion_value and self._tomato_value:
-            num_onions = len([ingredient for ingredient in self.ingredients if ingredient == self.ONION])
-            num_tomatoes = len([ingredient for ingredient in self.ingredients if ingredient == self.TOMATO])
-            return self._tomato_value * num_tomatoes + self._onion_value * num_onions
-        return 20
+        """Value of the recipe in the default RecipeContext, see `Recipe.configure`"""
+        return self.default_context.recipe_value(self)
 
     @property
     def time(self):
-        if self._cook_time:
-            return self._cook_time
-        if self._time_mapping and self in self._time_mapping:
-            return self._time_mapping[self]
-        if self._onion_time and self._tomato_time:
-            num_onions = len([ingredient for ingredient in self.ingredients if ingredient == self.ONION])
-            num_tomatoes = len([ingredient for ingredient in self.ingredients if ingredient == self.TOMATO])
-            return self._onion_time * num_onions + self._tomato_time * num_tomatoes
-        return 20
+        """Cook time of the recipe in the default RecipeContext, see `Recipe.configure`"""
+        return self.default_context.recipe_time(self)
 
     def to_dict(self):
         return { 'ingredients' : self.ingredients }
@@ -139,44 +171,95 @@ class Recipe:
         Return all "neighbor" recipes to this recipe. A neighbor recipe is one that can be obtained
         by adding exactly one ingredient to the current recipe
         """
-        neighbors = []
-        if len(self.ingredients) == self.MAX_NUM_INGREDIENTS:
-            return neighbors
-        for ingredient in self.ALL_INGREDIENTS:
-            new_ingredients = [*self.ingredients, ingredient]
-            new_recipe = Recipe(new_ingredients)
-            neighbors.append(new_recipe)
-        return neighbors
+        return self.default_context.neighbors(self)
 
     @classproperty
     def ALL_RECIPES(cls):
-        if not cls._computed:
-            cls._compute_all_recipes()
-            cls._computed = True
-        return set(cls.ALL_RECIPES_CACHE.values())
+        return set(cls.default_context.all_recipes)
 
     @classproperty
     def configuration(cls):
-        if not cls._configured:
-            raise ValueError("Recipe class not yet configured")
-        return cls._conf
+        return cls.default_context.conf
+
+    @classproperty
+    def default_context(cls):
+        # OvercookedGridworlds never change the default context, it is only set by `configure`
+        if cls._context is None:
+            cls.configure({})
+        return cls._context
 
     @classmethod
     def configure(cls, conf):
-        cls._conf = conf
-        cls._configured = True
-        cls._computed = False
-        cls.MAX_NUM_INGREDIENTS = conf.get('max_num_ingredients', 3)
-
-        cls._cook_time = None
-        cls._delivery_reward = None
-        cls._value_mapping = None
-        cls._time_mapping = None
-        cls._onion_value = None
-        cls._onion_time = None
-        cls._tomato_value = None
-        cls._tomato_time = None
+        """
+        Sets up the default RecipeContext from `conf`, which is used by Recipes, soups and states that
+        aren't given a context of their own (an empty configuration until this is called). Returns the
+        new context
+        """
+        context = RecipeContext(conf)
+        cls.set_default_context(context)
+        return context
+
+    @classmethod
+    def set_default_context(cls, context):
+        cls._context = context
+        cls._conf = context.conf
+        cls.MAX_NUM_INGREDIENTS = context.max_num_ingredients
+
+        # Kept for code that reads the configuration of the default context from the class
+        cls._cook_time = context.cook_time
+        cls._delivery_reward = context.delivery_reward
+        cls._value_mapping = context.value_mapping
+        cls._time_mapping = context.time_mapping
+        cls._onion_value = context.onion_value
+        cls._onion_time = context.onion_time
+        cls._tomato_value = context.tomato_value
+        cls._tomato_time = context.tomato_time
+    
+    @classmethod
+    def generate_random_recipes(cls, n=1, min_size=2, max_size=3, ingredients=None, recipes=None, unique=True, recipe_context=None):
+        """
+        n (int): how many recipes generate
+        min_size (int): min generated recipe size
+        max_size (int): max generated recipe size
+        ingredients (list(str)): list of ingredients used for generating recipes (default is cls.ALL_INGREDIENTS)
+        recipes (list(Recipe)): list of recipes to choose from (default is all recipes of `recipe_context`)
+        unique (bool): if all recipes are unique (without repeats)
+        recipe_context (RecipeContext): context that limits the recipe size (default is the default context)
+        """
+        recipe_context = recipe_context or cls.default_context
+        if recipes is None: recipes = recipe_context.all_recipes
+
+        ingredients = set(ingredients or cls.ALL_INGREDIENTS)
+        choice_replace = not(unique)
+
+        assert 1 <= min_size <= max_size <= recipe_context.max_num_ingredients
+        assert all(ingredient in cls.ALL_INGREDIENTS for ingredient in ingredients)
+
+        def valid_size(r):
+            return min_size <= len(r.ingredients) <= max_size
 
+        def valid_ingredients(r):
+            return all(i in ingredients for i in r.ingredients)
+        
+        relevant_recipes = [r for r in recipes if valid_size(r) and valid_ingredients(r)]
+        assert choice_replace or (n <= len(relevant_recipes))
+        return np.random.choice(relevant_recipes, n, replace=choice_replace)
+
+    @classmethod
+    def from_dict(cls, obj_dict):
+        return cls(**obj_dict)
+
+
+class RecipeContext(object):
+    """
+    A recipe configuration (values, cook times and the maximum number of ingredients), with the value,
+    cook time, ordering key and neighbors of every recipe precomputed into tables indexed by recipe id.
+
+    Every OvercookedGridworld owns its own context and passes it to the soups and states it creates, so
+    that MDPs with different recipe settings can be stepped side by side in one process.
+    """
+
+    def __init__(self, conf):
         ## Basic checks for validity ##
 
         # Mutual Exclusion
@@ -209,74 +292,119 @@ class Recipe:
             if not len(conf['all_orders']) == len(conf['recipe_times']):
                 raise ValueError("Number of recipes in 'all_orders' must be the same as number in 'recipe_times")
 
-        
         ## Conifgure ##
 
-        if 'cook_time' in conf:
-            cls._cook_time = conf['cook_time']
+        self.conf = conf
+        self.max_num_ingredients = conf.get('max_num_ingredients', 3)
+        Recipe._register_recipes(self.max_num_ingredients)
 
-        if 'delivery_reward' in conf:
-            cls._delivery_reward = conf['delivery_reward']
+        self.cook_time = conf.get('cook_time')
+        self.delivery_reward = conf.get('delivery_reward')
+        self.tomato_time = conf.get('tomato_time')
+        self.onion_time = conf.get('onion_time')
+        self.tomato_value = conf.get('tomato_value')
+        self.onion_value = conf.get('onion_value')
+        self.value_mapping = None
+        self.time_mapping = None
 
         if 'recipe_values' in conf:
-            cls._value_mapping = {
-                cls.from_dict(recipe) : value for (recipe, value) in zip(conf['all_orders'], conf['recipe_values'])
+            self.value_mapping = {
+                self.recipe_from_dict(recipe) : value for (recipe, value) in zip(conf['all_orders'], conf['recipe_values'])
             }
 
         if 'recipe_times' in conf:
-            cls._time_mapping = {
-                cls.from_dict(recipe) : time for (recipe, time) in zip(conf['all_orders'], conf['recipe_times'])
+            self.time_mapping = {
+                self.recipe_from_dict(recipe) : time for (recipe, time) in zip(conf['all_orders'], conf['recipe_times'])
             }
 
-        if 'tomato_time' in conf:
-            cls._tomato_time = conf['tomato_time']
-
-        if 'onion_time' in conf:
-            cls._onion_time = conf['onion_time']
-
-        if 'tomato_value' in conf:
-            cls._tomato_value = conf['tomato_value']
+        self.all_recipes = tuple(
+            recipe for recipe in Recipe._id_recipes if len(recipe.ingredients) <= self.max_num_ingredients
+        )
+        self._build_tables()
 
-        if 'onion_value' in conf:
-            cls._onion_value = conf['onion_value']
-    
-    @classmethod
-    def generate_random_recipes(cls, n=1, min_size=2, max_size=3, ingredients=None, recipes=None, unique=True):
+    def _build_tables(self):
         """
-        n (int): how many recipes generate
-        min_size (int): min generated recipe size
-        max_size (int): max generated recipe size
-        ingredients (list(str)): list of ingredients used for generating recipes (default is cls.ALL_INGREDIENTS)
-        recipes (list(Recipe)): list of recipes to choose from (default is cls.ALL_RECIPES)
-        unique (bool): if all recipes are unique (without repeats)
+        Precomputes value, cook time, ordering key and neighbors of all recipes that have an id. The tables are
+        built aside and swapped in at once, so that concurrent readers always see complete tables
         """
-        if recipes is None: recipes = cls.ALL_RECIPES
+        with Recipe._registry_lock:
+            id_recipes, id_successors = list(Recipe._id_recipes), Recipe._id_successors
+        values, times, keys, neighbors = [], [], [], []
+        for recipe in id_recipes:
+            num_onions = recipe.ingredients.count(Recipe.ONION)
+            num_tomatoes = recipe.ingredients.count(Recipe.TOMATO)
+
+            if self.delivery_reward:
+                value = self.delivery_reward
+            elif self.value_mapping and recipe in self.value_mapping:
+                value = self.value_mapping[recipe]
+            elif self.onion_value and self.tomato_value:
+                value = self.tomato_value * num_tomatoes + self.onion_value * num_onions
+            else:
+                value = 20
+            values.append(value)
+
+            if self.cook_time:
+                time = self.cook_time
+            elif self.time_mapping and recipe in self.time_mapping:
+                time = self.time_mapping[recipe]
+            elif self.onion_time and self.tomato_time:
+                time = self.onion_time * num_onions + self.tomato_time * num_tomatoes
+            else:
+                time = 20
+            times.append(time)
 
-        ingredients = set(ingredients or cls.ALL_INGREDIENTS)
-        choice_replace = not(unique)
+            mixed_mask = int(bool(num_tomatoes * num_onions))
+            mixed_shift = (self.max_num_ingredients + 1)**len(Recipe.ALL_INGREDIENTS)
+            encoding = num_onions + (self.max_num_ingredients + 1) * num_tomatoes
+            keys.append(mixed_mask * encoding * mixed_shift + encoding)
 
-        assert 1 <= min_size <= max_size <= cls.MAX_NUM_INGREDIENTS
-        assert all(ingredient in cls.ALL_INGREDIENTS for ingredient in ingredients)
+            if len(recipe.ingredients) >= self.max_num_ingredients:
+                neighbors.append([])
+            else:
+                neighbors.append([id_recipes[successor_id] for successor_id in id_successors[recipe.id].values()])
+        self._tables = (values, times, keys, neighbors)
+        return self._tables
 
-        def valid_size(r):
-            return min_size <= len(r.ingredients) <= max_size
+    def _table_entry(self, table_idx, recipe_id):
+        tables = self._tables
+        # Recipes registered by contexts created after this one aren't in the tables yet
+        if recipe_id >= len(tables[table_idx]):
+            tables = self._build_tables()
+        return tables[table_idx][recipe_id]
 
-        def valid_ingredients(r):
-            return all(i in ingredients for i in r.ingredients)
-        
-        relevant_recipes = [r for r in recipes if valid_size(r) and valid_ingredients(r)]
-        assert choice_replace or (n <= len(relevant_recipes))
-        return np.random.choice(relevant_recipes, n, replace=choice_replace)
+    def recipe(self, ingredients):
+        """Returns the Recipe made of `ingredients`, raising a ValueError if it isn't valid in this context"""
+        Recipe._check_ingredients(ingredients, self.max_num_ingredients)
+        return Recipe._intern(ingredients)
+
+    def recipe_from_dict(self, recipe_dict):
+        return self.recipe(recipe_dict['ingredients'])
+
+    def recipe_value(self, recipe):
+        return self._table_entry(0, recipe.id)
+
+    def recipe_time(self, recipe):
+        return self._table_entry(1, recipe.id)
+
+    def recipe_time_by_id(self, recipe_id):
+        return self._table_entry(1, recipe_id)
+
+    def recipe_key(self, recipe):
+        return self._table_entry(2, recipe.id)
+
+    def neighbors(self, recipe):
+        return list(self._table_entry(3, recipe.id))
 
-    @classmethod
-    def from_dict(cls, obj_dict):
-        return cls(**obj_dict)
-        
 
 class ObjectState(object):
     """
     State of an object in OvercookedGridworld.
+
+    Objects shared between OvercookedStates are frozen (see `OvercookedState.persistent_copy`) and
+    raise a ValueError when modified.
     """
+    __slots__ = ('name', '_position', '_frozen')
 
     def __init__(self, name, position, **kwargs):
         """
@@ -285,6 +413,7 @@ class ObjectState(object):
         """
         self.name = name
         self._position = tuple(position)
+        self._frozen = False
 
     @property
     def position(self):
@@ -292,8 +421,21 @@ class ObjectState(object):
 
     @position.setter
     def position(self, new_pos):
+        if new_pos != self._position:
+            self._check_not_frozen()
         self._position = new_pos
 
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def freeze(self):
+        self._frozen = True
+
+    def _check_not_frozen(self):
+        if self._frozen:
+            raise ValueError("Cannot modify {} as it is shared between states, modify a copy from OvercookedState.mutable_object instead".format(self))
+
     def is_valid(self):
         return self.name in ['onion', 'tomato', 'dish']
 
@@ -325,8 +467,9 @@ class ObjectState(object):
 
 
 class SoupState(ObjectState):
+    __slots__ = ('_ingredients', '_cooking_tick', '_recipe_id', '_recipe_context')
 
-    def __init__(self, position, ingredients=[], cooking_tick=-1, **kwargs):
+    def __init__(self, position, ingredients=[], cooking_tick=-1, recipe_context=None, **kwargs):
         """
         Represents a soup object. An object becomes a soup the instant it is placed in a pot. The
         soup's recipe is a list of ingredient names used to create it. A soup's recipe is undetermined
@@ -335,14 +478,17 @@ class SoupState(ObjectState):
         position (tupe): (x, y) coordinates in the grid
         ingrdients (list(ObjectState)): Objects that have been used to cook this soup. Determiens @property recipe
         cooking (int): How long the soup has been cooking for. -1 means cooking hasn't started yet
+        recipe_context (RecipeContext): Determines cook times and soup capacity, defaults to Recipe.default_context
         """
         super(SoupState, self).__init__("soup", position)
         self._ingredients = ingredients
         self._cooking_tick = cooking_tick
-        self._recipe = None
+        self._recipe_id = None
+        self._recipe_context = recipe_context or Recipe.default_context
 
     def __eq__(self, other):
         return isinstance(other, SoupState) and self.name == other.name and self.position == other.position and self._cooking_tick == other._cooking_tick and \
+            len(self._ingredients) == len(other._ingredients) and \
             all([this_i == other_i for this_i, other_i in zip(self._ingredients, other._ingredients)])
 
     def __hash__(self):
@@ -367,6 +513,8 @@ class SoupState(ObjectState):
 
     @ObjectState.position.setter
     def position(self, new_pos):
+        if new_pos != self._position:
+            self._check_not_frozen()
         self._position = new_pos
         for ingredient in self._ingredients:
             ingredient.position = new_pos
@@ -381,19 +529,33 @@ class SoupState(ObjectState):
 
     @property
     def recipe(self):
-        if self.is_idle:
+        if self._cooking_tick < 0:
             raise ValueError("Recipe is not determined until soup begins cooking")
-        if not self._recipe:
-            self._recipe = Recipe(self.ingredients)
-        return self._recipe
+        return Recipe.from_id(self.recipe_id)
+
+    @property
+    def recipe_id(self):
+        """
+        Id of the recipe made of the current ingredients (see Recipe.configure), None if there are
+        no ingredients. Also defined for soups that haven't started cooking yet
+        """
+        if self._recipe_id is None and self._ingredients:
+            self._recipe_id = Recipe.id_of(self.ingredients)
+        return self._recipe_id
+
+    @property
+    def recipe_context(self):
+        return self._recipe_context
 
     @property
     def value(self):
-        return self.recipe.value
+        return self._recipe_context.recipe_value(self.recipe)
 
     @property
     def cook_time(self):
-        return self.recipe.time
+        if self._cooking_tick < 0:
+            raise ValueError("Recipe is not determined until soup begins cooking")
+        return self._recipe_context.recipe_time_by_id(self.recipe_id)
 
     @property
     def cook_time_remaining(self):
@@ -401,9 +563,9 @@ class SoupState(ObjectState):
 
     @property
     def is_ready(self):
-        if self.is_idle:
+        if self._cooking_tick < 0:
             return False
-        return self._cooking_tick >= self.cook_time
+        return self._cooking_tick >= self._recipe_context.recipe_time_by_id(self.recipe_id)
 
     @property
     def is_idle(self):
@@ -411,18 +573,19 @@ class SoupState(ObjectState):
 
     @property
     def is_full(self):
-        return not self.is_idle or len(self.ingredients) == Recipe.MAX_NUM_INGREDIENTS
+        return not self.is_idle or len(self._ingredients) == self._recipe_context.max_num_ingredients
 
     def is_valid(self):
         if not all([ingredient.position == self.position for ingredient in self._ingredients]):
             return False
-        if len(self.ingredients) > Recipe.MAX_NUM_INGREDIENTS:
+        if len(self.ingredients) > self._recipe_context.max_num_ingredients:
             return False
         return True
 
     def auto_finish(self):
         if len(self.ingredients) == 0:
             raise ValueError("Cannot finish soup with no ingredients")
+        self._check_not_frozen()
         self._cooking_tick = 0
         self._cooking_tick = self.cook_time
 
@@ -431,7 +594,10 @@ class SoupState(ObjectState):
             raise ValueError("Invalid ingredient")
         if self.is_full:
             raise ValueError("Reached maximum number of ingredients in recipe")
+        self._check_not_frozen()
         ingredient.position = self.position
+        if self._recipe_id is not None or not self._ingredients:
+            self._recipe_id = Recipe.id_with_ingredient(self._recipe_id, ingredient.name)
         self._ingredients.append(ingredient)
 
     def add_ingredient_from_str(self, ingredient_str):
@@ -443,6 +609,8 @@ class SoupState(ObjectState):
             raise ValueError("Cannot remove an ingredient from this soup at this time")
         if len(self._ingredients) == 0:
             raise ValueError("No ingredient to remove")
+        self._check_not_frozen()
+        self._recipe_id = None
         return self._ingredients.pop()
 
     def begin_cooking(self):
@@ -450,17 +618,22 @@ class SoupState(ObjectState):
             raise ValueError("Cannot begin cooking this soup at this time")
         if len(self.ingredients) == 0:
             raise ValueError("Must add at least one ingredient to soup before you can begin cooking")
+        self._check_not_frozen()
         self._cooking_tick = 0
 
-    def cook(self):
+    def cook(self, num_ticks=1):
+        """Advances the cook tick by num_ticks, stopping once the soup is done"""
         if self.is_idle:
             raise ValueError("Must begin cooking before advancing cook tick")
         if self.is_ready:
             raise ValueError("Cannot cook a soup that is already done")
-        self._cooking_tick += 1
+        self._check_not_frozen()
+        self._cooking_tick = min(self._cooking_tick + num_ticks, self.cook_time)
 
     def deepcopy(self):
-        return SoupState(self.position, [ingredient.deepcopy() for ingredient in self._ingredients], self._cooking_tick)
+        soup = SoupState(self.position, [ingredient.deepcopy() for ingredient in self._ingredients], self._cooking_tick, self._recipe_context)
+        soup._recipe_id = self._recipe_id
+        return soup
     
     def to_dict(self):
         info_dict = super(SoupState, self).to_dict()
@@ -478,7 +651,7 @@ class SoupState(ObjectState):
         return info_dict
 
     @classmethod
-    def from_dict(cls, obj_dict):
+    def from_dict(cls, obj_dict, recipe_context=None):
         obj_dict = copy.deepcopy(obj_dict)
         if obj_dict['name'] != 'soup':
             return super(SoupState, cls).from_dict(obj_dict)
@@ -489,19 +662,20 @@ class SoupState(ObjectState):
             cooking_tick = -1 if time == 0 else time
             finished = time >= 20
             if ingredient == Recipe.TOMATO:
-                return SoupState.get_soup(obj_dict['position'], num_tomatoes=num_ingredient, cooking_tick=cooking_tick, finished=finished)
+                return SoupState.get_soup(obj_dict['position'], num_tomatoes=num_ingredient, cooking_tick=cooking_tick, finished=finished, recipe_context=recipe_context)
             else:
-                return SoupState.get_soup(obj_dict['position'], num_onions=num_ingredient, cooking_tick=cooking_tick, finished=finished)
+                return SoupState.get_soup(obj_dict['position'], num_onions=num_ingredient, cooking_tick=cooking_tick, finished=finished, recipe_context=recipe_context)
 
         ingredients_objs = [ObjectState.from_dict(ing_dict) for ing_dict in obj_dict['_ingredients']]
         obj_dict['ingredients'] = ingredients_objs
-        return cls(**obj_dict)
+        return cls(recipe_context=recipe_context, **obj_dict)
 
     @classmethod
-    def get_soup(cls, position, num_onions=1, num_tomatoes=0, cooking_tick=-1, finished=False, **kwargs):
+    def get_soup(cls, position, num_onions=1, num_tomatoes=0, cooking_tick=-1, finished=False, recipe_context=None, **kwargs):
+        recipe_context = recipe_context or Recipe.default_context
         if num_onions < 0 or num_tomatoes < 0:
             raise ValueError("Number of active ingredients must be positive")
-        if num_onions + num_tomatoes > Recipe.MAX_NUM_INGREDIENTS:
+        if num_onions + num_tomatoes > recipe_context.max_num_ingredients:
             raise ValueError("Too many ingredients specified for this soup")
         if cooking_tick >= 0 and num_tomatoes + num_onions == 0:
             raise ValueError("_cooking_tick must be -1 for empty soup")
@@ -510,7 +684,7 @@ class SoupState(ObjectState):
         onions = [ObjectState(Recipe.ONION, position) for _ in range(num_onions)]
         tomatoes = [ObjectState(Recipe.TOMATO, position) for _ in range(num_tomatoes)]
         ingredients = onions + tomatoes
-        soup = cls(position, ingredients, cooking_tick)
+        soup = cls(position, ingredients, cooking_tick, recipe_context)
         if finished:
             soup.auto_finish()
         return soup
@@ -524,11 +698,17 @@ class PlayerState(object):
     orientation: Direction.NORTH/SOUTH/EAST/WEST representing orientation.
     held_object: ObjectState representing the object held by the player, or
                  None if there is no such object.
+
+    Players shared between OvercookedStates are frozen (see `OvercookedState.persistent_copy`), and
+    `set_object`, `remove_object` and `update_pos_and_or` raise a ValueError on them.
     """
+    __slots__ = ('position', 'orientation', 'held_object', '_frozen')
+
     def __init__(self, position, orientation, held_object=None):
         self.position = tuple(position)
         self.orientation = tuple(orientation)
         self.held_object = held_object
+        self._frozen = False
 
         assert self.orientation in Direction.ALL_DIRECTIONS
         if self.held_object is not None:
@@ -546,18 +726,34 @@ class PlayerState(object):
         assert self.has_object()
         return self.held_object
 
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def freeze(self):
+        self._frozen = True
+        if self.held_object is not None:
+            self.held_object.freeze()
+
+    def _check_not_frozen(self):
+        if self._frozen:
+            raise ValueError("Cannot modify player {} as it is shared between states, modify a copy from OvercookedState.mutable_player instead".format(self))
+
     def set_object(self, obj):
         assert not self.has_object()
+        self._check_not_frozen()
         obj.position = self.position
         self.held_object = obj
  
     def remove_object(self):
         assert self.has_object()
+        self._check_not_frozen()
         obj = self.held_object
         self.held_object = None
         return obj
     
     def update_pos_and_or(self, new_position, new_orientation):
+        self._check_not_frozen()
         self.position = new_position
         self.orientation = new_orientation
         if self.has_object():
@@ -588,41 +784,83 @@ class PlayerState(object):
         }
 
     @staticmethod
-    def from_dict(player_dict):
+    def from_dict(player_dict, recipe_context=None):
         player_dict = copy.deepcopy(player_dict)
         held_obj = player_dict["held_object"]
         if held_obj is not None:
-            player_dict["held_object"] = SoupState.from_dict(held_obj)
+            player_dict["held_object"] = SoupState.from_dict(held_obj, recipe_context)
         return PlayerState(**player_dict)
 
 
 class OvercookedState(object):
-    """A state in OvercookedGridworld."""
-    def __init__(self, players, objects, bonus_orders=[], all_orders=[], timestep=0, **kwargs):
+    """
+    A state in OvercookedGridworld.
+
+    States returned by OvercookedGridworld.get_state_transition are persistent: they share every
+    PlayerState and ObjectState that the transition did not change with the state they were derived
+    from. Shared players and objects are frozen, so modifying them in place raises a ValueError
+    instead of silently changing (and invalidating the cached hash of) other states. Go through
+    `mutable_player`, `mutable_object` and `remove_object` (which copy frozen players and objects
+    before handing them out) or `deepcopy` to modify a state.
+
+    The (timestep independent) hash of a state is cached. It is the XOR of the hashes of the players,
+    objects and orders, so that the hash of a successor state can be derived from the one of its
+    parent by only rehashing what the transition changed.
+
+    The first query of the objects by type or of soup statuses (see `soup_status`) builds an index of
+    the non-held objects, which is then kept up to date by `add_object`, `remove_object` and
+    `mutable_object` and carried over to persistent copies, so later queries don't rescan all objects.
+    This is why the `objects` dict must not be written to directly.
+    """
+    __slots__ = ('_players', 'objects', '_bonus_orders', '_all_orders', 'timestep', '_owned', '_hash',
+                 '_objects_by_type', '_soup_statuses', '_volatile_positions')
+
+    # Sorted order tuples shared by all states with the same orders, see `_intern_orders`. At most
+    # ORDERS_CACHE_SIZE of them are kept, least recently used first out
+    ORDERS_CACHE_SIZE = 1024
+    _ORDERS_CACHE = OrderedDict()
+    _INTERNED_ORDERS_IDS = set()
+    _orders_cache_lock = threading.Lock()
+
+    def __init__(self, players, objects, bonus_orders=[], all_orders=[], timestep=0, recipe_context=None, **kwargs):
         """
         players (list(PlayerState)): Currently active PlayerStates (index corresponds to number)
         objects (dict({tuple:list(ObjectState)})):  Dictionary mapping positions (x, y) to ObjectStates. 
             NOTE: Does NOT include objects held by players (they are in 
             the PlayerState objects).
         bonus_orders (list(dict)):   Current orders worth a bonus
-        all_orders (list(dict)):     Current orders allowed at all
+        all_orders (list(dict)):     Current orders allowed at all, defaults to all possible recipes if empty
         timestep (int):  The current timestep of the state
+        recipe_context (RecipeContext): Context the orders are created in, defaults to Recipe.default_context
 
         """
-        bonus_orders = [Recipe.from_dict(order) for order in bonus_orders]
-        all_orders = [Recipe.from_dict(order) for order in all_orders]
         for pos, obj in objects.items():
             assert obj.position == pos
+        recipe_context = recipe_context or Recipe.default_context
         self.players = tuple(players)
         self.objects = objects
-        self._bonus_orders = bonus_orders
-        self._all_orders = all_orders
+        self._bonus_orders = self._intern_orders(bonus_orders, recipe_context)
+        self._all_orders = self._intern_orders(all_orders or recipe_context.all_recipes, recipe_context)
         self.timestep = timestep
+        self._owned = None
+        self._hash = None
+        self._objects_by_type = None
+        self._soup_statuses = None
+        self._volatile_positions = None
 
         assert len(set(self.bonus_orders)) == len(self.bonus_orders), "Bonus orders must not have duplicates"
         assert len(set(self.all_orders)) == len(self.all_orders), "All orders must not have duplicates"
         assert set(self.bonus_orders).issubset(set(self.all_orders)), "Bonus orders must be a subset of all orders"
 
+    @property
+    def players(self):
+        return self._players
+
+    @players.setter
+    def players(self, players):
+        self._players = players
+        self._hash = None
+
     @property
     def player_positions(self):
         return tuple([player.position for player in self.players])
@@ -643,9 +881,11 @@ class OvercookedState(object):
         for all objects in the environment, NOT including
         ones held by players.
         """
+        self._ensure_object_index()
         objects_by_type = defaultdict(list)
-        for _pos, obj in self.objects.items():
-            objects_by_type[obj.name].append(obj)
+        for name, objects in self._objects_by_type.items():
+            if objects:
+                objects_by_type[name] = list(objects.values())
         return objects_by_type
 
     @property
@@ -668,23 +908,106 @@ class OvercookedState(object):
         for all objects in the environment, including
         ones held by players.
         """
-        all_objs_by_type = self.unowned_objects_by_type.copy()
+        all_objs_by_type = self.unowned_objects_by_type
         for obj_type, player_objs in self.player_objects_by_type.items():
             all_objs_by_type[obj_type].extend(player_objs)
         return all_objs_by_type
 
     @property
     def all_objects_list(self):
-        all_objects_lists = list(self.all_objects_by_type.values()) + [[], []]
-        return reduce(lambda x, y: x + y, all_objects_lists)
+        """All objects in the environment, including ones held by players"""
+        all_objects = list(self.objects.values())
+        all_objects.extend(player.held_object for player in self.players if player.held_object is not None)
+        return all_objects
+
+    def soup_status(self, pos):
+        """
+        Returns the status of the (non-held) soup at `pos` as one of the buckets of
+        OvercookedGridworld.get_pot_states ('ready', 'cooking' or '{num ingredients}_items'),
+        or None if there is no soup at `pos`
+        """
+        self._ensure_object_index()
+        self._update_volatile_soup_statuses()
+        return self._soup_statuses.get(pos)
+
+    @property
+    def cooking_soup_positions(self):
+        """Positions of the non-held soups that are cooking but not ready yet"""
+        self._ensure_object_index()
+        self._update_volatile_soup_statuses()
+        return [pos for pos, status in self._soup_statuses.items() if status == 'cooking']
+
+    @staticmethod
+    def _get_soup_status(soup):
+        if soup.is_ready:
+            return 'ready'
+        elif soup.is_cooking:
+            return 'cooking'
+        return '{}_items'.format(len(soup._ingredients))
+
+    def _ensure_object_index(self):
+        if self._objects_by_type is not None:
+            return
+        self._objects_by_type = {}
+        self._soup_statuses = {}
+        self._volatile_positions = set()
+        for pos, obj in self.objects.items():
+            self._index_object(pos, obj)
+
+    def _index_object(self, pos, obj):
+        self._mutable_objects_of_type(obj.name)[pos] = obj
+        if obj.name == 'soup':
+            self._soup_statuses[pos] = self._get_soup_status(obj)
+
+    def _mutable_objects_of_type(self, name):
+        # Persistent copies share the per type dicts of the index until they write to them
+        objects = self._objects_by_type.get(name)
+        if objects is None or not self._owns(objects):
+            objects = {} if objects is None else objects.copy()
+            self._objects_by_type[name] = objects
+            if self._owned is not None:
+                self._owned.add(id(objects))
+        return objects
+
+    def _update_volatile_soup_statuses(self):
+        # Objects handed out by `mutable_object` can have changed since they were indexed
+        for pos in self._volatile_positions:
+            obj = self.objects.get(pos)
+            if obj is not None and obj.name == 'soup':
+                self._soup_statuses[pos] = self._get_soup_status(obj)
 
     @property
     def all_orders(self):
-        return sorted(self._all_orders) if self._all_orders else sorted(Recipe.ALL_RECIPES)
+        return self._all_orders
 
     @property
     def bonus_orders(self):
-        return sorted(self._bonus_orders)
+        return self._bonus_orders
+
+    @classmethod
+    def _intern_orders(cls, orders, recipe_context):
+        """
+        Returns `orders` (Recipes or recipe dicts) as a sorted tuple of Recipes. Orders never change
+        within an episode, so every state with the same orders gets the very same tuple (unless the
+        tuple was evicted from the cache in the meantime, then it is only equal)
+        """
+        # Ids only identify interned tuples while the cache keeps them alive, so they are evicted together.
+        # The caller holds a reference to `orders`, so its id can't be reused while this check runs unlocked
+        if id(orders) in cls._INTERNED_ORDERS_IDS:
+            return orders
+        orders = (order if isinstance(order, Recipe) else recipe_context.recipe_from_dict(order) for order in orders)
+        orders = tuple(sorted(orders, key=recipe_context.recipe_key))
+        with cls._orders_cache_lock:
+            interned = cls._ORDERS_CACHE.get(orders)
+            if interned is not None:
+                cls._ORDERS_CACHE.move_to_end(orders)
+                return interned
+            while cls._ORDERS_CACHE and len(cls._ORDERS_CACHE) >= cls.ORDERS_CACHE_SIZE:
+                _, evicted = cls._ORDERS_CACHE.popitem(last=False)
+                cls._INTERNED_ORDERS_IDS.discard(id(evicted))
+            cls._ORDERS_CACHE[orders] = orders
+            cls._INTERNED_ORDERS_IDS.add(id(orders))
+        return orders
 
     def has_object(self, pos):
         return pos in self.objects
@@ -700,60 +1023,194 @@ class OvercookedState(object):
         assert not self.has_object(pos)
         obj.position = pos
         self.objects[pos] = obj
+        self._hash = None
+        if self._owned is not None:
+            self._owned.add(id(obj))
+        if self._objects_by_type is not None:
+            self._index_object(pos, obj)
 
     def remove_object(self, pos):
+        """Removes the object at `pos` and returns it, copied first if it is shared with other states"""
         assert self.has_object(pos)
-        obj = self.objects[pos]
-        del self.objects[pos]
+        obj = self.objects.pop(pos)
+        self._hash = None
+        if self._objects_by_type is not None:
+            del self._mutable_objects_of_type(obj.name)[pos]
+            self._soup_statuses.pop(pos, None)
+            self._volatile_positions.discard(pos)
+        if not self._can_modify(obj):
+            obj = obj.deepcopy()
+        return obj
+
+    def mutable_player(self, player_idx):
+        """
+        Returns the PlayerState of player `player_idx`, replacing it with a copy first if it is
+        shared with other states, so that it can be modified in place
+        """
+        player = self.players[player_idx]
+        self._hash = None
+        if not self._can_modify(player):
+            player = player.deepcopy()
+            players = list(self.players)
+            players[player_idx] = player
+            self.players = tuple(players)
+            if self._owned is not None:
+                self._owned.add(id(player))
+        return player
+
+    def mutable_object(self, pos):
+        """
+        Returns the ObjectState at `pos`, replacing it with a copy first if it is shared with
+        other states, so that it can be modified in place
+        """
+        obj = self.get_object(pos)
+        self._hash = None
+        if not self._can_modify(obj):
+            obj = obj.deepcopy()
+            self.objects[pos] = obj
+            if self._owned is not None:
+                self._owned.add(id(obj))
+            if self._objects_by_type is not None:
+                self._mutable_objects_of_type(obj.name)[pos] = obj
+        if self._objects_by_type is not None:
+            self._volatile_positions.add(pos)
         return obj
 
+    def _owns(self, obj):
+        return self._owned is not None and id(obj) in self._owned
+
+    def _can_modify(self, obj):
+        return not obj.frozen and self._owns(obj)
+
     @classmethod
-    def from_players_pos_and_or(cls, players_pos_and_or, bonus_orders=[], all_orders=[]):
+    def from_players_pos_and_or(cls, players_pos_and_or, bonus_orders=[], all_orders=[], recipe_context=None):
         """
         Make a dummy OvercookedState with no objects based on the passed in player
         positions and orientations and order list
         """
         return cls(
             [PlayerState(*player_pos_and_or) for player_pos_and_or in players_pos_and_or], 
-            objects={}, bonus_orders=bonus_orders, all_orders=all_orders)
+            objects={}, bonus_orders=bonus_orders, all_orders=all_orders, recipe_context=recipe_context)
 
     @classmethod
-    def from_player_positions(cls, player_positions, bonus_orders=[], all_orders=[]):
+    def from_player_positions(cls, player_positions, bonus_orders=[], all_orders=[], recipe_context=None):
         """
         Make a dummy OvercookedState with no objects and with players facing
         North based on the passed in player positions and order list
         """
         dummy_pos_and_or = [(pos, Direction.NORTH) for pos in player_positions]
-        return cls.from_players_pos_and_or(dummy_pos_and_or, bonus_orders, all_orders)
+        return cls.from_players_pos_and_or(dummy_pos_and_or, bonus_orders, all_orders, recipe_context)
+
+    def persistent_copy(self):
+        """
+        Returns a copy of this state that shares all of its players and objects with this state.
+        Shared players and objects are frozen, and only copied once they are written to through
+        `mutable_player`, `mutable_object` or `remove_object`, so neither state is ever affected
+        by changes made to the other.
+        """
+        for player in self._players:
+            player._frozen = True
+            if player.held_object is not None:
+                player.held_object._frozen = True
+        for obj in self.objects.values():
+            obj._frozen = True
+        new_state = OvercookedState.__new__(OvercookedState)
+        new_state._players = self._players
+        new_state.objects = self.objects.copy()
+        new_state._bonus_orders = self._bonus_orders
+        new_state._all_orders = self._all_orders
+        new_state.timestep = self.timestep
+        new_state._owned = set()
+        new_state._hash = self._hash
+        new_state._objects_by_type = None
+        new_state._soup_statuses = None
+        new_state._volatile_positions = None
+        if self._objects_by_type is not None:
+            self._update_volatile_soup_statuses()
+            new_state._objects_by_type = self._objects_by_type.copy()
+            new_state._soup_statuses = self._soup_statuses.copy()
+            new_state._volatile_positions = set()
+        return new_state
+
+    def _update_hash(self, parent):
+        """
+        Derives the cached hash of this state from the one of `parent`, which this state was
+        created from with `persistent_copy`. Only the players and objects that aren't shared with
+        `parent` get rehashed.
+        """
+        if parent._hash is None:
+            self._hash = None
+            return
+        state_hash = parent._hash
+        for player_idx, (old_player, new_player) in enumerate(zip(parent.players, self.players)):
+            if old_player is not new_player:
+                state_hash ^= hash((player_idx, old_player)) ^ hash((player_idx, new_player))
+        for pos, old_obj in parent.objects.items():
+            new_obj = self.objects.get(pos)
+            if new_obj is not old_obj:
+                state_hash ^= hash(old_obj)
+                if new_obj is not None:
+                    state_hash ^= hash(new_obj)
+        for pos, new_obj in self.objects.items():
+            if pos not in parent.objects:
+                state_hash ^= hash(new_obj)
+        self._hash = state_hash
 
     def deepcopy(self):
         return OvercookedState(
             players=[player.deepcopy() for player in self.players],
             objects={pos:obj.deepcopy() for pos, obj in self.objects.items()}, 
-            bonus_orders=[order.to_dict() for order in self.bonus_orders],
-            all_orders=[order.to_dict() for order in self.all_orders],
+            bonus_orders=self._bonus_orders,
+            all_orders=self._all_orders,
             timestep=self.timestep)
 
     def time_independent_equal(self, other):
-        order_lists_equal = self.all_orders == other.all_orders and self.bonus_orders == other.bonus_orders
-
+        # Cached hashes tell most unequal states apart without comparing them, and order tuples
+        # are interned, so equal orders are almost always the same tuple
         return isinstance(other, OvercookedState) and \
+            hash(self) == hash(other) and \
             self.players == other.players and \
-            set(self.objects.items()) == set(other.objects.items()) and \
-            order_lists_equal
+            self.objects == other.objects and \
+            (self._all_orders is other._all_orders or self._all_orders == other._all_orders) and \
+            (self._bonus_orders is other._bonus_orders or self._bonus_orders == other._bonus_orders)
 
     def __eq__(self, other):
-        return self.time_independent_equal(other) and self.timestep == other.timestep
+        return isinstance(other, OvercookedState) and self.timestep == other.timestep and self.time_independent_equal(other)
 
     def __hash__(self):
-        order_list_hash = hash(tuple(self.bonus_orders)) + hash(tuple(self.all_orders))
-        return hash(
-            (self.players, tuple(self.objects.values()), order_list_hash)
-        )
+        if self._hash is None:
+            state_hash = hash((self._bonus_orders, self._all_orders))
+            for player_idx, player in enumerate(self.players):
+                state_hash ^= hash((player_idx, player))
+            for obj in self.objects.values():
+                state_hash ^= hash(obj)
+            self._hash = state_hash
+        return self._hash
+
+    @property
+    def time_independent_key(self):
+        """
+        Hashable key for caches keyed by states that should ignore the timestep. Keys of states
+        that are `time_independent_equal` are equal, and they reuse the cached hash of the state.
+        """
+        return TimeIndependentStateKey(self)
+
+    def __getstate__(self):
+        # The cached hash isn't valid in other processes (string hashes are salted per process)
+        return {slot : getattr(self, slot) for slot in ('_players', 'objects', '_bonus_orders', '_all_orders', 'timestep')}
+
+    def __setstate__(self, state):
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        self._owned = None
+        self._hash = None
+        self._objects_by_type = None
+        self._soup_statuses = None
+        self._volatile_positions = None
 
     def __str__(self):
         return 'Players: {}, Objects: {}, Bonus orders: {} All orders: {} Timestep: {}'.format( 
-            str(self.players), str(list(self.objects.values())), str(self.bonus_orders), str(self.all_orders), str(self.timestep))
+            str(self.players), str(list(self.objects.values())), str(list(self.bonus_orders)), str(list(self.all_orders)), str(self.timestep))
 
     def to_dict(self):
         return {
@@ -765,12 +1222,300 @@ class OvercookedState(object):
         }
 
     @staticmethod
-    def from_dict(state_dict):
+    def from_dict(state_dict, recipe_context=None):
         state_dict = copy.deepcopy(state_dict)
-        state_dict["players"] = [PlayerState.from_dict(p) for p in state_dict["players"]]
-        object_list = [SoupState.from_dict(o) for o in state_dict["objects"]]
+        state_dict["players"] = [PlayerState.from_dict(p, recipe_context) for p in state_dict["players"]]
+        object_list = [SoupState.from_dict(o, recipe_context) for o in state_dict["objects"]]
         state_dict["objects"] = { ob.position : ob for ob in object_list }
-        return OvercookedState(**state_dict)
+        return OvercookedState(recipe_context=recipe_context, **state_dict)
+
+
+class TimeIndependentStateKey(object):
+    """Hashable wrapper around an OvercookedState that ignores its timestep, see `OvercookedState.time_independent_key`"""
+    __slots__ = ('state',)
+
+    def __init__(self, state):
+        self.state = state
+
+    def __eq__(self, other):
+        return isinstance(other, TimeIndependentStateKey) and self.state.time_independent_equal(other.state)
+
+    def __hash__(self):
+        return hash(self.state)
+
+
+class OvercookedStateCodec(object):
+    """
+    Lossless fixed-width binary encoding of the OvercookedStates of one OvercookedGridworld, for storing
+    trajectories, sending states between processes and as compact hash keys.
+
+    Every state of the layout is encoded into exactly `num_bytes` bytes:
+
+        timestep | all orders | bonus orders | player 0 | ... | player n-1 | object slot 0 | ... | object slot m-1
+
+    The timestep is a little endian uint32 and the orders are bitmasks over the recipe ids of the mdp's
+    RecipeContext. A player is its x, y and orientation index followed by an object slot for its held object,
+    and there is an object slot for every non floor cell of the terrain (non-held objects can't be anywhere
+    else). An object slot is the index of the object name in OBJECT_NAMES (0 if empty), followed by the
+    ingredient sequence of soups packed in base len(Recipe.ALL_INGREDIENTS) + 1 and the soup cooking tick + 1
+    as little endian uint16.
+
+    Everything after the first TIMESTEP_BYTES bytes doesn't depend on the timestep, so
+    `encoding[OvercookedStateCodec.TIMESTEP_BYTES:]` can be used as a time independent key.
+    """
+
+    OBJECT_NAMES = (None, 'onion', 'tomato', 'dish', 'soup')
+    TIMESTEP_BYTES = 4
+    TICK_BYTES = 2
+
+    def __init__(self, mdp):
+        if mdp.width > 255 or mdp.height > 255:
+            raise ValueError("Can't encode positions of layouts larger than 255x255")
+        self.recipe_context = mdp.recipe_context
+        self.num_players = mdp.num_players
+        self.object_positions = tuple((x, y) for y, row in enumerate(mdp.terrain_mtx) for x, terrain_type in enumerate(row) if terrain_type != ' ')
+
+        self._object_codes = { name : code for code, name in enumerate(self.OBJECT_NAMES) if name is not None }
+        self._soup_code = self._object_codes['soup']
+        self._ingredient_base = len(Recipe.ALL_INGREDIENTS) + 1
+        self._ingredient_digits = { ingredient : digit + 1 for digit, ingredient in enumerate(Recipe.ALL_INGREDIENTS) }
+        max_packed_ingredients = self._ingredient_base**self.recipe_context.max_num_ingredients - 1
+        self._ingredients_bytes = (max_packed_ingredients.bit_length() + 7) // 8
+        self._slot_bytes = 1 + self._ingredients_bytes + self.TICK_BYTES
+
+        self._orders_bytes = (len(self.recipe_context.all_recipes) + 7) // 8
+        self._player_bytes = 3 + self._slot_bytes
+        self._players_offset = self.TIMESTEP_BYTES + 2 * self._orders_bytes
+        objects_offset = self._players_offset + self.num_players * self._player_bytes
+        self._slot_offsets = { pos : objects_offset + i * self._slot_bytes for i, pos in enumerate(self.object_positions) }
+        self.num_bytes = objects_offset + len(self.object_positions) * self._slot_bytes
+
+        # Orders tuples are interned (see OvercookedState._intern_orders), so their masks are cached by id
+        self._orders_masks = {}
+        self._mask_orders = {}
+
+    def encode(self, state):
+        """Returns the `num_bytes` long bytes encoding of `state`"""
+        if len(state.players) != self.num_players:
+            raise ValueError("Expected a state with {} players, got {}".format(self.num_players, len(state.players)))
+        buf = bytearray(self.num_bytes)
+        buf[:self.TIMESTEP_BYTES] = state.timestep.to_bytes(self.TIMESTEP_BYTES, 'little')
+        orders_end = self.TIMESTEP_BYTES + self._orders_bytes
+        buf[self.TIMESTEP_BYTES:orders_end] = self._encode_orders(state.all_orders)
+        buf[orders_end:self._players_offset] = self._encode_orders(state.bonus_orders)
+
+        offset = self._players_offset
+        for player in state.players:
+            buf[offset], buf[offset + 1] = player.position
+            buf[offset + 2] = Direction.DIRECTION_TO_INDEX[player.orientation]
+            if player.held_object is not None:
+                self._encode_object(buf, offset + 3, player.held_object)
+            offset += self._player_bytes
+
+        for pos, obj in state.objects.items():
+            if pos not in self._slot_offsets:
+                raise ValueError("Can't encode object {} that isn't on terrain".format(obj))
+            self._encode_object(buf, self._slot_offsets[pos], obj)
+        return bytes(buf)
+
+    def decode(self, data):
+        """Inverse of `encode`, also accepts np.uint8 rows as returned by `encode_batch`"""
+        if isinstance(data, np.ndarray):
+            data = data.tobytes()
+        if len(data) != self.num_bytes:
+            raise ValueError("Expected an encoding of {} bytes, got {}".format(self.num_bytes, len(data)))
+        timestep = int.from_bytes(data[:self.TIMESTEP_BYTES], 'little')
+        orders_end = self.TIMESTEP_BYTES + self._orders_bytes
+        all_orders = self._decode_orders(data[self.TIMESTEP_BYTES:orders_end])
+        bonus_orders = self._decode_orders(data[orders_end:self._players_offset])
+
+        players = []
+        offset = self._players_offset
+        for _ in range(self.num_players):
+            position = (data[offset], data[offset + 1])
+            orientation = Direction.INDEX_TO_DIRECTION[data[offset + 2]]
+            players.append(PlayerState(position, orientation, self._decode_object(data, offset + 3, position)))
+            offset += self._player_bytes
+
+        objects = {}
+        for pos, offset in self._slot_offsets.items():
+            if data[offset]:
+                objects[pos] = self._decode_object(data, offset, pos)
+        return OvercookedState(players, objects, bonus_orders=bonus_orders, all_orders=all_orders, timestep=timestep, recipe_context=self.recipe_context)
+
+    def encode_batch(self, states):
+        """Encodes `states` into the rows of a (len(states), num_bytes) np.uint8 array"""
+        encodings = b''.join([self.encode(state) for state in states])
+        return np.frombuffer(encodings, dtype=np.uint8).reshape(len(states), self.num_bytes)
+
+    def decode_batch(self, rows):
+        return [self.decode(row) for row in rows]
+
+    def decode_columns(self, rows):
+        """
+        Decodes the players and objects of (n, num_bytes) np.uint8 rows of `encode_batch` with array operations,
+        into a dict of int64 arrays:
+
+            timesteps (n,)
+            player_positions (n, num_players, 2)
+            player_orientations (n, num_players): indices into Direction.INDEX_TO_DIRECTION
+            object_codes (n, num_players + len(object_positions)): indices into OBJECT_NAMES (0 for no object) of
+                the objects held by the players followed by the objects at `object_positions`
+            soup_ingredients (n, num_players + len(object_positions)): packed ingredient sequences of soups
+            soup_ticks (n, num_players + len(object_positions)): cooking ticks of soups (-1 when not cooking)
+        """
+        rows = np.asarray(rows, dtype=np.uint8).reshape(-1, self.num_bytes)
+        as_int = lambda offset, num_bytes: sum(rows[:, offset + k].astype(np.int64) << (8 * k) for k in range(num_bytes))
+        player_offsets = [self._players_offset + i * self._player_bytes for i in range(self.num_players)]
+        slot_offsets = np.array([offset + 3 for offset in player_offsets] + [self._slot_offsets[pos] for pos in self.object_positions], dtype=np.int64)
+        return {
+            "timesteps" : as_int(0, self.TIMESTEP_BYTES),
+            "player_positions" : np.stack([rows[:, player_offsets], rows[:, np.add(player_offsets, 1)]], axis=-1).astype(np.int64),
+            "player_orientations" : rows[:, np.add(player_offsets, 2)].astype(np.int64),
+            "object_codes" : rows[:, slot_offsets].astype(np.int64),
+            "soup_ingredients" : as_int(slot_offsets + 1, self._ingredients_bytes),
+            "soup_ticks" : as_int(slot_offsets + 1 + self._ingredients_bytes, self.TICK_BYTES) - 1
+        }
+
+    def _encode_orders(self, orders):
+        cached = self._orders_masks.get(id(orders))
+        if cached is None or cached[0] is not orders:
+            mask = 0
+            for recipe in orders:
+                mask |= 1 << recipe.id
+            cached = self._orders_masks[id(orders)] = (orders, mask.to_bytes(self._orders_bytes, 'little'))
+        return cached[1]
+
+    def _decode_orders(self, mask_bytes):
+        if mask_bytes not in self._mask_orders:
+            mask = int.from_bytes(mask_bytes, 'little')
+            recipes = [recipe for recipe in self.recipe_context.all_recipes if mask >> recipe.id & 1]
+            self._mask_orders[mask_bytes] = OvercookedState._intern_orders(recipes, self.recipe_context)
+        return self._mask_orders[mask_bytes]
+
+    def _encode_object(self, buf, offset, obj):
+        if obj.name not in self._object_codes:
+            raise ValueError("Can't encode object {}".format(obj))
+        code = self._object_codes[obj.name]
+        buf[offset] = code
+        if code == self._soup_code:
+            packed_ingredients = 0
+            for ingredient in reversed(obj.ingredients):
+                packed_ingredients = packed_ingredients * self._ingredient_base + self._ingredient_digits[ingredient]
+            ingredients_end = offset + 1 + self._ingredients_bytes
+            buf[offset + 1:ingredients_end] = packed_ingredients.to_bytes(self._ingredients_bytes, 'little')
+            buf[ingredients_end:ingredients_end + self.TICK_BYTES] = (obj._cooking_tick + 1).to_bytes(self.TICK_BYTES, 'little')
+
+    def _decode_object(self, data, offset, position):
+        code = data[offset]
+        if not code:
+            return None
+        if code != self._soup_code:
+            return ObjectState(self.OBJECT_NAMES[code], position)
+        ingredients_end = offset + 1 + self._ingredients_bytes
+        packed_ingredients = int.from_bytes(data[offset + 1:ingredients_end], 'little')
+        ingredients = []
+        while packed_ingredients:
+            packed_ingredients, digit = divmod(packed_ingredients, self._ingredient_base)
+            ingredients.append(ObjectState(Recipe.ALL_INGREDIENTS[digit - 1], position))
+        cooking_tick = int.from_bytes(data[ingredients_end:ingredients_end + self.TICK_BYTES], 'little') - 1
+        return SoupState(position, ingredients, cooking_tick, self.recipe_context)
+
+
+class LosslessEncodingDelta(object):
+    """
+    Message of a LosslessEncodingDeltaEncoder stream. Keyframes hold the full (num_players, width, height,
+    num layers) np.int16 lossless_state_encoding in `keyframe`, other messages the (num entries, 4) np.int16
+    player, x, y and layer indices of the entries that changed since the previous message in `indices`, and
+    their new np.int16 values in `values`.
+    """
+    __slots__ = ('sequence_number', 'keyframe', 'indices', 'values')
+
+    def __init__(self, sequence_number, keyframe=None, indices=None, values=None):
+        self.sequence_number = sequence_number
+        self.keyframe = keyframe
+        self.indices = indices
+        self.values = values
+
+    @property
+    def is_keyframe(self):
+        return self.keyframe is not None
+
+    @property
+    def num_bytes(self):
+        if self.is_keyframe:
+            return self.keyframe.nbytes
+        return self.indices.nbytes + self.values.nbytes
+
+
+class LosslessEncodingDeltaEncoder(object):
+    """
+    Turns the states of a trajectory into a stream of LosslessEncodingDeltas, e.g. to send observations from
+    rollout workers to a learner. Between two timesteps only a few entries of the lossless_state_encoding
+    change, so most messages only hold those. Every `keyframe_interval` messages (and after `reset`) a keyframe
+    with the full encoding is sent instead, so that receivers can join mid-stream.
+    """
+
+    def __init__(self, mdp, horizon=400, keyframe_interval=100):
+        self.mdp = mdp
+        self.horizon = horizon
+        self.keyframe_interval = keyframe_interval
+        shape = (mdp.num_players,) + tuple(mdp.lossless_state_encoding_shape)
+        # The current and previous encodings, written in turns
+        self._buffers = np.empty((2,) + shape, dtype=np.int16)
+        self._sequence_number = 0
+        self.reset()
+
+    def reset(self):
+        """Makes the next message a keyframe, e.g. at the start of an episode"""
+        self._since_keyframe = None
+
+    def encode(self, state):
+        obs = self._buffers[self._sequence_number % 2]
+        prev_obs = self._buffers[(self._sequence_number + 1) % 2]
+        self.mdp.lossless_state_encoding(state, self.horizon, out=obs, dtype=np.int16)
+        if self._since_keyframe is None or self._since_keyframe + 1 >= self.keyframe_interval:
+            message = LosslessEncodingDelta(self._sequence_number, keyframe=obs.copy())
+            self._since_keyframe = 0
+        else:
+            flat_idxs = np.flatnonzero(obs != prev_obs)
+            indices = np.stack(np.unravel_index(flat_idxs, obs.shape), axis=1).astype(np.int16)
+            message = LosslessEncodingDelta(self._sequence_number, indices=indices, values=obs.ravel()[flat_idxs])
+            self._since_keyframe += 1
+        self._sequence_number += 1
+        return message
+
+
+class LosslessEncodingDeltaDecoder(object):
+    """
+    Rebuilds the lossless_state_encodings of a LosslessEncodingDeltaEncoder stream. Messages before the first
+    keyframe are skipped, so decoders can join mid-stream.
+    """
+
+    def __init__(self, dtype=int):
+        self.dtype = dtype
+        self._obs = None
+        self._next_sequence_number = None
+
+    def decode(self, message):
+        """
+        Returns the lossless_state_encoding of the message as one array per player, like
+        OvercookedGridworld.lossless_state_encoding, or None if no keyframe has been received yet.
+        Raises a ValueError if messages were lost since the last keyframe, after which the decoder waits
+        for the next one.
+        """
+        if message.is_keyframe:
+            self._obs = message.keyframe.copy()
+        elif self._obs is None:
+            return None
+        elif message.sequence_number != self._next_sequence_number:
+            self._obs = None
+            raise ValueError("Expected message {}, got {}. Messages were lost since the last keyframe".format(
+                self._next_sequence_number, message.sequence_number))
+        else:
+            self._obs[tuple(message.indices.T)] = message.values
+        self._next_sequence_number = message.sequence_number + 1
+        return tuple(self._obs.astype(self.dtype))
 
 
 BASE_REW_SHAPING_PARAMS = {
@@ -819,6 +1564,67 @@ EVENT_TYPES = [
     'useless_tomato_potting'
 ]
 
+# The events of one player in one transition are stored as a single integer, with one bit per event type
+EVENT_BITS = { event : 1 << i for i, event in enumerate(EVENT_TYPES) }
+
+# How many events get_state_transition logs. CHEAP only logs the raw pickup, drop, potting and
+# delivery events, skipping the usefulness and potting outcome checks that need extra computation
+EVENT_LEVEL_OFF = 0
+EVENT_LEVEL_CHEAP = 1
+EVENT_LEVEL_FULL = 2
+EVENT_LEVELS = [EVENT_LEVEL_OFF, EVENT_LEVEL_CHEAP, EVENT_LEVEL_FULL]
+
+
+class EventInfos(Mapping):
+    """
+    Read-only view of the event bitmasks of a transition (one per player) in the events_infos
+    format { event_type : [whether it occurred, for each player] } over all EVENT_TYPES. The
+    bitmasks are only decoded for the event types that are looked up
+    """
+
+    __slots__ = ['bitmasks']
+
+    def __init__(self, bitmasks):
+        self.bitmasks = bitmasks
+
+    def __getitem__(self, event):
+        bit = EVENT_BITS[event]
+        return [bool(bitmask & bit) for bitmask in self.bitmasks]
+
+    def __iter__(self):
+        return iter(EVENT_TYPES)
+
+    def __len__(self):
+        return len(EVENT_TYPES)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def to_dict(self):
+        return { event : self[event] for event in EVENT_TYPES }
+
+    @staticmethod
+    def to_bitmasks(events_infos):
+        """Inverse of the decoding, from an events_infos dict to one bitmask per player"""
+        num_players = len(next(iter(events_infos.values())))
+        bitmasks = [0] * num_players
+        for event, occurred_by_player in events_infos.items():
+            for player_idx, occurred in enumerate(occurred_by_player):
+                if occurred:
+                    bitmasks[player_idx] |= EVENT_BITS[event]
+        return bitmasks
+
+    @staticmethod
+    def iter_events(bitmask):
+        """Yields the event types set in a single player's bitmask, in the order of EVENT_TYPES"""
+        event_idx = 0
+        while bitmask:
+            if bitmask & 1:
+                yield EVENT_TYPES[event_idx]
+            bitmask >>= 1
+            event_idx += 1
+
+
 POTENTIAL_CONSTANTS = {
     'default' : {
         'max_delivery_steps' : 10,
@@ -834,6 +1640,21 @@ POTENTIAL_CONSTANTS = {
     }
 }
 
+# Layers of lossless_state_encoding after the player layers, in order
+LOSSLESS_BASE_MAP_FEATURES = ["pot_loc", "counter_loc", "onion_disp_loc", "tomato_disp_loc", "dish_disp_loc", "serve_loc"]
+LOSSLESS_VARIABLE_MAP_FEATURES = ["onions_in_pot", "tomatoes_in_pot", "onions_in_soup", "tomatoes_in_soup",
+                                  "soup_cook_time_remaining", "soup_done", "dishes", "onions", "tomatoes"]
+LOSSLESS_URGENCY_FEATURES = ["urgency"]
+LOSSLESS_MAP_FEATURES = LOSSLESS_BASE_MAP_FEATURES + LOSSLESS_VARIABLE_MAP_FEATURES + LOSSLESS_URGENCY_FEATURES
+# The urgency layer is all ones during the last LOSSLESS_URGENCY_STEPS timesteps of the horizon
+LOSSLESS_URGENCY_STEPS = 40
+# Memory layouts of lossless encodings: layers last, as (width, height, num layers) like they always were, or layers
+# first, as (num layers, width, height)
+LOSSLESS_LAYOUTS = ["HWC", "CHW"]
+# Length of the features featurize_state computes for each player: orientation, held object, deltas to the 9 closest
+# features and walls in the 4 directions
+FEATURIZE_PLAYER_FEATURES = 4 + 3 + 9 * 2 + 4
+
 class OvercookedGridworld(object):
     """
     An MDP grid world based off of the Overcooked game.
@@ -845,7 +1666,7 @@ class OvercookedGridworld(object):
     # INSTANTIATION METHODS #
     #########################
 
-    def __init__(self, terrain, start_player_positions, start_bonus_orders=[], rew_shaping_params=None, layout_name="unnamed_layout", start_all_orders=[], num_items_for_soup=3, order_bonus=2, start_state=None, **kwargs):
+    def __init__(self, terrain, start_player_positions, start_bonus_orders=[], rew_shaping_params=None, layout_name="unnamed_layout", start_all_orders=[], num_items_for_soup=3, order_bonus=2, start_state=None, event_level=EVENT_LEVEL_FULL, **kwargs):
         """
         terrain: a matrix of strings that encode the MDP layout
         layout_name: string identifier of the layout
@@ -856,21 +1677,29 @@ class OvercookedGridworld(object):
         num_items_for_soup: Maximum number of ingredients that can be placed in a soup
         order_bonus: Multiplicative factor for serving a bonus recipe
         start_state: Default start state returned by get_standard_start_state
+        event_level: Which events get_state_transition logs by default, one of EVENT_LEVELS
         """
         self._configure_recipes(start_all_orders, num_items_for_soup, **kwargs)
-        self.start_all_orders = [r.to_dict() for r in Recipe.ALL_RECIPES] if not start_all_orders else start_all_orders
+        self.start_all_orders = [r.to_dict() for r in self.recipe_context.all_recipes] if not start_all_orders else start_all_orders
         self.height = len(terrain)
         self.width = len(terrain[0])
         self.shape = (self.width, self.height)
         self.terrain_mtx = terrain
         self.terrain_pos_dict = self._get_terrain_type_pos_dict()
+        self._build_movement_table()
+        self._build_lossless_static_layers()
         self.start_player_positions = start_player_positions
         self.num_players = len(start_player_positions)
         self.start_bonus_orders = start_bonus_orders
         self.reward_shaping_params = BASE_REW_SHAPING_PARAMS if rew_shaping_params is None else rew_shaping_params
         self.layout_name = layout_name
         self.order_bonus = order_bonus
-        self.start_state = start_state
+        assert event_level in EVENT_LEVELS, "Unknown event level {}".format(event_level)
+        self.event_level = event_level
+        # Soups in the start state have to use the recipe context of this MDP
+        if start_state:
+            start_state = OvercookedState.from_dict(start_state if isinstance(start_state, dict) else start_state.to_dict(), self.recipe_context)
+        self.start_state = start_state or None
         self._opt_recipe_discount_cache = {}
         self._opt_recipe_cache = {}
         self._prev_potential_params = {}
@@ -889,8 +1718,6 @@ class OvercookedGridworld(object):
         grid = base_layout_params['grid']
         del base_layout_params['grid']
         base_layout_params['layout_name'] = layout_name
-        if 'start_state' in base_layout_params:
-            base_layout_params['start_state'] = OvercookedState.from_dict(base_layout_params['start_state'])
 
         # Clean grid
         grid = [layout_row.strip() for layout_row in grid.split("\n")]
@@ -944,7 +1771,7 @@ class OvercookedGridworld(object):
             "all_orders" : start_all_orders,
             **kwargs
         }
-        Recipe.configure(self.recipe_config)
+        self.recipe_context = RecipeContext(self.recipe_config)
 
     #####################
     # BASIC CLASS UTILS #
@@ -957,7 +1784,19 @@ class OvercookedGridworld(object):
                 self.start_all_orders == other.start_all_orders and \
                 self.reward_shaping_params == other.reward_shaping_params and \
                 self.layout_name == other.layout_name
-    
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # MDPs pickled before recipe contexts existed (e.g. inside saved planners) only have a recipe_config
+        if 'recipe_context' not in state:
+            self.recipe_context = RecipeContext(self.recipe_config)
+        if 'movement_table' not in state:
+            self._build_movement_table()
+        if '_lossless_static_layers' not in state:
+            self._build_lossless_static_layers()
+        if 'event_level' not in state:
+            self.event_level = EVENT_LEVEL_FULL
+
     def copy(self):
         return OvercookedGridworld(
             terrain=self.terrain_mtx.copy(),
@@ -965,7 +1804,9 @@ class OvercookedGridworld(object):
             start_bonus_orders=self.start_bonus_orders,
             rew_shaping_params=copy.deepcopy(self.reward_shaping_params),
             layout_name=self.layout_name,
-            start_all_orders=self.start_all_orders
+            start_all_orders=self.start_all_orders,
+            event_level=self.event_level,
+            **{k: v for k, v in self.recipe_config.items() if k != "all_orders"}
         )
 
     @property
@@ -1007,19 +1848,19 @@ class OvercookedGridworld(object):
         if self.start_state:
             return self.start_state
         start_state = OvercookedState.from_player_positions(
-            self.start_player_positions, bonus_orders=self.start_bonus_orders, all_orders=self.start_all_orders
+            self.start_player_positions, bonus_orders=self.start_bonus_orders, all_orders=self.start_all_orders,
+            recipe_context=self.recipe_context
         )
         return start_state
 
     def get_random_start_state_fn(self, random_start_pos=False, rnd_obj_prob_thresh=0.0):
         def start_state_fn():
             if random_start_pos:
-                valid_positions = self.get_valid_joint_player_positions()
-                start_pos = valid_positions[np.random.choice(len(valid_positions))]
+                start_pos = self.get_valid_joint_player_positions_at(np.random.choice(self.num_valid_joint_player_positions()))
             else:
                 start_pos = self.start_player_positions
 
-            start_state = OvercookedState.from_player_positions(start_pos, bonus_orders=self.start_bonus_orders, all_orders=self.start_all_orders)
+            start_state = OvercookedState.from_player_positions(start_pos, bonus_orders=self.start_bonus_orders, all_orders=self.start_all_orders, recipe_context=self.recipe_context)
 
             if rnd_obj_prob_thresh == 0:
                 return start_state
@@ -1035,7 +1876,7 @@ class OvercookedGridworld(object):
                     m = int(np.random.randint(low=0, high=4-n))
                     q = np.random.rand()
                     cooking_tick = 0 if q < rnd_obj_prob_thresh else -1
-                    start_state.objects[pot_loc] = SoupState.get_soup(pot_loc, num_onions=n, num_tomatoes=m, cooking_tick=cooking_tick)
+                    start_state.add_object(SoupState.get_soup(pot_loc, num_onions=n, num_tomatoes=m, cooking_tick=cooking_tick, recipe_context=self.recipe_context))
 
             # For each player, add a random object with prob rnd_obj_prob_thresh
             for player in start_state.players:
@@ -1047,7 +1888,7 @@ class OvercookedGridworld(object):
                     m = int(np.random.randint(low=0, high=4-n))
                     if obj == "soup":
                         player.set_object(
-                            SoupState.get_soup(player.position, num_onions=n, num_tomatoes=m, finished=True)
+                            SoupState.get_soup(player.position, num_onions=n, num_tomatoes=m, finished=True, recipe_context=self.recipe_context)
                         )
                     else:
                         player.set_object(ObjectState(obj, player.position))
@@ -1058,27 +1899,34 @@ class OvercookedGridworld(object):
         # There is a finite horizon, handled by the environment.
         return False
 
-    def get_state_transition(self, state, joint_action, display_phi=False, motion_planner=None):
+    def get_state_transition(self, state, joint_action, display_phi=False, motion_planner=None, event_level=None):
         """Gets information about possible transitions for the action.
 
         Returns the next state, sparse reward and reward shaping.
         Assumes all actions are deterministic.
 
+        The events of the transition are logged according to event_level (self.event_level if None),
+        as one bitmask per player under "event_bitmasks" (see EVENT_BITS). "event_infos" decodes
+        them into the { event_type : [occurred, for each player] } format on access.
+
         NOTE: Sparse reward is given only when soups are delivered, 
         shaped reward is given only for completion of subgoals 
         (not soup deliveries).
         """
-        events_infos = { event : [False] * self.num_players for event in EVENT_TYPES }
+        event_level = self.event_level if event_level is None else event_level
+        event_bitmasks = [0] * self.num_players
 
         assert not self.is_terminal(state), "Trying to find successor of a terminal state: {}".format(state)
         for action, action_set in zip(joint_action, self.get_actions(state)):
             if action not in action_set:
                 raise ValueError("Illegal action %s in state %s" % (action, state))
         
-        new_state = state.deepcopy()
+        # Only the players and objects that the transition changes get copied, everything
+        # else is shared with `state`
+        new_state = state.persistent_copy()
 
         # Resolve interacts first
-        sparse_reward_by_agent, shaped_reward_by_agent = self.resolve_interacts(new_state, joint_action, events_infos)
+        sparse_reward_by_agent, shaped_reward_by_agent = self.resolve_interacts(new_state, joint_action, event_bitmasks, event_level)
 
         assert new_state.player_positions == state.player_positions
         assert new_state.player_orientations == state.player_orientations
@@ -1089,10 +1937,16 @@ class OvercookedGridworld(object):
         # Finally, environment effects
         self.step_environment_effects(new_state)
 
+        # Drop the bookkeeping of what `new_state` owns so that stored states stay small. Any
+        # later writes through `mutable_player` or `mutable_object` will copy again
+        new_state._owned = None
+        new_state._update_hash(state)
+
         # Additional dense reward logic
         # shaped_reward += self.calculate_distance_based_shaped_reward(state, new_state)
         infos = {
-            "event_infos": events_infos,
+            "event_bitmasks": event_bitmasks,
+            "event_infos": EventInfos(event_bitmasks),
             "sparse_reward_by_agent": sparse_reward_by_agent,
             "shaped_reward_by_agent": shaped_reward_by_agent,
         }
@@ -1102,14 +1956,20 @@ class OvercookedGridworld(object):
             infos["phi_s_prime"] = self.potential_function(new_state, motion_planner)
         return new_state, infos
 
-    def resolve_interacts(self, new_state, joint_action, events_infos):
+    def resolve_interacts(self, new_state, joint_action, event_bitmasks, event_level=EVENT_LEVEL_FULL):
         """
         Resolve any INTERACT actions, if present.
 
         Currently if two players both interact with a terrain, we resolve player 1's interact 
         first and then player 2's, without doing anything like collision checking.
+
+        Players and objects are only copied (through `new_state.mutable_player` and
+        `new_state.mutable_object`) once an interact actually changes them.
+
+        Events are or-ed into event_bitmasks (one per player), as far as event_level asks for them.
         """
-        pot_states = self.get_pot_states(new_state)
+        # Pot states are only needed by interacts, and are those from before any player's interact
+        pot_states = self.get_pot_states(new_state) if Action.INTERACT in joint_action else None
         # We divide reward by agent to keep track of who contributed
         sparse_reward, shaped_reward = [0] * self.num_players, [0] * self.num_players 
 
@@ -1128,34 +1988,40 @@ class OvercookedGridworld(object):
 
                 if player.has_object() and not new_state.has_object(i_pos):
                     obj_name = player.get_object().name
-                    self.log_object_drop(events_infos, new_state, obj_name, pot_states, player_idx)
+                    if event_level:
+                        self.log_object_drop(event_bitmasks, new_state, obj_name, pot_states, player_idx, event_level)
 
                     # Drop object on counter
+                    player = new_state.mutable_player(player_idx)
                     obj = player.remove_object()
                     new_state.add_object(obj, i_pos)
                     
                 elif not player.has_object() and new_state.has_object(i_pos):
                     obj_name = new_state.get_object(i_pos).name
-                    self.log_object_pickup(events_infos, new_state, obj_name, pot_states, player_idx)
+                    if event_level:
+                        self.log_object_pickup(event_bitmasks, new_state, obj_name, pot_states, player_idx, event_level)
 
                     # Pick up object from counter
+                    player = new_state.mutable_player(player_idx)
                     obj = new_state.remove_object(i_pos)
                     player.set_object(obj)
                     
 
             elif terrain_type == 'O' and player.held_object is None:
-                self.log_object_pickup(events_infos, new_state, "onion", pot_states, player_idx)
+                if event_level:
+                    self.log_object_pickup(event_bitmasks, new_state, "onion", pot_states, player_idx, event_level)
 
                 # Onion pickup from dispenser
                 obj = ObjectState('onion', pos)
-                player.set_object(obj)
+                new_state.mutable_player(player_idx).set_object(obj)
 
             elif terrain_type == 'T' and player.held_object is None:
                 # Tomato pickup from dispenser
-                player.set_object(ObjectState('tomato', pos))
+                new_state.mutable_player(player_idx).set_object(ObjectState('tomato', pos))
 
             elif terrain_type == 'D' and player.held_object is None:
-                self.log_object_pickup(events_infos, new_state, "dish", pot_states, player_idx)
+                if event_level:
+                    self.log_object_pickup(event_bitmasks, new_state, "dish", pot_states, player_idx, event_level)
 
                 # Give shaped reward if pickup is useful
                 if self.is_dish_pickup_useful(new_state, pot_states):
@@ -1163,20 +2029,22 @@ class OvercookedGridworld(object):
 
                 # Perform dish pickup from dispenser
                 obj = ObjectState('dish', pos)
-                player.set_object(obj)
+                new_state.mutable_player(player_idx).set_object(obj)
 
             elif terrain_type == 'P' and not player.has_object():
                 # Cooking soup
                 if self.soup_to_be_cooked_at_location(new_state, i_pos):
-                    soup = new_state.get_object(i_pos)
+                    soup = new_state.mutable_object(i_pos)
                     soup.begin_cooking()
             
             elif terrain_type == 'P' and player.has_object():
 
                 if player.get_object().name == 'dish' and self.soup_ready_at_location(new_state, i_pos):
-                    self.log_object_pickup(events_infos, new_state, "soup", pot_states, player_idx)
+                    if event_level:
+                        self.log_object_pickup(event_bitmasks, new_state, "soup", pot_states, player_idx, event_level)
 
                     # Pick up soup
+                    player = new_state.mutable_player(player_idx)
                     player.remove_object() # Remove the dish
                     obj = new_state.remove_object(i_pos) # Get soup
                     player.set_object(obj)
@@ -1187,30 +2055,32 @@ class OvercookedGridworld(object):
 
                     if not new_state.has_object(i_pos):
                         # Pot was empty, add soup to it
-                        new_state.add_object(SoupState(i_pos, ingredients=[]))
+                        new_state.add_object(SoupState(i_pos, ingredients=[], recipe_context=self.recipe_context))
 
                     # Add ingredient if possible
-                    soup = new_state.get_object(i_pos)
-                    if not soup.is_full:
-                        old_soup = soup.deepcopy()
-                        obj = player.remove_object()
+                    if not new_state.get_object(i_pos).is_full:
+                        soup = new_state.mutable_object(i_pos)
+                        # The soup before potting is only needed to classify the potting
+                        old_soup = soup.deepcopy() if event_level == EVENT_LEVEL_FULL else None
+                        obj = new_state.mutable_player(player_idx).remove_object()
                         soup.add_ingredient(obj)
                         shaped_reward[player_idx] += self.reward_shaping_params["PLACEMENT_IN_POT_REW"]
 
                         # Log potting
-                        self.log_object_potting(events_infos, new_state, old_soup, soup, obj.name, player_idx)
-                        if obj.name == Recipe.ONION:
-                            events_infos['potting_onion'][player_idx] = True
+                        if event_level:
+                            self.log_object_potting(event_bitmasks, new_state, old_soup, soup, obj.name, player_idx, event_level)
 
             elif terrain_type == 'S' and player.has_object():
                 obj = player.get_object()
                 if obj.name == 'soup':
 
+                    player = new_state.mutable_player(player_idx)
                     delivery_rew = self.deliver_soup(new_state, player, obj)
                     sparse_reward[player_idx] += delivery_rew
 
                     # Log soup delivery
-                    events_infos['soup_delivery'][player_idx] = True                        
+                    if event_level:
+                        event_bitmasks[player_idx] |= EVENT_BITS['soup_delivery']
 
         return sparse_reward, shaped_reward
 
@@ -1226,9 +2096,9 @@ class OvercookedGridworld(object):
                 return 0
             
             if not recipe in state.bonus_orders:
-                return recipe.value
+                return self.recipe_context.recipe_value(recipe)
 
-            return self.order_bonus * recipe.value
+            return self.order_bonus * self.recipe_context.recipe_value(recipe)
         else:
             # Calculate missing ingredients needed to complete recipe
             missing_ingredients = list(recipe.ingredients)
@@ -1240,7 +2110,7 @@ class OvercookedGridworld(object):
 
             gamma, pot_onion_steps, pot_tomato_steps = potential_params['gamma'], potential_params['pot_onion_steps'], potential_params['pot_tomato_steps']
 
-            return gamma**recipe.time * gamma**(pot_onion_steps * n_onions) * gamma**(pot_tomato_steps * n_tomatoes) * self.get_recipe_value(state, recipe, discounted=False)
+            return gamma**self.recipe_context.recipe_time(recipe) * gamma**(pot_onion_steps * n_onions) * gamma**(pot_tomato_steps * n_tomatoes) * self.get_recipe_value(state, recipe, discounted=False)
 
     def deliver_soup(self, state, player, soup):
         """
@@ -1256,8 +2126,10 @@ class OvercookedGridworld(object):
     def resolve_movement(self, state, joint_action):
         """Resolve player movement and deal with possible collisions"""
         new_positions, new_orientations = self.compute_new_positions_and_orientations(state.players, joint_action)
-        for player_state, new_pos, new_o in zip(state.players, new_positions, new_orientations):
-            player_state.update_pos_and_or(new_pos, new_o)
+        for player_idx, (player_state, new_pos, new_o) in enumerate(zip(state.players, new_positions, new_orientations)):
+            # Players that don't move or turn stay shared with the previous state
+            if player_state.position != new_pos or player_state.orientation != new_o:
+                state.mutable_player(player_idx).update_pos_and_or(new_pos, new_o)
 
     def compute_new_positions_and_orientations(self, old_player_states, joint_action):
         """Compute new positions and orientations ignoring collisions"""
@@ -1272,22 +2144,70 @@ class OvercookedGridworld(object):
         # Checking for any players ending in same square
         if self.is_joint_position_collision(new_positions):
             return True
-        # Check if any two players crossed paths
-        for idx0, idx1 in itertools.combinations(range(self.num_players), 2):
-            p1_old, p2_old = old_positions[idx0], old_positions[idx1]
-            p1_new, p2_new = new_positions[idx0], new_positions[idx1]
-            if p1_new == p2_old and p1_old == p2_new:
+        # Check if any two players crossed paths, looking up which player occupied
+        # each new position before the transition
+        old_occupancy = dict(zip(old_positions, range(len(old_positions))))
+        for idx, new_pos in enumerate(new_positions):
+            other_idx = old_occupancy.get(new_pos)
+            if other_idx is not None and other_idx != idx and new_positions[other_idx] == old_positions[idx]:
                 return True
         return False
 
     def is_joint_position_collision(self, joint_position):
-        return any(pos0 == pos1 for pos0, pos1 in itertools.combinations(joint_position, 2))
+        return len(set(joint_position)) < len(joint_position)
             
-    def step_environment_effects(self, state):
-        state.timestep += 1
-        for obj in state.objects.values():
-            if obj.name == 'soup' and obj.is_cooking:
-                obj.cook()
+    def step_environment_effects(self, state, num_steps=1):
+        """
+        Advances the timestep and the cooking soups of `state` in place. With num_steps > 1 the
+        effects of that many ticks are applied at once, which is only exact if the players change
+        nothing in between (see `fast_forward`)
+        """
+        state.timestep += num_steps
+        for pos in state.cooking_soup_positions:
+            state.mutable_object(pos).cook(num_steps)
+
+    def fast_forward(self, state, num_steps):
+        """
+        Returns the state after num_steps ticks in which the players change nothing (e.g. all of
+        them stay), without stepping through them: only the timestep and the cooking soups advance.
+        No rewards are given and no events happen in such ticks
+        """
+        new_state = state.persistent_copy()
+        self.step_environment_effects(new_state, num_steps)
+        new_state._owned = None
+        new_state._update_hash(state)
+        return new_state
+
+    def get_ticks_until_soup_ready(self, state):
+        """Number of ticks until the next cooking soup is done, None if no soup is cooking"""
+        ticks_remaining = [state.get_object(pos).cook_time_remaining for pos in state.cooking_soup_positions]
+        return min(ticks_remaining) if ticks_remaining else None
+
+    def is_noop_joint_action(self, state, joint_action):
+        """
+        Whether joint_action is known to change nothing about the players in `state` without
+        stepping: nobody interacts, and every player stays or walks into a wall they already face
+        """
+        for player, action in zip(state.players, joint_action):
+            if action == Action.INTERACT or self._move_if_direction(player.position, player.orientation, action) != player.pos_and_or:
+                return False
+        return True
+
+    def only_cooking_progressed(self, state, next_state):
+        """
+        Whether next_state only differs from `state` by its timestep and the cooking ticks of soups.
+        A joint action that led from `state` to such a next_state will keep doing nothing until
+        the next soup is done
+        """
+        if next_state.players != state.players or next_state.objects.keys() != state.objects.keys():
+            return False
+        for pos, obj in next_state.objects.items():
+            old_obj = state.objects[pos]
+            if obj is old_obj:
+                continue
+            if obj.name != 'soup' or old_obj.name != 'soup' or old_obj.is_idle or obj.ingredients != old_obj.ingredients:
+                return False
+        return True
 
     def _handle_collisions(self, old_positions, new_positions):
         """If agents collide, they stay at their old locations"""
@@ -1302,17 +2222,67 @@ class OvercookedGridworld(object):
                 pos_dict[terrain_type].append((x, y))
         return pos_dict
 
-    def _move_if_direction(self, position, orientation, action):
-        """Returns position and orientation that would 
-        be obtained after executing action"""
+    def _build_movement_table(self):
+        """
+        Precomputes the outcome of every action from every cell of the grid, so that movement never
+        has to search the list of valid player positions.
+
+        Cells are indexed by their position index x + y * width (see `get_position_index`).
+        `walkable_cells` is a boolean array over position indices, and `movement_table` is an int
+        array of shape (num cells, num directions, num actions, 2) mapping (position index,
+        orientation index, action index) to (new position index, new orientation index), ignoring
+        collisions. `_motion_transitions` holds the same outcomes keyed by (position, orientation)
+        and action, for the per-player Python code paths.
+        """
+        num_cells = self.width * self.height
+        self.walkable_cells = np.zeros(num_cells, dtype=bool)
+        for pos in self.get_valid_player_positions():
+            self.walkable_cells[self.get_position_index(pos)] = True
+
+        self.movement_table = np.zeros((num_cells, len(Direction.ALL_DIRECTIONS), Action.NUM_ACTIONS, 2), dtype=np.int64)
+        self._motion_transitions = {}
+        for pos_idx in range(num_cells):
+            position = self.get_position_from_index(pos_idx)
+            for orientation_idx, orientation in enumerate(Direction.INDEX_TO_DIRECTION):
+                transitions = self._motion_transitions[(position, orientation)] = {}
+                for action_idx, action in enumerate(Action.INDEX_TO_ACTION):
+                    new_pos, new_orientation = transitions[action] = self._compute_move(position, orientation, action)
+                    self.movement_table[pos_idx, orientation_idx, action_idx] = \
+                        self.get_position_index(new_pos), Direction.DIRECTION_TO_INDEX[new_orientation]
+
+    def _build_lossless_static_layers(self):
+        """The LOSSLESS_BASE_MAP_FEATURES layers of lossless_state_encoding, which only depend on the terrain"""
+        self._lossless_static_layers = np.zeros(self.shape + (len(LOSSLESS_BASE_MAP_FEATURES),), dtype=int)
+        for layer_idx, terrain_type in enumerate(['P', 'X', 'O', 'T', 'D', 'S']):
+            for x, y in self.terrain_pos_dict[terrain_type]:
+                self._lossless_static_layers[x, y, layer_idx] = 1
+        self._pot_location_set = frozenset(self.terrain_pos_dict['P'])
+
+    def _compute_move(self, position, orientation, action):
         if action not in Action.MOTION_ACTIONS:
             return position, orientation
         new_pos = Action.move_in_direction(position, action)
         new_orientation = orientation if action == Action.STAY else action
-        if new_pos not in self.get_valid_player_positions():
+        if not self.is_walkable(new_pos):
             return position, new_orientation
         return new_pos, new_orientation
 
+    def _move_if_direction(self, position, orientation, action):
+        """Returns position and orientation that would 
+        be obtained after executing action"""
+        transitions = self._motion_transitions.get((position, orientation))
+        if transitions is None:
+            # Only positions outside of the grid are not in the table
+            return self._compute_move(position, orientation, action)
+        return transitions[action]
+
+    def get_motion_transitions(self, position, orientation):
+        """
+        Returns a dict mapping every action (in the order of Action.ALL_ACTIONS) to the position and
+        orientation it leads to from `position` and `orientation`, ignoring collisions
+        """
+        return self._motion_transitions[(position, orientation)]
+
 
     #######################
     # LAYOUT / STATE INFO #
@@ -1321,12 +2291,50 @@ class OvercookedGridworld(object):
     def get_valid_player_positions(self):
         return self.terrain_pos_dict[' ']
 
+    def get_position_index(self, pos):
+        """Index of a position of the grid in `walkable_cells` and `movement_table`"""
+        x, y = pos
+        return x + y * self.width
+
+    def get_position_from_index(self, pos_idx):
+        return (pos_idx % self.width, pos_idx // self.width)
+
+    def is_walkable(self, pos):
+        x, y = pos
+        return 0 <= x < self.width and 0 <= y < self.height and bool(self.walkable_cells[x + y * self.width])
+
     def get_valid_joint_player_positions(self):
         """Returns all valid tuples of the form (p0_pos, p1_pos, p2_pos, ...)"""
-        valid_positions = self.get_valid_player_positions() 
-        all_joint_positions = list(itertools.product(valid_positions, repeat=self.num_players))
-        valid_joint_positions = [j_pos for j_pos in all_joint_positions if not self.is_joint_position_collision(j_pos)]
-        return valid_joint_positions
+        return list(self.iter_valid_joint_player_positions())
+
+    def iter_valid_joint_player_positions(self):
+        """Lazily iterates over the joint positions of get_valid_joint_player_positions, in the same order"""
+        return itertools.permutations(self.get_valid_player_positions(), self.num_players)
+
+    def num_valid_joint_player_positions(self):
+        return self._num_joint_positions(len(self.get_valid_player_positions()), self.num_players)
+
+    def get_valid_joint_player_positions_at(self, index):
+        """
+        Returns get_valid_joint_player_positions()[index] without enumerating the joint positions,
+        which are too many to list for layouts with many players
+        """
+        remaining_positions = list(self.get_valid_player_positions())
+        joint_position = []
+        for player_idx in range(self.num_players):
+            # Number of joint positions that share the positions of the players so far
+            num_completions = self._num_joint_positions(len(remaining_positions) - 1, self.num_players - player_idx - 1)
+            pos_idx, index = divmod(index, num_completions)
+            joint_position.append(remaining_positions.pop(pos_idx))
+        return tuple(joint_position)
+
+    @staticmethod
+    def _num_joint_positions(num_positions, num_players):
+        """Number of ways to place num_players players on num_positions distinct positions"""
+        count = 1
+        for i in range(num_players):
+            count *= num_positions - i
+        return count
 
     def get_valid_player_positions_and_orientations(self):
         valid_states = []
@@ -1337,15 +2345,21 @@ class OvercookedGridworld(object):
     def get_valid_joint_player_positions_and_orientations(self):
         """All joint player position and orientation pairs that are not
         overlapping and on empty terrain."""
+        return list(self.iter_valid_joint_player_positions_and_orientations())
+
+    def iter_valid_joint_player_positions_and_orientations(self):
+        """Lazy version of get_valid_joint_player_positions_and_orientations, in the same order"""
         valid_player_states = self.get_valid_player_positions_and_orientations()
 
-        valid_joint_player_states = []
-        for players_pos_and_orientations in itertools.product(valid_player_states, repeat=self.num_players):
-            joint_position = [plyer_pos_and_or[0] for plyer_pos_and_or in players_pos_and_orientations]
-            if not self.is_joint_position_collision(joint_position):
-                valid_joint_player_states.append(players_pos_and_orientations)
+        def extend(joint_player_states, occupied_positions):
+            if len(joint_player_states) == self.num_players:
+                yield tuple(joint_player_states)
+                return
+            for pos_and_or in valid_player_states:
+                if pos_and_or[0] not in occupied_positions:
+                    yield from extend(joint_player_states + [pos_and_or], occupied_positions | {pos_and_or[0]})
 
-        return valid_joint_player_states
+        return extend([], frozenset())
 
     def get_adjacent_features(self, player):
         adj_feats = []
@@ -1393,18 +2407,11 @@ class OvercookedGridworld(object):
         """
         pots_states_dict = defaultdict(list)
         for pot_pos in self.get_pot_locations():
-            if not state.has_object(pot_pos):
-                pots_states_dict['empty'].append(pot_pos)
-            else:
-                soup = state.get_object(pot_pos)
-                assert soup.name == 'soup', "soup at " + pot_pos + " is not a soup but a " + soup.name
-                if soup.is_ready:
-                    pots_states_dict['ready'].append(pot_pos)
-                elif soup.is_cooking:
-                    pots_states_dict['cooking'].append(pot_pos)
-                else:
-                    num_ingredients = len(soup.ingredients)
-                    pots_states_dict['{}_items'.format(num_ingredients)].append(pot_pos)
+            status = state.soup_status(pot_pos)
+            if status is None:
+                assert not state.has_object(pot_pos), "object at {} is not a soup but a {}".format(pot_pos, state.get_object(pot_pos).name)
+                status = 'empty'
+            pots_states_dict[status].append(pot_pos)
 
         return pots_states_dict
 
@@ -1435,13 +2442,13 @@ class OvercookedGridworld(object):
         return pot_states['cooking']
 
     def get_full_but_not_cooking_pots(self, pot_states):
-        return pot_states['{}_items'.format(Recipe.MAX_NUM_INGREDIENTS)]
+        return pot_states['{}_items'.format(self.recipe_context.max_num_ingredients)]
 
     def get_full_pots(self, pot_states):
         return self.get_cooking_pots(pot_states) + self.get_ready_pots(pot_states) + self.get_full_but_not_cooking_pots(pot_states)
 
     def get_partially_full_pots(self, pot_states):
-        return list(set().union(*[pot_states['{}_items'.format(i)] for i in range(1, Recipe.MAX_NUM_INGREDIENTS)]))
+        return list(set().union(*[pot_states['{}_items'.format(i)] for i in range(1, self.recipe_context.max_num_ingredients)]))
 
     def soup_ready_at_location(self, state, pos):
         if not state.has_object(pos):
@@ -1494,14 +2501,12 @@ class OvercookedGridworld(object):
             assert obj_state.is_valid()
 
     def find_free_counters_valid_for_both_players(self, state, mlam):
-        """Finds all empty counter locations that are accessible to both players"""
-        one_player, other_player = state.players
+        """Finds all empty counter locations that are accessible to all players"""
         free_counters = self.get_empty_counter_locations(state)
         free_counters_valid_for_both = []
         for free_counter in free_counters:
             goals = mlam.motion_planner.motion_goals_for_pos[free_counter]
-            if any([mlam.motion_planner.is_valid_motion_start_goal_pair(one_player.pos_and_or, goal) for goal in goals]) and \
-            any([mlam.motion_planner.is_valid_motion_start_goal_pair(other_player.pos_and_or, goal) for goal in goals]):
+            if all(any([mlam.motion_planner.is_valid_motion_start_goal_pair(player.pos_and_or, goal) for goal in goals]) for player in state.players):
                 free_counters_valid_for_both.append(free_counter)
         return free_counters_valid_for_both
 
@@ -1519,7 +2524,7 @@ class OvercookedGridworld(object):
         best_value = 0
         if not recipe:
             for ingredient in Recipe.ALL_INGREDIENTS:
-                stack.append(Recipe([ingredient]))
+                stack.append(self.recipe_context.recipe([ingredient]))
         else:
             stack.append(recipe)
 
@@ -1531,7 +2536,7 @@ class OvercookedGridworld(object):
                 if curr_value > best_value:
                     best_value, best_recipe = curr_value, curr_recipe
                 
-                for neighbor in curr_recipe.neighbors():
+                for neighbor in self.recipe_context.neighbors(curr_recipe):
                     if not neighbor in visited:
                         stack.append(neighbor)
         
@@ -1620,12 +2625,14 @@ class OvercookedGridworld(object):
     # EVENT LOGGING HELPER METHODS #
     ################################
 
-    def log_object_potting(self, events_infos, state, old_soup, new_soup, obj_name, player_index):
+    def log_object_potting(self, event_bitmasks, state, old_soup, new_soup, obj_name, player_index, event_level=EVENT_LEVEL_FULL):
         """Player added an ingredient to a pot"""
         obj_pickup_key = "potting_" + obj_name
-        if obj_pickup_key not in events_infos:
+        if obj_pickup_key not in EVENT_BITS:
             raise ValueError("Unknown event {}".format(obj_pickup_key))
-        events_infos[obj_pickup_key][player_index] = True
+        event_bitmasks[player_index] |= EVENT_BITS[obj_pickup_key]
+        if event_level != EVENT_LEVEL_FULL:
+            return
 
         POTTING_FNS = {
             "optimal" : self.is_potting_optimal,
@@ -1637,15 +2644,17 @@ class OvercookedGridworld(object):
         for outcome, outcome_fn in POTTING_FNS.items():
             if outcome_fn(state, old_soup, new_soup):
                 potting_key = "{}_{}_potting".format(outcome, obj_name)
-                events_infos[potting_key][player_index] = True
+                event_bitmasks[player_index] |= EVENT_BITS[potting_key]
 
     
-    def log_object_pickup(self, events_infos, state, obj_name, pot_states, player_index):
+    def log_object_pickup(self, event_bitmasks, state, obj_name, pot_states, player_index, event_level=EVENT_LEVEL_FULL):
         """Player picked an object up from a counter or a dispenser"""
         obj_pickup_key = obj_name + "_pickup"
-        if obj_pickup_key not in events_infos:
+        if obj_pickup_key not in EVENT_BITS:
             raise ValueError("Unknown event {}".format(obj_pickup_key))
-        events_infos[obj_pickup_key][player_index] = True
+        event_bitmasks[player_index] |= EVENT_BITS[obj_pickup_key]
+        if event_level != EVENT_LEVEL_FULL:
+            return
         
         USEFUL_PICKUP_FNS = {
             "tomato" : self.is_ingredient_pickup_useful,
@@ -1655,14 +2664,16 @@ class OvercookedGridworld(object):
         if obj_name in USEFUL_PICKUP_FNS:
             if USEFUL_PICKUP_FNS[obj_name](state, pot_states, player_index):
                 obj_useful_key = "useful_" + obj_name + "_pickup"
-                events_infos[obj_useful_key][player_index] = True
+                event_bitmasks[player_index] |= EVENT_BITS[obj_useful_key]
 
-    def log_object_drop(self, events_infos, state, obj_name, pot_states, player_index):
+    def log_object_drop(self, event_bitmasks, state, obj_name, pot_states, player_index, event_level=EVENT_LEVEL_FULL):
         """Player dropped the object on a counter"""
         obj_drop_key = obj_name + "_drop"
-        if obj_drop_key not in events_infos:
+        if obj_drop_key not in EVENT_BITS:
             raise ValueError("Unknown event {}".format(obj_drop_key))
-        events_infos[obj_drop_key][player_index] = True
+        event_bitmasks[player_index] |= EVENT_BITS[obj_drop_key]
+        if event_level != EVENT_LEVEL_FULL:
+            return
         
         USEFUL_DROP_FNS = {
             "tomato" : self.is_ingredient_drop_useful,
@@ -1672,7 +2683,7 @@ class OvercookedGridworld(object):
         if obj_name in USEFUL_DROP_FNS:
             if USEFUL_DROP_FNS[obj_name](state, pot_states, player_index):
                 obj_useful_key = "useful_" + obj_name + "_drop"
-                events_infos[obj_useful_key][player_index] = True
+                event_bitmasks[player_index] |= EVENT_BITS[obj_useful_key]
 
     def is_dish_pickup_useful(self, state, pot_states, player_index=None):
         """
@@ -1737,8 +2748,8 @@ class OvercookedGridworld(object):
         """
         True if the highest valued soup possible is the same before and after the potting
         """
-        old_recipe = Recipe(old_soup.ingredients) if old_soup.ingredients else None
-        new_recipe = Recipe(new_soup.ingredients)
+        old_recipe = Recipe.from_id(old_soup.recipe_id) if old_soup.ingredients else None
+        new_recipe = Recipe.from_id(new_soup.recipe_id)
         old_val = self.get_recipe_value(state, self.get_optimal_possible_recipe(state, old_recipe))
         new_val = self.get_recipe_value(state, self.get_optimal_possible_recipe(state, new_recipe))
         return old_val == new_val
@@ -1747,7 +2758,7 @@ class OvercookedGridworld(object):
         """
         True if there exists a non-zero reward soup possible from new ingredients
         """
-        new_recipe = Recipe(new_soup.ingredients)
+        new_recipe = Recipe.from_id(new_soup.recipe_id)
         new_val = self.get_recipe_value(state, self.get_optimal_possible_recipe(state, new_recipe))
         return new_val > 0
 
@@ -1755,8 +2766,8 @@ class OvercookedGridworld(object):
         """
         True if no non-zero reward soup is possible from new ingredients
         """
-        old_recipe = Recipe(old_soup.ingredients) if old_soup.ingredients else None
-        new_recipe = Recipe(new_soup.ingredients)
+        old_recipe = Recipe.from_id(old_soup.recipe_id) if old_soup.ingredients else None
+        new_recipe = Recipe.from_id(new_soup.recipe_id)
         old_val = self.get_recipe_value(state, self.get_optimal_possible_recipe(state, old_recipe))
         new_val = self.get_recipe_value(state, self.get_optimal_possible_recipe(state, new_recipe))
         return old_val > 0 and new_val == 0
@@ -1765,7 +2776,7 @@ class OvercookedGridworld(object):
         """
         True if ingredient added to a soup that was already gauranteed to be worth at most 0 points
         """
-        old_recipe = Recipe(old_soup.ingredients) if old_soup.ingredients else None
+        old_recipe = Recipe.from_id(old_soup.recipe_id) if old_soup.ingredients else None
         old_val = self.get_recipe_value(state, self.get_optimal_possible_recipe(state, old_recipe))
         return old_val == 0
 
@@ -1835,130 +2846,305 @@ class OvercookedGridworld(object):
 
     @property
     def lossless_state_encoding_shape(self):
-        return np.array(list(self.shape) + [26])
+        # A location layer and one layer per orientation for every player, plus 16 map, object and urgency layers
+        return np.array(list(self.shape) + [5 * self.num_players + 16])
+
+
+    def lossless_state_encoding(self, overcooked_state, horizon=400, debug=False, out=None, dtype=int, layout="HWC"):
+        """
+        Featurizes a OvercookedState object into a stack of boolean masks that are easily readable by a CNN.
 
+        Returns one (width, height, 5 * num_players + 16) array per player (see `lossless_state_encoding_layers`).
+        The views of the players share all layers but the player layers, which are ordered starting with the
+        player the view is for, so the shared layers are only computed once. If given, `out` is a (num_players,
+        width, height, num layers) array (or (num_players, num layers, width, height) for the "CHW" layout) that is
+        written in place, and whose views are returned.
 
-    def lossless_state_encoding(self, overcooked_state, horizon=400, debug=False):
-        """Featurizes a OvercookedState object into a stack of boolean masks that are easily readable by a CNN"""
-        assert self.num_players == 2, "Functionality has to be added to support encondings for > 2 players"
+        dtype: Type of the arrays, e.g. np.uint8, np.int16 or np.float32. With bool, the ingredient counts and cook
+            times of soups are reduced to whether they are non zero
+        layout (str): One of LOSSLESS_LAYOUTS. The encoding is written directly in it, without intermediate copies
+        """
         assert type(debug) is bool
-        base_map_features = ["pot_loc", "counter_loc", "onion_disp_loc", "tomato_disp_loc",
-                             "dish_disp_loc", "serve_loc"]
-        variable_map_features = ["onions_in_pot", "tomatoes_in_pot", "onions_in_soup", "tomatoes_in_soup",
-                                 "soup_cook_time_remaining", "soup_done", "dishes", "onions", "tomatoes"]
-        urgency_features = ["urgency"]
-        all_objects = overcooked_state.all_objects_list
-
-        def make_layer(position, value):
-                layer = np.zeros(self.shape)
-                layer[position] = value
-                return layer
-
-        def process_for_player(primary_agent_idx):
-            # Ensure that primary_agent_idx layers are ordered before other_agent_idx layers
-            other_agent_idx = 1 - primary_agent_idx
-            ordered_player_features = ["player_{}_loc".format(primary_agent_idx), "player_{}_loc".format(other_agent_idx)] + \
-                        ["player_{}_orientation_{}".format(i, Direction.DIRECTION_TO_INDEX[d])
-                        for i, d in itertools.product([primary_agent_idx, other_agent_idx], Direction.ALL_DIRECTIONS)]
-
-            # LAYERS = ordered_player_features + base_map_features + variable_map_features
-            LAYERS = ordered_player_features + base_map_features + variable_map_features + urgency_features
-            state_mask_dict = {k:np.zeros(self.shape) for k in LAYERS}
-
-            # MAP LAYERS
-            if horizon - overcooked_state.timestep < 40:
-                state_mask_dict["urgency"] = np.ones(self.shape)
-
-            for loc in self.get_counter_locations():
-                state_mask_dict["counter_loc"][loc] = 1
-
-            for loc in self.get_pot_locations():
-                state_mask_dict["pot_loc"][loc] = 1
-
-            for loc in self.get_onion_dispenser_locations():
-                state_mask_dict["onion_disp_loc"][loc] = 1
-
-            for loc in self.get_tomato_dispenser_locations():
-                state_mask_dict["tomato_disp_loc"][loc] = 1
-
-            for loc in self.get_dish_dispenser_locations():
-                state_mask_dict["dish_disp_loc"][loc] = 1
-
-            for loc in self.get_serving_locations():
-                state_mask_dict["serve_loc"][loc] = 1
-
-            # PLAYER LAYERS
-            for i, player in enumerate(overcooked_state.players):
-                player_orientation_idx = Direction.DIRECTION_TO_INDEX[player.orientation]
-                state_mask_dict["player_{}_loc".format(i)] = make_layer(player.position, 1)
-                state_mask_dict["player_{}_orientation_{}".format(i, player_orientation_idx)] = make_layer(player.position, 1)
-
-            # OBJECT & STATE LAYERS
-            for obj in all_objects:
-                if obj.name == "soup":
-                    # removed the next line because onion doesn't have to be in all the soups?
-                    # if Recipe.ONION in obj.ingredients:
-                    # get the ingredients into a {object: number} dictionary
-                    ingredients_dict = Counter(obj.ingredients)
-                    # assert "onion" in ingredients_dict.keys()
-                    if obj.position in self.get_pot_locations():
-                        if obj.is_idle:
-                            # onions_in_pot and tomatoes_in_pot are used when the soup is idling, and ingredients could still be added
-                            state_mask_dict["onions_in_pot"] += make_layer(obj.position, ingredients_dict["onion"])
-                            state_mask_dict["tomatoes_in_pot"] += make_layer(obj.position, ingredients_dict["tomato"])
-                        else:
-                            state_mask_dict["onions_in_soup"] += make_layer(obj.position, ingredients_dict["onion"])
-                            state_mask_dict["tomatoes_in_soup"] += make_layer(obj.position, ingredients_dict["tomato"])
-                            state_mask_dict["soup_cook_time_remaining"] += make_layer(obj.position, obj.cook_time - obj._cooking_tick)
-                            if obj.is_ready:
-                                state_mask_dict["soup_done"] += make_layer(obj.position, 1)
+        players = overcooked_state.players
+        num_players = len(players)
+        num_player_layers = 5 * num_players
+        # out is written through a (num_players, width, height, num layers) view of the output array
+        encoding, out = self._lossless_output((num_players,), num_player_layers + len(LOSSLESS_MAP_FEATURES), out, dtype, layout)
+
+        # MAP LAYERS
+        obs = out[0]
+        obs[:, :, :num_player_layers] = 0
+        obs[:, :, num_player_layers:num_player_layers + len(LOSSLESS_BASE_MAP_FEATURES)] = self._lossless_static_layers
+        variable_layers = obs[:, :, num_player_layers + len(LOSSLESS_BASE_MAP_FEATURES):]
+        variable_layers[:] = 0
+        if horizon - overcooked_state.timestep < LOSSLESS_URGENCY_STEPS:
+            variable_layers[:, :, -1] = 1
+
+        # OBJECT & STATE LAYERS
+        for x, y, layer_idx, value in self._lossless_object_entries(overcooked_state):
+            variable_layers[x, y, layer_idx] += value
+        out[1:] = obs
+
+        # PLAYER LAYERS
+        for primary_agent_idx in range(num_players):
+            view = out[primary_agent_idx]
+            for x, y, layer_idx in self._lossless_player_entries(players, primary_agent_idx):
+                view[x, y, layer_idx] = 1
+
+        if debug:
+            print("terrain----")
+            print(np.array(self.terrain_mtx))
+            print("-----------")
+            for primary_agent_idx in range(num_players):
+                layers = self.lossless_state_encoding_layers(primary_agent_idx, num_players)
+                print(len(layers))
+                for layer_idx, layer_id in enumerate(layers):
+                    print(layer_id)
+                    print(np.transpose(out[primary_agent_idx, :, :, layer_idx], (1, 0)))
+
+        # NOTE: currently not including time left or order_list in featurization
+        return tuple(encoding)
+
+    def _lossless_output(self, leading_shape, num_layers, out, dtype, layout):
+        """
+        Returns the output array of a lossless encoding with leading dimensions `leading_shape`, allocated if `out`
+        is None, and its view with the layers last, which is what the encodings write into
+        """
+        assert layout in LOSSLESS_LAYOUTS, "Unrecognized layout {}, expected one of {}".format(layout, LOSSLESS_LAYOUTS)
+        shape = leading_shape + self.shape + (num_layers,)
+        if layout == "CHW":
+            shape = leading_shape + (num_layers,) + self.shape
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        assert out.shape == shape, "Expected an output array of shape {}, got {}".format(shape, out.shape)
+        if layout == "CHW":
+            num_leading = len(leading_shape)
+            return out, np.moveaxis(out, num_leading, -1)
+        return out, out
+
+    def lossless_state_encoding_sparse(self, overcooked_state, horizon=400):
+        """
+        lossless_state_encoding of `overcooked_state` as coordinate lists, without the layers that only depend on the
+        terrain (see `lossless_state_encoding_static`). Returns one (indices, values, urgent) tuple per player, where
+        indices is a (num entries, 3) np.int16 array of the x, y and layer index of the non zero entries of the
+        player, object and state layers, values the np.int16 array of their values and urgent whether the urgency
+        layer is all ones. `lossless_state_encoding_from_sparse` converts them back into dense encodings.
+        """
+        players = overcooked_state.players
+        num_players = len(players)
+        variable_offset = 5 * num_players + len(LOSSLESS_BASE_MAP_FEATURES)
+        object_entries, object_values = [], []
+        for x, y, layer_idx, value in self._lossless_object_entries(overcooked_state):
+            object_entries.append((x, y, variable_offset + layer_idx))
+            object_values.append(value)
+        urgent = horizon - overcooked_state.timestep < LOSSLESS_URGENCY_STEPS
+
+        sparse_encodings = []
+        for primary_agent_idx in range(num_players):
+            player_entries = list(self._lossless_player_entries(players, primary_agent_idx))
+            indices = np.array(player_entries + object_entries, dtype=np.int16).reshape(-1, 3)
+            values = np.array([1] * len(player_entries) + object_values, dtype=np.int16)
+            sparse_encodings.append((indices, values, urgent))
+        return tuple(sparse_encodings)
+
+    def lossless_state_encoding_static(self, dtype=int, layout="HWC"):
+        """
+        (width, height, num layers) array holding the LOSSLESS_BASE_MAP_FEATURES layers of lossless_state_encoding,
+        which only depend on the terrain, and zeros in all other layers. It is the same for all states and players.
+        dtype and layout are those of lossless_state_encoding, and carry over to lossless_state_encoding_from_sparse
+        """
+        num_player_layers = 5 * self.num_players
+        static_encoding, hwc_static_encoding = self._lossless_output((), num_player_layers + len(LOSSLESS_MAP_FEATURES), None, dtype, layout)
+        hwc_static_encoding[:] = 0
+        hwc_static_encoding[:, :, num_player_layers:num_player_layers + len(LOSSLESS_BASE_MAP_FEATURES)] = self._lossless_static_layers
+        return static_encoding
 
-                    else:
-                        # If player soup is not in a pot, treat it like a soup that is cooked with remaining time 0
-                        state_mask_dict["onions_in_soup"] += make_layer(obj.position, ingredients_dict["onion"])
-                        state_mask_dict["tomatoes_in_soup"] += make_layer(obj.position, ingredients_dict["tomato"])
-                        state_mask_dict["soup_done"] += make_layer(obj.position, 1)
-
-                elif obj.name == "dish":
-                    state_mask_dict["dishes"] += make_layer(obj.position, 1)
-                elif obj.name == "onion":
-                    state_mask_dict["onions"] += make_layer(obj.position, 1)
-                elif obj.name == "tomato":
-                    state_mask_dict["tomatoes"] += make_layer(obj.position, 1)
+    @staticmethod
+    def lossless_state_encoding_from_sparse(sparse_encoding, static_encoding, out=None, layout="HWC"):
+        """
+        The dense lossless_state_encoding of one player from its lossless_state_encoding_sparse and the
+        lossless_state_encoding_static of the mdp (whose dtype and `layout` it has), written into `out` if given
+        """
+        indices, values, urgent = sparse_encoding
+        if out is None:
+            out = static_encoding.copy()
+        else:
+            out[:] = static_encoding
+        layer_idxs, xs, ys = indices[:, 2], indices[:, 0], indices[:, 1]
+        if layout == "CHW":
+            out[layer_idxs, xs, ys] = values
+            if urgent:
+                out[-1] = 1
+        else:
+            out[xs, ys, layer_idxs] = values
+            if urgent:
+                out[:, :, -1] = 1
+        return out
+
+    def _lossless_object_entries(self, overcooked_state):
+        """
+        Yields the non zero (x, y, layer index in LOSSLESS_VARIABLE_MAP_FEATURES, value) entries of the object
+        and state layers of lossless_state_encoding
+        """
+        for obj in overcooked_state.all_objects_list:
+            x, y = obj.position
+            if obj.name == "soup":
+                ingredients = obj.ingredients
+                num_onions, num_tomatoes = ingredients.count(Recipe.ONION), ingredients.count(Recipe.TOMATO)
+                if obj.position in self._pot_location_set and obj.is_idle:
+                    # onions_in_pot and tomatoes_in_pot are used when the soup is idling, and ingredients could still be added
+                    ingredient_layers = (0, 1)
+                else:
+                    ingredient_layers = (2, 3)
+                if num_onions:
+                    yield x, y, ingredient_layers[0], num_onions
+                if num_tomatoes:
+                    yield x, y, ingredient_layers[1], num_tomatoes
+                if obj.position in self._pot_location_set:
+                    if not obj.is_idle:
+                        cook_time_remaining = obj.cook_time - obj._cooking_tick
+                        if cook_time_remaining:
+                            yield x, y, 4, cook_time_remaining
+                        if obj.is_ready:
+                            yield x, y, 5, 1
                 else:
-                    raise ValueError("Unrecognized object")
+                    # If player soup is not in a pot, treat it like a soup that is cooked with remaining time 0
+                    yield x, y, 5, 1
+            elif obj.name == "dish":
+                yield x, y, 6, 1
+            elif obj.name == "onion":
+                yield x, y, 7, 1
+            elif obj.name == "tomato":
+                yield x, y, 8, 1
+            else:
+                raise ValueError("Unrecognized object")
+
+    def _lossless_player_entries(self, players, primary_agent_idx):
+        """Yields the (x, y, layer index) of the entries set to 1 in the player layers of a view"""
+        num_players = len(players)
+        for i, player in enumerate(players):
+            # Rank of player i in the view, where the primary agent comes first and the others keep their order
+            rank = 0 if i == primary_agent_idx else i + (i < primary_agent_idx)
+            x, y = player.position
+            yield x, y, rank
+            yield x, y, num_players + 4 * rank + Direction.DIRECTION_TO_INDEX[player.orientation]
+
+    def lossless_state_encoding_layers(self, primary_agent_idx=0, num_players=None):
+        """Names of the layers of the lossless_state_encoding view of player `primary_agent_idx`, in order"""
+        num_players = self.num_players if num_players is None else num_players
+        # Ensure that primary_agent_idx layers are ordered before the layers of the other agents
+        ordered_agent_idxs = [primary_agent_idx] + [i for i in range(num_players) if i != primary_agent_idx]
+        ordered_player_features = ["player_{}_loc".format(i) for i in ordered_agent_idxs] + \
+                    ["player_{}_orientation_{}".format(i, Direction.DIRECTION_TO_INDEX[d])
+                    for i, d in itertools.product(ordered_agent_idxs, Direction.ALL_DIRECTIONS)]
+        return ordered_player_features + LOSSLESS_MAP_FEATURES
+
+    def lossless_state_encoding_batch(self, states, horizon=400, out=None, dtype=int, layout="HWC"):
+        """
+        lossless_state_encoding of many states at once, as a (num_states, num_players, width, height, num layers)
+        array (or (num_states, num_players, num layers, width, height) for the "CHW" layout), where [i, j] is the
+        view of player j of states[i]. dtype and layout are those of lossless_state_encoding.
 
-            if debug:
-                print("terrain----")
-                print(np.array(self.terrain_mtx))
-                print("-----------")
-                print(len(LAYERS))
-                print(len(state_mask_dict))
-                for k, v in state_mask_dict.items():
-                    print(k)
-                    print(np.transpose(v, (1, 0)))
-
-            # Stack of all the state masks, order decided by order of LAYERS
-            state_mask_stack = np.array([state_mask_dict[layer_id] for layer_id in LAYERS])
-            state_mask_stack = np.transpose(state_mask_stack, (1, 2, 0))
-            assert state_mask_stack.shape[:2] == self.shape
-            assert state_mask_stack.shape[2] == len(LAYERS)
-            # NOTE: currently not including time left or order_list in featurization
-            return np.array(state_mask_stack).astype(int)
-
-        # NOTE: Currently not very efficient, a decent amount of computation repeated here
-        num_players = len(overcooked_state.players)
-        final_obs_for_players = tuple(process_for_player(i) for i in range(num_players))
-        return final_obs_for_players
+        states (list(OvercookedState) or np.ndarray): OvercookedStates, or the (num_states, num_bytes) rows of
+            OvercookedStateCodec.encode_batch for this mdp, which are used without decoding them
+        out (np.ndarray): If given, written in place and returned
+
+        All states are converted into arrays of player and object coordinates (see
+        OvercookedStateCodec.decode_columns) that are scattered into the layers of all states at once.
+        """
+        codec, slot_positions, in_pot, ingredient_counts, cook_times = self._get_lossless_batch_tables()
+        if isinstance(states, np.ndarray) and states.dtype == np.uint8:
+            rows = states
+        else:
+            rows = codec.encode_batch(list(states))
+        columns = codec.decode_columns(rows)
+        num_states, num_players = columns["player_orientations"].shape
+        num_player_layers = 5 * num_players
+        encodings, out = self._lossless_output((num_states, num_players), num_player_layers + len(LOSSLESS_MAP_FEATURES), out, dtype, layout)
+
+        # MAP LAYERS
+        obs = out[:, 0]
+        obs[..., :num_player_layers] = 0
+        obs[..., num_player_layers:num_player_layers + len(LOSSLESS_BASE_MAP_FEATURES)] = self._lossless_static_layers
+        variable_layers = obs[..., num_player_layers + len(LOSSLESS_BASE_MAP_FEATURES):]
+        variable_layers[:] = 0
+        variable_layers[horizon - columns["timesteps"] < LOSSLESS_URGENCY_STEPS, :, :, -1] = 1
+
+        # OBJECT & STATE LAYERS, with the held object slots at the positions of their players
+        player_positions = columns["player_positions"]
+        xs = np.concatenate([player_positions[:, :, 0], np.broadcast_to(slot_positions[:, 0], (num_states, len(slot_positions)))], axis=1)
+        ys = np.concatenate([player_positions[:, :, 1], np.broadcast_to(slot_positions[:, 1], (num_states, len(slot_positions)))], axis=1)
+        codes = columns["object_codes"]
+        ticks = columns["soup_ticks"]
+        soups_in_pot = (codes == OvercookedStateCodec.OBJECT_NAMES.index("soup")) & np.concatenate([np.zeros(num_players, dtype=bool), in_pot])
+        soups_off_pot = (codes == OvercookedStateCodec.OBJECT_NAMES.index("soup")) & ~soups_in_pot
+        idle, cooking = soups_in_pot & (ticks < 0), soups_in_pot & (ticks >= 0)
+        num_onions, num_tomatoes = np.moveaxis(ingredient_counts[columns["soup_ingredients"]], -1, 0)
+        cook_time = cook_times[columns["soup_ingredients"]]
+        layer_values = [
+            num_onions * idle,
+            num_tomatoes * idle,
+            num_onions * (cooking | soups_off_pot),
+            num_tomatoes * (cooking | soups_off_pot),
+            (cook_time - ticks) * cooking,
+            (cooking & (ticks >= cook_time)) | soups_off_pot,
+            codes == OvercookedStateCodec.OBJECT_NAMES.index("dish"),
+            codes == OvercookedStateCodec.OBJECT_NAMES.index(Recipe.ONION),
+            codes == OvercookedStateCodec.OBJECT_NAMES.index(Recipe.TOMATO)
+        ]
+        state_idxs = np.broadcast_to(np.arange(num_states)[:, None], xs.shape)
+        for layer_idx, values in enumerate(layer_values):
+            # Objects never share a position, so every (state, x, y) is written at most once
+            variable_layers[state_idxs, xs, ys, layer_idx] = values
+        out[:, 1:] = out[:, :1]
+
+        # PLAYER LAYERS
+        orientations = columns["player_orientations"]
+        for primary_agent_idx in range(num_players):
+            for i in range(num_players):
+                rank = 0 if i == primary_agent_idx else i + (i < primary_agent_idx)
+                x, y = player_positions[:, i, 0], player_positions[:, i, 1]
+                out[state_idxs[:, 0], primary_agent_idx, x, y, rank] = 1
+                out[state_idxs[:, 0], primary_agent_idx, x, y, num_players + 4 * rank + orientations[:, i]] = 1
+        return encodings
+
+    def _get_lossless_batch_tables(self):
+        """
+        The codec, object slot positions and soup tables used by lossless_state_encoding_batch, built on first use:
+        whether every object slot is a pot, and the onion and tomato counts and cook time (0 if the ingredients
+        aren't a recipe) of every packed ingredient sequence of the codec
+        """
+        if getattr(self, '_lossless_batch_tables', None) is None:
+            codec = OvercookedStateCodec(self)
+            slot_positions = np.array(codec.object_positions, dtype=np.int64).reshape(-1, 2)
+            in_pot = np.array([pos in self._pot_location_set for pos in codec.object_positions], dtype=bool)
+            base = len(Recipe.ALL_INGREDIENTS) + 1
+            num_packed = base**self.recipe_context.max_num_ingredients
+            ingredient_counts = np.zeros((num_packed, 2), dtype=np.int64)
+            cook_times = np.zeros(num_packed, dtype=np.int64)
+            for packed_ingredients in range(num_packed):
+                ingredients, remaining = [], packed_ingredients
+                while remaining:
+                    remaining, digit = divmod(remaining, base)
+                    if digit:
+                        ingredients.append(Recipe.ALL_INGREDIENTS[digit - 1])
+                ingredient_counts[packed_ingredients] = ingredients.count(Recipe.ONION), ingredients.count(Recipe.TOMATO)
+                recipe_id = Recipe.id_of(ingredients)
+                if recipe_id is not None:
+                    cook_times[packed_ingredients] = self.recipe_context.recipe_time_by_id(recipe_id)
+            self._lossless_batch_tables = (codec, slot_positions, in_pot, ingredient_counts, cook_times)
+        return self._lossless_batch_tables
 
     @property
     def featurize_state_shape(self):
-        return np.array([62])
+        # Features of every player, positions of the other players relative to the player and its own position
+        return np.array([self.num_players * FEATURIZE_PLAYER_FEATURES + (self.num_players - 1) * 2 + 2])
 
     def featurize_state(self, overcooked_state, mlam, horizon=400):
         """
-        Encode state with some manually designed features.
-        NOTE: currently works for just two players.
+        Encode state with some manually designed features. Returns one featurization per player, made of its own
+        features, the features of the other players in index order, the positions of the other players relative
+        to it in index order and its own position.
         """
 
         all_features = {}
@@ -2024,23 +3210,109 @@ class OvercookedGridworld(object):
 
                 all_features["p{}_wall_{}".format(i, direction)] = [0] if feat == ' ' else [1]
 
-        features_np = {k: np.array(v) for k, v in all_features.items()}
+        players = overcooked_state.players
+        player_features = [
+            np.concatenate([np.array(v) for k, v in all_features.items() if k.startswith("p{}_".format(i))])
+            for i in range(len(players))
+        ]
 
-        p0, p1 = overcooked_state.players
-        p0_dict = {k: v for k, v in features_np.items() if k[:2] == "p0"}
-        p1_dict = {k: v for k, v in features_np.items() if k[:2] == "p1"}
-        p0_features = np.concatenate(list(p0_dict.values()))
-        p1_features = np.concatenate(list(p1_dict.values()))
+        ordered_features = []
+        for i, player in enumerate(players):
+            others = [j for j in range(len(players)) if j != i]
+            others_features = [player_features[j] for j in others]
+            others_rel_pos = [np.array(pos_distance(players[j].position, player.position)) for j in others]
+            abs_pos = np.array(player.position)
+            ordered_features.append(np.squeeze(np.concatenate([player_features[i]] + others_features + others_rel_pos + [abs_pos])))
+        return tuple(ordered_features)
 
-        p1_rel_to_p0 = np.array(pos_distance(p1.position, p0.position))
-        abs_pos_p0 = np.array(p0.position)
-        ordered_features_p0 = np.squeeze(np.concatenate([p0_features, p1_features, p1_rel_to_p0, abs_pos_p0]))
 
-        p0_rel_to_p1 = np.array(pos_distance(p0.position, p1.position))
-        abs_pos_p1 = np.array(p1.position)
-        ordered_features_p1 = np.squeeze(np.concatenate([p1_features, p0_features, p0_rel_to_p1, abs_pos_p1]))
-        return ordered_features_p0, ordered_features_p1
+    def featurize_state_batch(self, states, mlam, horizon=400, chunk_size=1024):
+        """
+        featurize_state of many states at once, as a (num_states, num_players, featurize_state_shape[0]) np.float32
+        array where [i, j] is the featurization of states[i] for player j.
 
+        States are only scanned once for their players, counter objects and pot statuses. Closest features are
+        then found for all states of a chunk at once with the distance table of the motion planner (see
+        MotionPlanner.get_feature_distance_table), breaking ties in favor of the feature that comes first in the
+        candidate lists of featurize_state, so that the result matches featurize_state exactly.
+        """
+        IDX_TO_OBJ = ["onion", "soup", "dish"]
+        OBJ_TO_IDX = {o_name: idx for idx, o_name in enumerate(IDX_TO_OBJ)}
+        # Closest feature types, in the order of featurize_state
+        CLOSEST_FEATURES = ["onion", "empty_pot", "one_onion_pot", "two_onion_pot", "cooking_pot", "ready_pot", "dish", "soup", "serving"]
+        POT_FEATURES = { "empty" : 1, "1_items" : 2, "2_items" : 3, "cooking" : 4, "ready" : 5 }
+        num_directions = len(Direction.ALL_DIRECTIONS)
+
+        distance_table, feature_positions = mlam.motion_planner.get_feature_distance_table()
+        feature_idxs = { pos : idx for idx, pos in enumerate(feature_positions) }
+        feature_positions = np.array(feature_positions, dtype=np.int64)
+        num_features = len(feature_positions)
+        counters = set(self.terrain_pos_dict['X'])
+        onion_dispensers, dish_dispensers = self.get_onion_dispenser_locations(), self.get_dish_dispenser_locations()
+
+        # Candidate ranks shared by all states: the position of static features in their candidate lists
+        static_ranks = np.full((len(CLOSEST_FEATURES), num_features), np.Inf)
+        for feature_type, locations in [("onion", onion_dispensers), ("dish", dish_dispensers), ("serving", self.get_serving_locations())]:
+            for rank, pos in enumerate(locations):
+                static_ranks[CLOSEST_FEATURES.index(feature_type), feature_idxs[pos]] = rank
+        walls = np.zeros((self.width * self.height, num_directions), dtype=np.float32)
+        for pos in self.get_valid_player_positions():
+            walls[self.get_position_index(pos)] = [self.get_terrain_type_at_pos(Action.move_in_direction(pos, d)) != ' ' for d in Direction.ALL_DIRECTIONS]
+
+        num_players, num_player_features = self.num_players, FEATURIZE_PLAYER_FEATURES
+        features = np.zeros((len(states), num_players, self.featurize_state_shape[0]), dtype=np.float32)
+        for chunk_start in range(0, len(states), chunk_size):
+            chunk = states[chunk_start:chunk_start + chunk_size]
+            n = len(chunk)
+            positions = np.zeros((n, num_players, 2), dtype=np.int64)
+            orientations = np.zeros((n, num_players), dtype=np.int64)
+            held = np.full((n, num_players), -1, dtype=np.int64)
+            ranks = np.repeat(static_ranks[None], n, axis=0)
+            for state_idx, state in enumerate(chunk):
+                for i, player in enumerate(state.players):
+                    positions[state_idx, i] = player.position
+                    orientations[state_idx, i] = Direction.DIRECTION_TO_INDEX[player.orientation]
+                    if player.held_object is not None:
+                        held[state_idx, i] = OBJ_TO_IDX[player.held_object.name]
+                # Counter objects come after the dispensers in the candidate lists, in the order of state.objects
+                for obj_idx, obj in enumerate(state.objects.values()):
+                    if obj.position in counters and obj.name in ("onion", "dish", "soup"):
+                        num_dispensers = len(onion_dispensers) if obj.name == "onion" else len(dish_dispensers) if obj.name == "dish" else 0
+                        ranks[state_idx, CLOSEST_FEATURES.index(obj.name), feature_idxs[obj.position]] = num_dispensers + obj_idx
+                for rank, pot_pos in enumerate(self.get_pot_locations()):
+                    status = state.soup_status(pot_pos) or "empty"
+                    if status in POT_FEATURES:
+                        ranks[state_idx, POT_FEATURES[status], feature_idxs[pot_pos]] = rank
+
+            player_features = np.zeros((n, num_players, num_player_features), dtype=np.float32)
+            state_idxs = np.arange(n)
+            for i in range(num_players):
+                player_features[state_idxs, i, orientations[:, i]] = 1
+                has_obj = held[:, i] >= 0
+                player_features[state_idxs[has_obj], i, 4 + held[has_obj, i]] = 1
+
+                # Closest features: lowest distance, then lowest rank in the candidate list
+                position_idxs = positions[:, i, 0] + positions[:, i, 1] * self.width
+                distances = distance_table[position_idxs * num_directions + orientations[:, i]]
+                keys = distances[:, None, :] * (2 * num_features + 1) + ranks
+                closest = np.argmin(keys, axis=-1)
+                found = np.isfinite(np.take_along_axis(keys, closest[..., None], axis=-1)[..., 0])
+                deltas = (feature_positions[closest] - positions[:, None, i]) * found[..., None]
+                for obj_name in ["onion", "dish", "soup"]:
+                    # Players don't look for objects of the type they are holding
+                    deltas[held[:, i] == OBJ_TO_IDX[obj_name], CLOSEST_FEATURES.index(obj_name)] = 0
+                player_features[:, i, 7:25] = deltas.reshape(n, -1)
+                player_features[:, i, 25:29] = walls[position_idxs]
+
+            for i in range(num_players):
+                others = [j for j in range(num_players) if j != i]
+                others_end = num_players * num_player_features
+                chunk_features = features[chunk_start:chunk_start + n, i]
+                chunk_features[:, :num_player_features] = player_features[:, i]
+                chunk_features[:, num_player_features:others_end] = player_features[:, others].reshape(n, -1)
+                chunk_features[:, others_end:-2] = (positions[:, others] - positions[:, None, i]).reshape(n, -1)
+                chunk_features[:, -2:] = positions[:, i]
+        return features
 
     def get_deltas_to_closest_location(self, player, locations, mlam):
         _, closest_loc = mlam.motion_planner.min_cost_to_feature(player.pos_and_or, locations, with_argmin=True)
@@ -2102,16 +3374,9 @@ class OvercookedGridworld(object):
         Returns
             phi(state), the potential of the state
         """
-        if not hasattr(Recipe, '_tomato_value') or not hasattr(Recipe, '_onion_value'):
-            raise ValueError("Potential function requires Recipe onion and tomato values to work properly")
-
         # Constants needed for potential function
-        potential_params = {
-            'gamma' : gamma,
-            'tomato_value' : Recipe._tomato_value if Recipe._tomato_value else 13,
-            'onion_value' : Recipe._onion_value if Recipe._tomato_value else 21,
-            **POTENTIAL_CONSTANTS.get(self.layout_name, POTENTIAL_CONSTANTS['default'])
-        }
+        recipe_context = self.recipe_context
+        potential_params = self._get_potential_params(gamma)
         pot_states = self.get_pot_states(state)
 
         # Base potential value is the geometric sum of making optimal soups infinitely
@@ -2124,7 +3389,7 @@ class OvercookedGridworld(object):
         # Get list of all soups that have >0 ingredients, sorted based on value of best possible recipe 
         idle_soups = [state.get_object(pos) for pos in self.get_full_but_not_cooking_pots(pot_states)]
         idle_soups.extend([state.get_object(pos) for pos in self.get_partially_full_pots(pot_states)])
-        idle_soups = sorted(idle_soups, key=lambda soup : self.get_optimal_possible_recipe(state, Recipe(soup.ingredients), discounted=True, potential_params=potential_params, return_value=True)[1], reverse=True)
+        idle_soups = sorted(idle_soups, key=lambda soup : self.get_optimal_possible_recipe(state, Recipe.from_id(soup.recipe_id), discounted=True, potential_params=potential_params, return_value=True)[1], reverse=True)
 
         # Build mapping of non_idle soups to the potential value each one will contribue
         # Default potential value is maximimal discount for last two steps applied to optimal recipe value
@@ -2196,7 +3461,7 @@ class OvercookedGridworld(object):
         # Iterate over idle soups in decreasing order of value so we greedily prioritize higher valued soups
         for soup in idle_soups:
             # Calculate optimal recipe
-            curr_recipe = Recipe(soup.ingredients)
+            curr_recipe = Recipe.from_id(soup.recipe_id)
             opt_recipe = self.get_optimal_possible_recipe(state, curr_recipe, discounted=True, potential_params=potential_params)
 
             # Calculate missing ingredients needed to complete optimal recipe
@@ -2205,7 +3470,7 @@ class OvercookedGridworld(object):
                 missing_ingredients.remove(ingredient)
 
             # Base discount for steps 3-4
-            discount = gamma**(max(potential_params['max_pickup_steps'], opt_recipe.time) + potential_params['max_delivery_steps'])
+            discount = gamma**(max(potential_params['max_pickup_steps'], recipe_context.recipe_time(opt_recipe)) + potential_params['max_delivery_steps'])
 
             # Add a multiplicative discount for each needed ingredient (this has the effect of giving more award to soups
             # that are closer to being completed)
@@ -2262,6 +3527,180 @@ class OvercookedGridworld(object):
         # At last
         return potential
 
+    def _get_potential_params(self, gamma):
+        recipe_context = self.recipe_context
+        return {
+            'gamma' : gamma,
+            'tomato_value' : recipe_context.tomato_value if recipe_context.tomato_value else 13,
+            'onion_value' : recipe_context.onion_value if recipe_context.tomato_value else 21,
+            **POTENTIAL_CONSTANTS.get(self.layout_name, POTENTIAL_CONSTANTS['default'])
+        }
+
+    def potential_function_batch(self, states, mp, gamma=0.99, chunk_size=1024):
+        """
+        potential_function of many states at once, as a np.float64 array that matches it up to float rounding.
+
+        States are only scanned once for their players and pot statuses. The distances of all players to all pots
+        and serving locations are then looked up in the distance table of the motion planner (see
+        MotionPlanner.get_feature_distance_table), and the best possible recipes and their values in tables built
+        once per call, so that the greedy steps of potential_function are evaluated for all states of a chunk at
+        once. Ties are broken like in potential_function (e.g. between equally close players).
+        """
+        HELD = { None : 0, Recipe.ONION : 1, Recipe.TOMATO : 2, "dish" : 3, "soup" : 4 }
+        EMPTY, IDLE, COOKING, READY = range(4)
+        recipe_context = self.recipe_context
+        potential_params = self._get_potential_params(gamma)
+        max_delivery_steps, max_pickup_steps = potential_params['max_delivery_steps'], potential_params['max_pickup_steps']
+        pot_onion_steps, pot_tomato_steps = potential_params['pot_onion_steps'], potential_params['pot_tomato_steps']
+        num_directions = len(Direction.ALL_DIRECTIONS)
+        potentials = np.zeros(len(states))
+        if not len(states):
+            return potentials
+
+        # Distances (including the interact action) from every player position and orientation to every pot and
+        # to the closest serving location
+        distance_table, feature_positions = mp.get_feature_distance_table()
+        feature_idxs = { pos : idx for idx, pos in enumerate(feature_positions) }
+        pot_locations = self.get_pot_locations()
+        num_pots = len(pot_locations)
+        pot_idxs = { pos : idx for idx, pos in enumerate(pot_locations) }
+        pot_distances = distance_table[:, [feature_idxs[pos] for pos in pot_locations]] + 1
+        serving_idxs = [feature_idxs[pos] for pos in self.terrain_pos_dict['S']]
+        serving_distances = distance_table[:, serving_idxs].min(axis=1, initial=np.Inf) + 1
+
+        # Best possible recipes and their discounted values by recipe id of the current ingredients (shared by all
+        # states, like the cache of get_optimal_possible_recipe), with the missing ingredients and cook times
+        num_recipe_ids = max(recipe.id for recipe in recipe_context.all_recipes) + 1
+        opt_recipe_ids = np.zeros(num_recipe_ids, dtype=np.int64)
+        opt_discounted_values = np.zeros(num_recipe_ids)
+        missing_onions = np.zeros(num_recipe_ids, dtype=np.int64)
+        missing_tomatoes = np.zeros(num_recipe_ids, dtype=np.int64)
+        opt_cook_times = np.zeros(num_recipe_ids)
+        for recipe in recipe_context.all_recipes:
+            opt_recipe, value = self.get_optimal_possible_recipe(states[0], recipe, discounted=True, potential_params=potential_params, return_value=True)
+            opt_recipe_ids[recipe.id], opt_discounted_values[recipe.id] = opt_recipe.id, value
+            missing_onions[recipe.id] = opt_recipe.ingredients.count(Recipe.ONION) - recipe.ingredients.count(Recipe.ONION)
+            missing_tomatoes[recipe.id] = opt_recipe.ingredients.count(Recipe.TOMATO) - recipe.ingredients.count(Recipe.TOMATO)
+            opt_cook_times[recipe.id] = recipe_context.recipe_time(opt_recipe)
+        base_recipe, base_discounted_value = self.get_optimal_possible_recipe(states[0], None, discounted=True, potential_params=potential_params, return_value=True)
+        # Recipe values depend on the orders of the state, which are shared by the states of an episode
+        recipe_values_by_orders = {}
+
+        for chunk_start in range(0, len(states), chunk_size):
+            chunk = states[chunk_start:chunk_start + chunk_size]
+            n = len(chunk)
+            num_players = len(chunk[0].players)
+            start_idxs = np.zeros((n, num_players), dtype=np.int64)
+            held = np.zeros((n, num_players), dtype=np.int64)
+            held_recipe_ids = np.zeros((n, num_players), dtype=np.int64)
+            pot_statuses = np.full((n, num_pots), EMPTY, dtype=np.int64)
+            pot_recipe_ids = np.zeros((n, num_pots), dtype=np.int64)
+            cook_times_remaining = np.zeros((n, num_pots))
+            # Order of the idle soups in potential_function before they are sorted by value
+            idle_ranks = np.full((n, num_pots), num_pots, dtype=np.int64)
+            recipe_values = np.zeros((n, num_recipe_ids))
+            base_values = np.zeros(n)
+            for state_idx, state in enumerate(chunk):
+                for i, player in enumerate(state.players):
+                    start_idxs[state_idx, i] = self.get_position_index(player.position) * num_directions + Direction.DIRECTION_TO_INDEX[player.orientation]
+                    if player.held_object is not None:
+                        held[state_idx, i] = HELD[player.held_object.name]
+                        if player.held_object.name == "soup":
+                            held_recipe_ids[state_idx, i] = player.held_object.recipe_id
+                pot_states = self.get_pot_states(state)
+                idle_pots = self.get_full_but_not_cooking_pots(pot_states) + self.get_partially_full_pots(pot_states)
+                for rank, pos in enumerate(idle_pots):
+                    idle_ranks[state_idx, pot_idxs[pos]] = rank
+                for status, pot_positions in pot_states.items():
+                    for pos in pot_positions:
+                        if status == 'empty':
+                            continue
+                        soup = state.get_object(pos)
+                        pot_idx = pot_idxs[pos]
+                        pot_statuses[state_idx, pot_idx] = READY if status == 'ready' else COOKING if status == 'cooking' else IDLE
+                        pot_recipe_ids[state_idx, pot_idx] = soup.recipe_id
+                        if not soup.is_idle:
+                            cook_times_remaining[state_idx, pot_idx] = soup.cook_time - soup._cooking_tick
+                # Orders are interned, so states with the same orders share the very same tuples
+                orders = (id(state.all_orders), id(state.bonus_orders))
+                if orders not in recipe_values_by_orders:
+                    recipe_values_by_orders[orders] = (
+                        np.array([self.get_recipe_value(state, Recipe.from_id(recipe_id)) for recipe_id in range(num_recipe_ids)], dtype=float),
+                        self.get_recipe_value(state, base_recipe)
+                    )
+                recipe_values[state_idx], base_values[state_idx] = recipe_values_by_orders[orders]
+
+            state_idxs = np.arange(n)
+            # (n, num_players, num_pots) distances of all players to all pots
+            player_pot_distances = pot_distances[start_idxs]
+            bumped_values = np.maximum(recipe_values, 1)
+
+            # Base potential value is the geometric sum of making optimal soups infinitely
+            discount = base_discounted_value / base_values
+            potential = (discount / (1 - discount)) * base_values
+
+            ### Step 4 potential ###
+            holding_soup = held == HELD["soup"]
+            delivery_values = gamma**np.minimum(serving_distances[start_idxs], max_delivery_steps) * np.take_along_axis(bumped_values, held_recipe_ids, axis=1)
+            potential = potential + (delivery_values * holding_soup).sum(axis=1)
+
+            ### Step 3 potential ###
+            non_idle = (pot_statuses == COOKING) | (pot_statuses == READY)
+            pot_values = np.take_along_axis(bumped_values, pot_recipe_ids, axis=1)
+            non_idle_values = gamma**(max_delivery_steps + np.maximum(max_pickup_steps, cook_times_remaining)) * pot_values
+            # Players holding dishes consider cooking soups before ready ones, each in the order of the pots
+            non_idle_order = np.argsort(np.where(pot_statuses == READY, num_pots, 0) + np.arange(num_pots), axis=1, kind='stable')
+            pickup_soup_values = gamma**max_delivery_steps * pot_values
+            for i in range(num_players):
+                pickup_distances = player_pot_distances[:, i]
+                is_useful = pickup_distances < np.inf
+                pickup_values = gamma**np.maximum(cook_times_remaining, np.minimum(pickup_distances, max_pickup_steps)) * pickup_soup_values * is_useful
+                pickup_values = np.where(non_idle & is_useful, pickup_values, 0)
+                best = np.take_along_axis(non_idle_order, np.argmax(np.take_along_axis(pickup_values, non_idle_order, axis=1), axis=1)[:, None], axis=1)[:, 0]
+                best_values = pickup_values[state_idxs, best]
+                has_best = (held[:, i] == HELD["dish"]) & (best_values > 0)
+                non_idle_values[state_idxs[has_best], best[has_best]] = np.maximum(non_idle_values[state_idxs[has_best], best[has_best]], best_values[has_best])
+            potential = potential + (non_idle_values * non_idle).sum(axis=1)
+
+            ### Step 2 potential ###
+            idle = pot_statuses == IDLE
+            idle_values = np.where(idle, opt_discounted_values[pot_recipe_ids], 0)
+            # Idle soups in decreasing order of value, with the remaining pots last
+            idle_order = np.lexsort((idle_ranks, -idle_values, ~idle), axis=1)
+            # Players holding ingredients that weren't used for a soup yet
+            available = { Recipe.ONION : held == HELD[Recipe.ONION], Recipe.TOMATO : held == HELD[Recipe.TOMATO] }
+            holding_nothing = held == HELD[None]
+            for k in range(num_pots):
+                pot = idle_order[:, k]
+                is_idle = idle[state_idxs, pot]
+                recipe_ids = pot_recipe_ids[state_idxs, pot]
+                opt_ids = opt_recipe_ids[recipe_ids]
+                distances = player_pot_distances[state_idxs, :, pot]
+                discount = gamma**(np.maximum(max_pickup_steps, opt_cook_times[recipe_ids]) + max_delivery_steps)
+                for ingredient, missing, pot_steps in [(Recipe.ONION, missing_onions[recipe_ids], pot_onion_steps), (Recipe.TOMATO, missing_tomatoes[recipe_ids], pot_tomato_steps)]:
+                    for j in range(recipe_context.max_num_ingredients):
+                        needed = is_idle & (j < missing)
+                        # Closest player with the ingredient, the first one in case of a tie
+                        candidate_distances = np.where(available[ingredient] & needed[:, None], distances, np.inf)
+                        closest = np.argmin(candidate_distances, axis=1)
+                        dist = candidate_distances[state_idxs, closest]
+                        discount = np.where(needed, discount * gamma**np.minimum(dist, pot_steps), discount)
+                        available[ingredient][state_idxs[dist < np.inf], closest[dist < np.inf]] = False
+                has_missing = (missing_onions[recipe_ids] + missing_tomatoes[recipe_ids]) > 0
+                cook_dist = np.where(holding_nothing, distances, np.inf).min(axis=1)
+                discount = np.where(has_missing, discount * gamma, discount * gamma**np.minimum(cook_dist, max_pickup_steps))
+                potential = potential + np.where(is_idle, discount * bumped_values[state_idxs, opt_ids], 0)
+
+            ### Step 1 potential ###
+            empty_pot_distances = np.where((pot_statuses == EMPTY)[:, None, :], player_pot_distances, np.inf).min(axis=2)
+            is_useful = empty_pot_distances < np.inf
+            for ingredient, pot_steps, value in [(Recipe.TOMATO, pot_tomato_steps, potential_params['tomato_value']), (Recipe.ONION, pot_onion_steps, potential_params['onion_value'])]:
+                discount = gamma**(np.minimum(pot_steps, empty_pot_distances) + max_pickup_steps + max_delivery_steps) * is_useful
+                potential = potential + (discount * value * available[ingredient]).sum(axis=1)
+
+            potentials[chunk_start:chunk_start + n] = potential
+        return potentials
+
     ##############
     # DEPRECATED #
     ##############
@@ -0,0 +1,266 @@
+import os, json, itertools
+import numpy as np
+import scipy.sparse
+from overcooked_ai_py.mdp.actions import Action
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedStateCodec, EVENT_LEVEL_OFF
+
+
+class TabularOvercookedGridworld(object):
+    """
+    The states of an OvercookedGridworld that are reachable from a start state (with its fixed orders),
+    compiled into a tabular MDP. States are time independent and get integer ids in the order they are found
+    by a breadth first search, so the start state has id 0. Transitions are deterministic, so for every state
+    id s and joint action index a (into `joint_actions`) only the id of the next state and the rewards of the
+    transition are stored:
+
+        next_state_ids[s, a], sparse_rewards[s, a], shaped_rewards[s, a]
+
+    `transition_matrix(a)` and `reward_matrix(a)` return them as scipy.sparse matrices.
+
+    States are kept as their OvercookedStateCodec encodings (with timestep 0). The search keeps a dict from
+    the time independent encodings of the states found so far to their ids in memory. When built with a
+    `save_dir`, encodings and transitions are streamed to files in it during the search and the arrays are
+    memory mapped from there, so that transitions (which outnumber states by the number of joint actions)
+    don't have to fit in memory.
+    """
+
+    STATES_FILE = "states.bin"
+    NEXT_STATE_IDS_FILE = "next_state_ids.bin"
+    SPARSE_REWARDS_FILE = "sparse_rewards.bin"
+    SHAPED_REWARDS_FILE = "shaped_rewards.bin"
+    INFO_FILE = "info.json"
+
+    def __init__(self, mdp, states, next_state_ids, sparse_rewards, shaped_rewards, state_ids=None):
+        """
+        mdp (OvercookedGridworld): The layout and dynamics the states were enumerated with
+        states (np.ndarray): (num_states, codec.num_bytes) np.uint8 codec encodings of the states
+        next_state_ids (np.ndarray): (num_states, num_joint_actions) np.int32
+        sparse_rewards, shaped_rewards (np.ndarray): (num_states, num_joint_actions) np.float32
+        state_ids (dict): Time independent encodings to state ids, built on first use if not given
+        """
+        self.mdp = mdp
+        self.codec = OvercookedStateCodec(mdp)
+        self.joint_actions = self.get_joint_actions(mdp.num_players)
+        self.states = states
+        self.next_state_ids = next_state_ids
+        self.sparse_rewards = sparse_rewards
+        self.shaped_rewards = shaped_rewards
+        self.num_states = len(states)
+        self._joint_action_idxs = { joint_action : idx for idx, joint_action in enumerate(self.joint_actions) }
+        self._state_ids = state_ids
+
+    @staticmethod
+    def get_joint_actions(num_players):
+        return list(itertools.product(Action.ALL_ACTIONS, repeat=num_players))
+
+    @staticmethod
+    def from_mdp(mdp, start_state=None, save_dir=None, max_states=None, chunk_size=1000, info=False):
+        """
+        Enumerates all states reachable from `start_state` (mdp.get_standard_start_state() by default) with a
+        breadth first search and compiles them into a TabularOvercookedGridworld.
+
+        save_dir (str): If given, states and transitions are streamed to files in this directory (see `load`)
+        max_states (int): Raises a ValueError once more states than this are found, as the number of reachable
+            states grows quickly with the size of the layout (mostly because of objects placed on counters)
+        chunk_size (int): Number of states expanded at a time, which bounds the memory used for transitions
+            that haven't been written out yet
+        """
+        start_state = start_state if start_state is not None else mdp.get_standard_start_state()
+        codec = OvercookedStateCodec(mdp)
+        joint_actions = TabularOvercookedGridworld.get_joint_actions(mdp.num_players)
+        timestep_bytes = bytes(codec.TIMESTEP_BYTES)
+
+        writer = _TabularWriter(save_dir, codec.num_bytes)
+        state_ids = {}
+
+        def get_id(state):
+            key = codec.encode(state)[codec.TIMESTEP_BYTES:]
+            state_id = state_ids.get(key)
+            if state_id is None:
+                state_id = state_ids[key] = len(state_ids)
+                if max_states is not None and state_id >= max_states:
+                    raise ValueError("Found more than {} reachable states after expanding {}".format(max_states, num_expanded))
+                writer.write_state(timestep_bytes + key)
+            return state_id
+
+        num_expanded = 0
+        try:
+            get_id(start_state)
+            while num_expanded < len(state_ids):
+                chunk = writer.read_states(num_expanded, min(len(state_ids), num_expanded + chunk_size))
+                next_state_ids = np.zeros((len(chunk), len(joint_actions)), dtype=np.int32)
+                sparse_rewards = np.zeros((len(chunk), len(joint_actions)), dtype=np.float32)
+                shaped_rewards = np.zeros((len(chunk), len(joint_actions)), dtype=np.float32)
+                for i, row in enumerate(chunk):
+                    state = codec.decode(row)
+                    for a, joint_action in enumerate(joint_actions):
+                        # Only the rewards of the transitions are kept, so events aren't logged
+                        next_state, infos = mdp.get_state_transition(state, joint_action, event_level=EVENT_LEVEL_OFF)
+                        next_state_ids[i, a] = get_id(next_state)
+                        sparse_rewards[i, a] = sum(infos["sparse_reward_by_agent"])
+                        shaped_rewards[i, a] = sum(infos["shaped_reward_by_agent"])
+                writer.write_transitions(next_state_ids, sparse_rewards, shaped_rewards)
+                num_expanded += len(chunk)
+                if info:
+                    print("Expanded {} states, found {}".format(num_expanded, len(state_ids)))
+
+            arrays = writer.finish(len(joint_actions))
+        finally:
+            writer.close()
+        return TabularOvercookedGridworld(mdp, *arrays, state_ids=state_ids)
+
+    @staticmethod
+    def load(save_dir, mdp):
+        """Memory maps a TabularOvercookedGridworld that `from_mdp` streamed to `save_dir`"""
+        with open(os.path.join(save_dir, TabularOvercookedGridworld.INFO_FILE), "r") as f:
+            saved_info = json.load(f)
+        num_states, num_joint_actions = saved_info["num_states"], saved_info["num_joint_actions"]
+        codec = OvercookedStateCodec(mdp)
+        if saved_info["num_bytes"] != codec.num_bytes or num_joint_actions != Action.NUM_ACTIONS**mdp.num_players:
+            raise ValueError("States in {} weren't enumerated with an mdp of this layout".format(save_dir))
+
+        def memmap(filename, dtype, shape):
+            return np.memmap(os.path.join(save_dir, filename), dtype=dtype, mode='r', shape=shape)
+
+        return TabularOvercookedGridworld(
+            mdp,
+            memmap(TabularOvercookedGridworld.STATES_FILE, np.uint8, (num_states, codec.num_bytes)),
+            memmap(TabularOvercookedGridworld.NEXT_STATE_IDS_FILE, np.int32, (num_states, num_joint_actions)),
+            memmap(TabularOvercookedGridworld.SPARSE_REWARDS_FILE, np.float32, (num_states, num_joint_actions)),
+            memmap(TabularOvercookedGridworld.SHAPED_REWARDS_FILE, np.float32, (num_states, num_joint_actions))
+        )
+
+    @property
+    def num_joint_actions(self):
+        return len(self.joint_actions)
+
+    def get_state(self, state_id):
+        """The OvercookedState with id `state_id` (at timestep 0)"""
+        return self.codec.decode(self.states[state_id])
+
+    def get_state_id(self, state):
+        """The id of `state`, ignoring its timestep. Raises a KeyError for states that aren't reachable"""
+        if self._state_ids is None:
+            t = self.codec.TIMESTEP_BYTES
+            self._state_ids = { row[t:].tobytes() : state_id for state_id, row in enumerate(self.states) }
+        return self._state_ids[self.codec.encode(state)[self.codec.TIMESTEP_BYTES:]]
+
+    def get_joint_action_idx(self, joint_action):
+        return self._joint_action_idxs[tuple(joint_action)]
+
+    def get_next_state_id(self, state_id, joint_action):
+        return int(self.next_state_ids[state_id, self.get_joint_action_idx(joint_action)])
+
+    def transition_matrix(self, joint_action_idx):
+        """(num_states, num_states) scipy.sparse.csr_matrix of the transition probabilities of a joint action"""
+        next_state_ids = np.asarray(self.next_state_ids[:, joint_action_idx])
+        ones = np.ones(self.num_states, dtype=np.float32)
+        return scipy.sparse.csr_matrix((ones, (np.arange(self.num_states), next_state_ids)), shape=(self.num_states, self.num_states))
+
+    def reward_matrix(self, joint_action_idx, shaped_reward_coeff=0):
+        """
+        (num_states, num_states) scipy.sparse.csr_matrix of the rewards of the transitions of a joint action,
+        sparse rewards plus `shaped_reward_coeff` times shaped rewards
+        """
+        rewards = self.get_rewards(shaped_reward_coeff)[:, joint_action_idx]
+        next_state_ids = np.asarray(self.next_state_ids[:, joint_action_idx])
+        nonzero = np.nonzero(rewards)[0]
+        return scipy.sparse.csr_matrix((rewards[nonzero], (nonzero, next_state_ids[nonzero])), shape=(self.num_states, self.num_states))
+
+    def get_rewards(self, shaped_reward_coeff=0):
+        """(num_states, num_joint_actions) rewards of all transitions"""
+        rewards = np.asarray(self.sparse_rewards, dtype=np.float64)
+        if shaped_reward_coeff:
+            rewards = rewards + shaped_reward_coeff * np.asarray(self.shaped_rewards, dtype=np.float64)
+        return rewards
+
+    def value_iteration(self, gamma=0.99, horizon=None, shaped_reward_coeff=0, epsilon=1e-6, max_iters=10000):
+        """
+        Optimal values of all states and the index of a greedy joint action in every state.
+
+        With a `horizon`, the values are the optimal (discounted with gamma, which can then be 1) returns of the
+        next `horizon` steps: e.g. values[0] with gamma=1 and horizon=400 is an upper bound on the sparse reward
+        of any pair of agents in a 400 step episode from the start state. Otherwise iterates until values change
+        by less than `epsilon`.
+        """
+        rewards = self.get_rewards(shaped_reward_coeff)
+        next_state_ids = np.asarray(self.next_state_ids)
+        values = np.zeros(self.num_states)
+        q_values = rewards
+        num_iters = horizon if horizon is not None else max_iters
+        for _ in range(num_iters):
+            q_values = rewards + gamma * values[next_state_ids]
+            new_values = q_values.max(axis=1)
+            converged = horizon is None and np.abs(new_values - values).max() < epsilon
+            values = new_values
+            if converged:
+                break
+        return values, q_values.argmax(axis=1)
+
+
+class _TabularWriter(object):
+    """Accumulates the results of TabularOvercookedGridworld.from_mdp in memory or streams them to files"""
+
+    def __init__(self, save_dir, num_bytes):
+        self.save_dir = save_dir
+        self.num_bytes = num_bytes
+        self.num_states = 0
+        if save_dir is None:
+            self._states = bytearray()
+            self._transitions = []
+        else:
+            os.makedirs(save_dir, exist_ok=True)
+            self._states_file = open(self._path(TabularOvercookedGridworld.STATES_FILE), "wb")
+            self._transition_files = [open(self._path(filename), "wb") for filename in (
+                TabularOvercookedGridworld.NEXT_STATE_IDS_FILE,
+                TabularOvercookedGridworld.SPARSE_REWARDS_FILE,
+                TabularOvercookedGridworld.SHAPED_REWARDS_FILE)]
+
+    def _path(self, filename):
+        return os.path.join(self.save_dir, filename)
+
+    def write_state(self, encoding):
+        self.num_states += 1
+        if self.save_dir is None:
+            self._states += encoding
+        else:
+            self._states_file.write(encoding)
+
+    def read_states(self, start, end):
+        """(end - start, num_bytes) np.uint8 encodings of the states with ids in [start, end)"""
+        if self.save_dir is None:
+            data = bytes(self._states[start * self.num_bytes:end * self.num_bytes])
+        else:
+            self._states_file.flush()
+            with open(self._path(TabularOvercookedGridworld.STATES_FILE), "rb") as f:
+                f.seek(start * self.num_bytes)
+                data = f.read((end - start) * self.num_bytes)
+        return np.frombuffer(data, dtype=np.uint8).reshape(end - start, self.num_bytes)
+
+    def write_transitions(self, *arrays):
+        if self.save_dir is None:
+            self._transitions.append(arrays)
+        else:
+            for f, array in zip(self._transition_files, arrays):
+                f.write(array.tobytes())
+
+    def close(self):
+        if self.save_dir is not None:
+            for f in [self._states_file] + self._transition_files:
+                f.close()
+
+    def finish(self, num_joint_actions):
+        """The states, next state ids, sparse rewards and shaped rewards arrays"""
+        if self.save_dir is None:
+            states = np.frombuffer(bytes(self._states), dtype=np.uint8).reshape(self.num_states, self.num_bytes)
+            return (states,) + tuple(np.concatenate(arrays) for arrays in zip(*self._transitions))
+
+        self.close()
+        with open(self._path(TabularOvercookedGridworld.INFO_FILE), "w") as f:
+            json.dump({ "num_states" : self.num_states, "num_joint_actions" : num_joint_actions, "num_bytes" : self.num_bytes }, f)
+        states = np.memmap(self._path(TabularOvercookedGridworld.STATES_FILE), dtype=np.uint8, mode='r', shape=(self.num_states, self.num_bytes))
+        return (states,) + tuple(
+            np.memmap(self._path(filename), dtype=dtype, mode='r', shape=(self.num_states, num_joint_actions))
+            for filename, dtype in ((TabularOvercookedGridworld.NEXT_STATE_IDS_FILE, np.int32),
+                                    (TabularOvercookedGridworld.SPARSE_REWARDS_FILE, np.float32),
+                                    (TabularOvercookedGridworld.SHAPED_REWARDS_FILE, np.float32)))
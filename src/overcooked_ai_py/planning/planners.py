@@ -4,7 +4,7 @@ import pickle, time
 from overcooked_ai_py.utils import manhattan_distance
 from overcooked_ai_py.planning.search import Graph, NotConnectedError
 from overcooked_ai_py.mdp.actions import Action, Direction
-from overcooked_ai_py.mdp.overcooked_mdp import OvercookedState, PlayerState, OvercookedGridworld, EVENT_TYPES
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedState, PlayerState, OvercookedGridworld, EVENT_LEVEL_OFF
 from overcooked_ai_py.data.planners import load_saved_action_manager, load_saved_motion_planner, PLANNERS_DIR
 
 # Run planning logic with additional checks and
@@ -260,7 +260,7 @@ class MotionPlanner(object):
     def _get_valid_successor_motion_states(self, start_motion_state):
         """Get valid motion states one action away from the starting motion state."""
         start_position, start_orientation = start_motion_state
-        return [(action, self.mdp._move_if_direction(start_position, start_orientation, action)) for action in Action.ALL_ACTIONS]
+        return list(self.mdp.get_motion_transitions(start_position, start_orientation).items())
 
     def min_cost_between_features(self, pos_list1, pos_list2, manhattan_if_fail=False):
         """
@@ -292,19 +292,19 @@ class MotionPlanner(object):
         """
         Determines the minimum number of timesteps necessary for a player to go from the starting
         position and orientation to any feature in feature_pos_list and perform an interact action
+
+        debug is ignored, it is only kept so that existing callers passing it keep working
         """
         start_pos = start_pos_and_or[0]
         assert self.mdp.get_terrain_type_at_pos(start_pos) != 'X'
+        feature_distances = self.get_feature_distances(start_pos_and_or)
         min_dist = np.Inf
         best_feature = None
         for feature_pos in feature_pos_list:
-            for feature_goal in self.motion_goals_for_pos[feature_pos]:
-                if not self.is_valid_motion_start_goal_pair(start_pos_and_or, feature_goal, debug=debug):
-                    continue
-                curr_dist = self.get_gridworld_distance(start_pos_and_or, feature_goal)
-                if curr_dist < min_dist:
-                    best_feature = feature_pos
-                    min_dist = curr_dist
+            curr_dist = feature_distances[feature_pos]
+            if curr_dist < min_dist:
+                best_feature = feature_pos
+                min_dist = curr_dist
         # +1 to account for interaction action
         min_cost = min_dist + 1
         if with_argmin:
@@ -312,6 +312,42 @@ class MotionPlanner(object):
             return min_cost, best_feature
         return min_cost
 
+    def get_feature_distances(self, start_pos_and_or):
+        """
+        Returns a dict mapping every terrain feature position to the minimum gridworld distance from
+        `start_pos_and_or` to any of its valid motion goals (np.Inf if there is none). Computed once per
+        start and cached, so that min_cost_to_feature only has to look distances up.
+        """
+        if getattr(self, '_feature_distances', None) is None:
+            self._feature_distances = {}
+        feature_distances = self._feature_distances.get(start_pos_and_or)
+        if feature_distances is None:
+            feature_distances = self._feature_distances[start_pos_and_or] = {}
+            for feature_pos, feature_goals in self.motion_goals_for_pos.items():
+                min_dist = np.Inf
+                for feature_goal in feature_goals:
+                    if self.is_valid_motion_start_goal_pair(start_pos_and_or, feature_goal):
+                        min_dist = min(min_dist, self.get_gridworld_distance(start_pos_and_or, feature_goal))
+                feature_distances[feature_pos] = min_dist
+        return feature_distances
+
+    def get_feature_distance_table(self):
+        """
+        The distances of `get_feature_distances` for all starts at once, as a (width * height * 4, num features)
+        float array indexed by mdp.get_position_index(pos) * 4 + orientation index and by the index of the feature
+        in the returned list of feature positions. Starts that aren't valid player positions are at np.Inf.
+        """
+        if getattr(self, '_feature_distance_table', None) is None:
+            feature_positions = list(self.motion_goals_for_pos.keys())
+            table = np.full((self.mdp.width * self.mdp.height * len(Direction.ALL_DIRECTIONS), len(feature_positions)), np.Inf)
+            for pos in self.mdp.get_valid_player_positions():
+                for orientation_idx, orientation in enumerate(Direction.INDEX_TO_DIRECTION):
+                    feature_distances = self.get_feature_distances((pos, orientation))
+                    table[self.mdp.get_position_index(pos) * len(Direction.ALL_DIRECTIONS) + orientation_idx] = \
+                        [feature_distances[feature_pos] for feature_pos in feature_positions]
+            self._feature_distance_table = (table, feature_positions)
+        return self._feature_distance_table
+
     def _get_goal_dict(self):
         """Creates a dictionary of all possible goal states for all possible
         terrain features that the agent might want to interact with."""
@@ -673,7 +709,7 @@ class JointMotionPlanner(object):
         # Also assumes can't deliver more than two orders in one motion goal
         # (otherwise Environment will terminate)
         from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv
-        dummy_state = OvercookedState.from_players_pos_and_or(joint_start_state, all_orders=self.mdp.start_all_orders)
+        dummy_state = OvercookedState.from_players_pos_and_or(joint_start_state, all_orders=self.mdp.start_all_orders, recipe_context=self.mdp.recipe_context)
         env = OvercookedEnv.from_mdp(self.mdp, horizon=200) # Plans should be shorter than 200 timesteps, or something is likely wrong
         successor_state, is_done = env.execute_plan(dummy_state, joint_action_plan)
         assert not is_done
@@ -719,10 +755,11 @@ class JointMotionPlanner(object):
         
         # Under assumption that orientation doesn't matter
         dummy_orientation = Direction.NORTH
-        dummy_player_states = [PlayerState(pos, dummy_orientation) for pos in starting_positions]
+        starting_positions = tuple(starting_positions)
+        player_transitions = [self.mdp.get_motion_transitions(pos, dummy_orientation) for pos in starting_positions]
         for joint_action in joint_motion_actions:
-            new_positions, _ = self.mdp.compute_new_positions_and_orientations(dummy_player_states, joint_action)
-            successor_joint_positions[joint_action] = new_positions
+            new_positions = tuple(transitions[a][0] for transitions, a in zip(player_transitions, joint_action))
+            successor_joint_positions[joint_action] = self.mdp._handle_collisions(starting_positions, new_positions)
         return successor_joint_positions
 
     def derive_state(self, start_state, end_pos_and_ors, action_plans):
@@ -743,17 +780,16 @@ class JointMotionPlanner(object):
         
         end_state.players = tuple(end_players)
 
-        # Resolve environment effects for t - 1 turns
+        # Resolve environment effects for t - 1 turns at once
         plan_length = len(action_plans)
         assert plan_length > 0
-        for _ in range(plan_length - 1):
-            self.mdp.step_environment_effects(end_state)
+        self.mdp.step_environment_effects(end_state, plan_length - 1)
 
         # Interacts
         last_joint_action = tuple(a if a == Action.INTERACT else Action.STAY for a in action_plans[-1])
 
-        events_dict = { k : [ [] for _ in range(self.mdp.num_players) ] for k in EVENT_TYPES }
-        self.mdp.resolve_interacts(end_state, last_joint_action, events_dict)
+        event_bitmasks = [0] * self.mdp.num_players
+        self.mdp.resolve_interacts(end_state, last_joint_action, event_bitmasks, EVENT_LEVEL_OFF)
         self.mdp.resolve_movement(end_state, last_joint_action)
         self.mdp.step_environment_effects(end_state)
         return end_state
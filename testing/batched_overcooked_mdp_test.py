@@ -0,0 +1,70 @@
+import unittest
+import numpy as np
+from overcooked_ai_py.mdp.actions import Action, Direction
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, OvercookedState, PlayerState, ObjectState, SoupState, Recipe, EVENT_TYPES
+from overcooked_ai_py.mdp.batched_overcooked_mdp import BatchedOvercookedGridworld
+
+# Random actions that interact a lot, so that soups get cooked and delivered
+ACTION_PROBS = [0.12, 0.12, 0.12, 0.12, 0.08, 0.44]
+
+
+class TestBatchedOvercookedGridworld(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+
+    def test_state_conversion(self):
+        mdp = OvercookedGridworld.from_layout_name("mdp_test")
+        state = mdp.get_standard_start_state().deepcopy()
+        state.players[0].set_object(SoupState.get_soup((0, 0), num_onions=1, num_tomatoes=2, finished=True))
+        state.add_object(SoupState((2, 0), [ObjectState(Recipe.TOMATO, (2, 0)), ObjectState(Recipe.ONION, (2, 0))], cooking_tick=3))
+        state.add_object(ObjectState("dish", (0, 0)))
+        state.timestep = 17
+        states = [state, mdp.get_standard_start_state()]
+
+        batch = BatchedOvercookedGridworld(mdp, states)
+        self.assertEqual(batch.get_states(), states)
+        batch.set_state(0, states[1])
+        self.assertEqual(batch.get_state(0), states[1])
+
+        with self.assertRaises(ValueError):
+            other_orders_state = OvercookedState.from_player_positions(mdp.start_player_positions, all_orders=[{ "ingredients" : ["onion"] }])
+            batch.set_state(0, other_orders_state)
+        with self.assertRaises(ValueError):
+            batch.step(np.zeros((3, 2)))
+
+    def test_step_matches_mdp(self):
+        for layout in ["cramped_room", "cramped_room_o_3orders", "bonus_order_test", "multiplayer_schelling"]:
+            mdp = OvercookedGridworld.from_layout_name(layout)
+            start_state_fn = mdp.get_random_start_state_fn(random_start_pos=True, rnd_obj_prob_thresh=0.5)
+            states = [start_state_fn() for _ in range(16)]
+            batch = BatchedOvercookedGridworld(mdp, states)
+
+            num_deliveries = 0
+            for _ in range(200):
+                joint_actions = np.random.choice(Action.NUM_ACTIONS, size=(len(states), mdp.num_players), p=ACTION_PROBS)
+                infos = batch.step(joint_actions)
+                for idx, actions in enumerate(joint_actions):
+                    states[idx], expected_infos = mdp.get_state_transition(states[idx], tuple(Action.INDEX_TO_ACTION[a] for a in actions))
+                    self.assertEqual(list(infos["sparse_reward_by_agent"][idx]), expected_infos["sparse_reward_by_agent"])
+                    self.assertEqual(list(infos["shaped_reward_by_agent"][idx]), expected_infos["shaped_reward_by_agent"])
+                    for event in EVENT_TYPES:
+                        self.assertEqual(list(infos["event_infos"][event][idx]), expected_infos["event_infos"][event], event)
+                    num_deliveries += sum(expected_infos["event_infos"]["soup_delivery"])
+                self.assertEqual(batch.get_states(), states)
+            self.assertGreater(num_deliveries, 0, layout)
+
+    def test_collisions(self):
+        mdp = OvercookedGridworld.from_layout_name("cramped_room")
+        # Players swapping places collide, so both keep their positions but still turn
+        state = OvercookedState.from_players_pos_and_or([((1, 1), Direction.EAST), ((2, 1), Direction.WEST)], all_orders=mdp.start_all_orders)
+        batch = BatchedOvercookedGridworld(mdp, [state])
+        joint_action_idxs = [[Action.ACTION_TO_INDEX[Direction.EAST], Action.ACTION_TO_INDEX[Direction.WEST]]]
+        batch.step(joint_action_idxs)
+        expected_state, _ = mdp.get_state_transition(state, (Direction.EAST, Direction.WEST))
+        self.assertEqual(batch.get_state(0), expected_state)
+        self.assertEqual(batch.get_state(0).player_positions, ((1, 1), (2, 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,12 @@
-import unittest, os, shutil
+import unittest, os, sys, shutil, itertools, threading
 import json
+from collections import defaultdict
+from types import SimpleNamespace
 import numpy as np
 from math import factorial
 from overcooked_ai_py.mdp.actions import Action, Direction
-from overcooked_ai_py.mdp.overcooked_mdp import PlayerState, OvercookedGridworld, OvercookedState, ObjectState, SoupState, Recipe
-from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv, DEFAULT_ENV_PARAMS
+from overcooked_ai_py.mdp.overcooked_mdp import PlayerState, OvercookedGridworld, OvercookedState, ObjectState, SoupState, Recipe, RecipeContext, OvercookedStateCodec, LosslessEncodingDeltaEncoder, LosslessEncodingDeltaDecoder, EventInfos, EVENT_TYPES, EVENT_BITS, EVENT_LEVEL_OFF, EVENT_LEVEL_CHEAP
+from overcooked_ai_py.mdp.overcooked_env import OvercookedEnv, Overcooked, DEFAULT_ENV_PARAMS
 from overcooked_ai_py.mdp.layout_generator import LayoutGenerator, ONION_DISPENSER, TOMATO_DISPENSER, POT, DISH_DISPENSER, SERVING_LOC
 from overcooked_ai_py.agents.agent import AgentGroup, AgentPair, GreedyHumanModel, FixedPlanAgent, RandomAgent
 from overcooked_ai_py.agents.benchmarking import AgentEvaluator
@@ -123,6 +125,47 @@ class TestRecipe(unittest.TestCase):
         
         self.assertCountEqual(only_onions_recipes, set([Recipe.generate_random_recipes(n=1, recipes=only_onions_recipes)[0] for _ in range(100)])) # false positives rate for this test is 1/10^99 
 
+    def test_recipe_table(self):
+        Recipe.configure({ "onion_value" : 3, "tomato_value" : 5, "onion_time" : 7, "tomato_time" : 11 })
+        recipe = Recipe([Recipe.TOMATO, Recipe.ONION, Recipe.ONION])
+        self.assertEqual(recipe.ingredients, (Recipe.ONION, Recipe.ONION, Recipe.TOMATO))
+        self.assertEqual(recipe.value, 2 * 3 + 5)
+        self.assertEqual(recipe.time, 2 * 7 + 11)
+        self.assertIs(Recipe.from_id(recipe.id), recipe)
+        self.assertEqual(Recipe.id_of([Recipe.ONION, Recipe.TOMATO, Recipe.ONION]), recipe.id)
+        self.assertEqual(Recipe.id_with_ingredient(self.r6.id, Recipe.TOMATO), recipe.id)
+        self.assertEqual(Recipe.id_with_ingredient(None, Recipe.TOMATO), Recipe([Recipe.TOMATO]).id)
+        self.assertCountEqual(self.r6.neighbors(), [self.r1, recipe])
+        self.assertEqual(recipe.neighbors(), [])
+        self.assertLess(self.r6, self.r1)
+        self.assertLess(self.r1, self.r3)
+
+        # Recipe ids stay the same when the maximum number of ingredients changes
+        ids = { r : r.id for r in Recipe.ALL_RECIPES }
+        Recipe.configure({ "max_num_ingredients" : 4 })
+        for r, recipe_id in ids.items():
+            self.assertEqual(r.id, recipe_id)
+            self.assertIs(Recipe.from_id(recipe_id), r)
+            self.assertEqual(r.value, 20)
+        self.assertEqual(len(recipe.neighbors()), len(Recipe.ALL_INGREDIENTS))
+
+    def test_recipe_context(self):
+        cheap_context = RecipeContext({ "delivery_reward" : 5, "cook_time" : 3, "max_num_ingredients" : 2 })
+        rich_context = RecipeContext({ "onion_value" : 4, "tomato_value" : 6, "onion_time" : 2, "tomato_time" : 1 })
+
+        # Both contexts share the same Recipe objects but disagree on their values and times
+        self.assertIs(cheap_context.recipe([Recipe.ONION, Recipe.TOMATO]), self.r3)
+        self.assertEqual(cheap_context.recipe_value(self.r3), 5)
+        self.assertEqual(cheap_context.recipe_time(self.r3), 3)
+        self.assertEqual(rich_context.recipe_value(self.r3), 10)
+        self.assertEqual(rich_context.recipe_time(self.r3), 3)
+        self.assertEqual(rich_context.recipe_time(self.r1), 6)
+
+        self.assertEqual(len(cheap_context.all_recipes), self._expected_num_recipes(len(Recipe.ALL_INGREDIENTS), 2))
+        self.assertEqual(len(rich_context.all_recipes), self._expected_num_recipes(len(Recipe.ALL_INGREDIENTS), 3))
+        self.assertCountEqual(cheap_context.neighbors(self.r6), [])
+        self.assertCountEqual(rich_context.neighbors(self.r6), [self.r1, Recipe([Recipe.ONION, Recipe.ONION, Recipe.TOMATO])])
+
     def _expected_num_recipes(self, num_ingredients, max_len):
         return comb(num_ingredients + max_len, num_ingredients) - 1
 
@@ -213,6 +256,17 @@ class TestSoupState(unittest.TestCase):
         self.assertEqual(self.s3.recipe, Recipe([Recipe.ONION]))
         self.assertEqual(self.s4.recipe, Recipe([Recipe.TOMATO, Recipe.TOMATO]))
 
+    def test_recipe_id(self):
+        self.assertIsNone(self.s1.recipe_id)
+        self.s1.add_ingredient_from_str(Recipe.TOMATO)
+        self.s1.add_ingredient_from_str(Recipe.ONION)
+        self.assertEqual(self.s1.recipe_id, Recipe([Recipe.ONION, Recipe.TOMATO]).id)
+        self.assertEqual(self.s1.deepcopy().recipe_id, self.s1.recipe_id)
+        self.s1.pop_ingredient()
+        self.assertEqual(self.s1.recipe_id, Recipe([Recipe.TOMATO]).id)
+        self.assertEqual(self.s2.recipe_id, Recipe([Recipe.ONION, Recipe.ONION, Recipe.TOMATO]).id)
+        self.assertEqual(self.s4.recipe.id, self.s4.recipe_id)
+
     def test_invalid_ops(self):
         
         # Cannot cook an empty soup
@@ -418,12 +472,416 @@ class TestGridworld(unittest.TestCase):
                 sparse_reward += sum(infos['sparse_reward_by_agent'])
             seed += 1
 
+    def test_state_pickling(self):
+        np.random.seed(0)
+        state = self.base_mdp.get_standard_start_state()
+        for _ in range(200):
+            state, _ = self.base_mdp.get_state_transition(state, random_joint_action())
+
+        pickle_path = os.path.join(TESTING_DATA_DIR, 'test_state_pickling', 'state')
+        os.makedirs(os.path.dirname(pickle_path), exist_ok=True)
+        try:
+            save_pickle(state, pickle_path)
+            loaded_state = load_pickle(pickle_path)
+            # Cached hashes are only valid within one process, so they aren't pickled
+            self.assertIsNone(loaded_state._hash)
+            self.assertEqual(state, loaded_state)
+        finally:
+            shutil.rmtree(os.path.dirname(pickle_path))
+
+        # States are stored compactly, without per-instance dictionaries
+        for obj in [state, *state.players, *state.objects.values()]:
+            self.assertFalse(hasattr(obj, '__dict__'), type(obj))
+
+    def test_transitions_share_unchanged_state(self):
+        np.random.seed(0)
+        state = self.base_mdp.get_standard_start_state()
+        states, state_dicts = [state], [state.to_dict()]
+        for _ in range(300):
+            state, _ = self.base_mdp.get_state_transition(state, random_joint_action())
+            states.append(state)
+            state_dicts.append(state.to_dict())
+
+        # Later transitions never modify the states they were derived from
+        for state, state_dict in zip(states, state_dicts):
+            self.assertEqual(state.to_dict(), state_dict)
+
+        # Players that don't move or interact are shared with the previous state
+        state = self.base_mdp.get_standard_start_state()
+        new_state, _ = self.base_mdp.get_state_transition(state, [stay, w])
+        self.assertIs(new_state.players[0], state.players[0])
+        self.assertIsNot(new_state.players[1], state.players[1])
+
+        # Writing through the mutable accessors copies shared players first
+        new_state.mutable_player(0).set_object(ObjectState('onion', new_state.players[0].position))
+        self.assertFalse(state.players[0].has_object())
+
+    def test_shared_state_is_read_only(self):
+        state = self.base_mdp.get_standard_start_state()
+        state.add_object(SoupState.get_soup((2, 0), num_onions=3, cooking_tick=0, recipe_context=self.base_mdp.recipe_context))
+        new_state, _ = self.base_mdp.get_state_transition(state, [stay, stay])
+        shared_player = new_state.players[0]
+        self.assertIs(shared_player, state.players[0])
+        state_hash, state_dict = hash(state), state.to_dict()
+
+        # Writing to a shared player or object in place raises instead of leaking into the other state
+        with self.assertRaises(ValueError):
+            shared_player.set_object(ObjectState('onion', shared_player.position))
+        with self.assertRaises(ValueError):
+            shared_player.update_pos_and_or((1, 1), n)
+        with self.assertRaises(ValueError):
+            state.get_object((2, 0)).cook()
+        self.assertEqual(state.to_dict(), state_dict)
+        self.assertEqual(hash(state), state_hash)
+
+        # Both states can still be modified through the mutable accessors
+        for modified_state in [state, new_state]:
+            modified_state.mutable_player(0).set_object(ObjectState('onion', shared_player.position))
+            self.assertTrue(modified_state.players[0].has_object())
+        self.assertFalse(shared_player.has_object())
+        self.assertFalse(state.deepcopy().players[1].frozen)
+
+    def test_orders_are_shared(self):
+        np.random.seed(0)
+        start_state = self.base_mdp.get_standard_start_state()
+        state = start_state
+        for _ in range(100):
+            state, _ = self.base_mdp.get_state_transition(state, random_joint_action())
+
+        # All states with the same orders share the same sorted order tuples
+        for other_state in [state, state.deepcopy(), OvercookedState.from_dict(state.to_dict()), self.base_mdp.get_standard_start_state()]:
+            self.assertIs(other_state.all_orders, start_state.all_orders)
+            self.assertIs(other_state.bonus_orders, start_state.bonus_orders)
+        self.assertEqual(list(start_state.all_orders), sorted(start_state.all_orders))
+
+        # Empty all_orders means all recipes are allowed
+        dummy_state = OvercookedState.from_player_positions([(1, 1), (2, 1)])
+        self.assertEqual(dummy_state.all_orders, tuple(sorted(Recipe.ALL_RECIPES)))
+
+    def test_orders_cache_is_bounded(self):
+        recipes = sorted(Recipe.ALL_RECIPES)
+        orders_subsets = [recipes[:i] for i in range(1, 9)]
+        cache_size = OvercookedState.ORDERS_CACHE_SIZE
+        OvercookedState.ORDERS_CACHE_SIZE = 4
+        try:
+            states = [OvercookedState.from_player_positions([(1, 1), (2, 1)], all_orders=orders) for orders in orders_subsets]
+            self.assertLessEqual(len(OvercookedState._ORDERS_CACHE), 4)
+            self.assertEqual(len(OvercookedState._INTERNED_ORDERS_IDS), len(OvercookedState._ORDERS_CACHE))
+            # Orders evicted from the cache are still equal, recently used ones are still shared
+            for state, orders in zip(states, orders_subsets):
+                self.assertEqual(state.all_orders, tuple(orders))
+            new_state = OvercookedState.from_player_positions([(1, 1), (2, 1)], all_orders=orders_subsets[-1])
+            self.assertIs(new_state.all_orders, states[-1].all_orders)
+        finally:
+            OvercookedState.ORDERS_CACHE_SIZE = cache_size
+
+    def test_orders_cache_concurrent_interning(self):
+        recipes = sorted(Recipe.ALL_RECIPES)
+        orders_subsets = [recipes[:i] for i in range(1, 9)]
+        cache_size = OvercookedState.ORDERS_CACHE_SIZE
+        OvercookedState.ORDERS_CACHE_SIZE = 2
+        errors = []
+
+        def intern_orders(thread_idx):
+            try:
+                for i in range(500):
+                    orders = orders_subsets[(thread_idx + i) % len(orders_subsets)]
+                    state = OvercookedState.from_player_positions([(1, 1), (2, 1)], all_orders=orders)
+                    self.assertEqual(state.all_orders, tuple(orders))
+            except Exception as e:
+                errors.append(e)
+
+        # Switching threads often makes interleavings inside the cache update likely
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            threads = [threading.Thread(target=intern_orders, args=(thread_idx,)) for thread_idx in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+            self.assertLessEqual(len(OvercookedState._ORDERS_CACHE), 2)
+            self.assertEqual(OvercookedState._INTERNED_ORDERS_IDS, set(id(orders) for orders in OvercookedState._ORDERS_CACHE.values()))
+        finally:
+            sys.setswitchinterval(switch_interval)
+            OvercookedState.ORDERS_CACHE_SIZE = cache_size
+
+    def test_incremental_hashing(self):
+        np.random.seed(0)
+        state = self.base_mdp.get_standard_start_state()
+        hash(state)
+        for _ in range(300):
+            state, _ = self.base_mdp.get_state_transition(state, random_joint_action())
+
+            # Hashes derived from the previous state match hashes computed from scratch
+            state_copy = state.deepcopy()
+            self.assertIsNotNone(state._hash)
+            self.assertIsNone(state_copy._hash)
+            self.assertEqual(hash(state), hash(state_copy))
+            self.assertEqual(state, state_copy)
+
+        # Writes invalidate the cached hash
+        player = state.mutable_player(0)
+        player.update_pos_and_or(player.position, Direction.SOUTH if player.orientation != Direction.SOUTH else Direction.NORTH)
+        self.assertNotEqual(state, state_copy)
+        self.assertNotEqual(hash(state), hash(state_copy))
+
+        # Time independent keys ignore the timestep
+        later_state = state_copy.deepcopy()
+        later_state.timestep += 5
+        self.assertNotEqual(later_state, state_copy)
+        cache = { state_copy.time_independent_key : "value" }
+        self.assertEqual(cache[later_state.time_independent_key], "value")
+        self.assertNotIn(state.time_independent_key, cache)
+
+    def test_recipe_contexts_are_per_mdp(self):
+        fast_mdp = OvercookedGridworld.from_layout_name("cramped_room", cook_time=2, delivery_reward=7)
+        slow_mdp = OvercookedGridworld.from_layout_name("cramped_room", cook_time=5, delivery_reward=30)
+        self.assertIsNot(fast_mdp.recipe_context, slow_mdp.recipe_context)
+
+        mdps, states = [fast_mdp, slow_mdp], []
+        for mdp in mdps:
+            state = mdp.get_standard_start_state()
+            state.add_object(SoupState.get_soup(mdp.get_pot_locations()[0], num_onions=3, cooking_tick=0, recipe_context=mdp.recipe_context))
+            states.append(state)
+
+        # Interleaved steps of both MDPs each use their own cook time and reward
+        for t in range(1, 6):
+            for i, mdp in enumerate(mdps):
+                states[i], _ = mdp.get_state_transition(states[i], (stay, stay))
+            fast_soup, slow_soup = [state.get_object(mdp.get_pot_locations()[0]) for state, mdp in zip(states, mdps)]
+            self.assertEqual(fast_soup.is_ready, t >= 2)
+            self.assertEqual(slow_soup.is_ready, t >= 5)
+            self.assertEqual((fast_soup.value, slow_soup.value), (7, 30))
+
+        recipe = Recipe([Recipe.ONION] * 3)
+        self.assertEqual(fast_mdp.get_recipe_value(states[0], recipe), 7)
+        self.assertEqual(slow_mdp.get_recipe_value(states[1], recipe), 30)
+
+    def test_mdps_leave_default_recipe_context(self):
+        default_context = Recipe.default_context
+        fast_mdp = OvercookedGridworld.from_layout_name("cramped_room", cook_time=5)
+        fast_state = fast_mdp.get_standard_start_state()
+        fast_state.add_object(SoupState.get_soup(fast_mdp.get_pot_locations()[0], num_onions=3, cooking_tick=0, recipe_context=fast_mdp.recipe_context))
+        state_dict = fast_state.to_dict()
+
+        OvercookedGridworld.from_layout_name("cramped_room", cook_time=30)
+        self.assertIs(Recipe.default_context, default_context)
+
+        # A state loaded with the context of the MDP it came from keeps that MDP's cook time
+        state = OvercookedState.from_dict(state_dict, fast_mdp.recipe_context)
+        for _ in range(5):
+            state, _ = fast_mdp.get_state_transition(state, (stay, stay))
+        soup = state.get_object(fast_mdp.get_pot_locations()[0])
+        self.assertEqual(soup.cook_time, 5)
+        self.assertTrue(soup.is_ready)
+
+    def test_recipe_context_concurrent_lookups(self):
+        context = RecipeContext({ "cook_time" : 4 })
+        # Registering larger recipes makes the tables of `context` stale, so that the lookups below rebuild them
+        RecipeContext({ "max_num_ingredients" : 5 })
+        recipes = list(context.all_recipes)
+        errors = []
+
+        def lookup():
+            try:
+                for _ in range(50):
+                    for recipe in recipes:
+                        context.recipe_time(recipe)
+                        context.neighbors(recipe)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=lookup) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(context.recipe_time(recipes[0]), 4)
+
+    def test_object_index(self):
+        def brute_force_objects_by_type(state):
+            objects_by_type = defaultdict(list)
+            for obj in state.objects.values():
+                objects_by_type[obj.name].append(obj)
+            return objects_by_type
+
+        def brute_force_soup_status(soup):
+            if soup.is_ready:
+                return 'ready'
+            return 'cooking' if soup.is_cooking else '{}_items'.format(len(soup.ingredients))
+
+        np.random.seed(0)
+        state = self.base_mdp.get_standard_start_state()
+        states = [state]
+        for _ in range(500):
+            state, _ = self.base_mdp.get_state_transition(state, random_joint_action())
+            states.append(state)
+
+        for state in states + [states[-1].deepcopy()]:
+            self.assertEqual(state.unowned_objects_by_type, brute_force_objects_by_type(state))
+            for pos, obj in state.objects.items():
+                expected_status = brute_force_soup_status(obj) if obj.name == 'soup' else None
+                self.assertEqual(state.soup_status(pos), expected_status)
+            self.assertCountEqual(state.cooking_soup_positions, [pos for pos, obj in state.objects.items() if obj.name == 'soup' and obj.is_cooking])
+            self.assertCountEqual(state.all_objects_list, list(state.objects.values()) + [p.held_object for p in state.players if p.held_object])
+
+        # Writes to a state keep its index up to date without affecting the state it was copied from
+        state = self.base_mdp.get_standard_start_state()
+        self.assertIsNone(state.soup_status((2, 0)))
+        next_state = state.persistent_copy()
+        next_state.add_object(SoupState.get_soup((2, 0), num_onions=2))
+        next_state.add_object(ObjectState(Recipe.ONION, (0, 0)))
+        self.assertEqual(next_state.soup_status((2, 0)), '2_items')
+        next_state.mutable_object((2, 0)).add_ingredient_from_str(Recipe.ONION)
+        self.assertEqual(next_state.soup_status((2, 0)), '3_items')
+        next_state.mutable_object((2, 0)).begin_cooking()
+        self.assertEqual(self.base_mdp.get_pot_states(next_state)['cooking'], [(2, 0)])
+        self.assertEqual(next_state.cooking_soup_positions, [(2, 0)])
+        next_state.remove_object((0, 0))
+        self.assertEqual(next_state.unowned_objects_by_type, brute_force_objects_by_type(next_state))
+        self.assertEqual(dict(state.unowned_objects_by_type), {})
+        self.assertIsNone(state.soup_status((2, 0)))
+
+    def test_state_codec(self):
+        codec = OvercookedStateCodec(self.base_mdp)
+        np.random.seed(0)
+        state = self.base_mdp.get_standard_start_state()
+        states = [state]
+        for _ in range(300):
+            state, _ = self.base_mdp.get_state_transition(state, random_joint_action())
+            states.append(state)
+
+        # Soups with mixed ingredients, held soups and cooking soups on counters
+        state = state.deepcopy()
+        state.players[0].held_object = None
+        recipe_context = self.base_mdp.recipe_context
+        state.players[0].set_object(SoupState.get_soup((0, 0), num_onions=1, num_tomatoes=2, finished=True, recipe_context=recipe_context))
+        state.add_object(SoupState((0, 1), [ObjectState(Recipe.TOMATO, (0, 1)), ObjectState(Recipe.ONION, (0, 1))], cooking_tick=3, recipe_context=recipe_context), (0, 1))
+        state.timestep = 1000
+        states.append(state)
+
+        for state in states:
+            encoding = codec.encode(state)
+            self.assertEqual(len(encoding), codec.num_bytes)
+            decoded_state = codec.decode(encoding)
+            self.assertEqual(decoded_state, state)
+            self.assertEqual(decoded_state.to_dict()["players"], state.to_dict()["players"])
+            self.assertEqual(codec.decode(encoding).time_independent_key, state.time_independent_key)
+
+        rows = codec.encode_batch(states)
+        self.assertEqual(rows.shape, (len(states), codec.num_bytes))
+        self.assertEqual(rows.dtype, np.uint8)
+        self.assertEqual(codec.decode_batch(rows), states)
+
+        # Bytes after the timestep only depend on the time independent state
+        later_state = states[0].deepcopy()
+        later_state.timestep += 1
+        self.assertNotEqual(codec.encode(later_state), codec.encode(states[0]))
+        self.assertEqual(codec.encode(later_state)[codec.TIMESTEP_BYTES:], codec.encode(states[0])[codec.TIMESTEP_BYTES:])
+
+        with self.assertRaises(ValueError):
+            codec.decode(codec.encode(states[0])[1:])
+        with self.assertRaises(ValueError):
+            floor_state = states[0].deepcopy()
+            floor_state.add_object(ObjectState(Recipe.ONION, (1, 1)))
+            codec.encode(floor_state)
+
+    def test_movement_table(self):
+        mdp = self.base_mdp
+        valid_positions = mdp.get_valid_player_positions()
+        self.assertEqual(int(mdp.walkable_cells.sum()), len(valid_positions))
+        for y in range(mdp.height):
+            for x in range(mdp.width):
+                pos = (x, y)
+                pos_idx = mdp.get_position_index(pos)
+                self.assertEqual(mdp.get_position_from_index(pos_idx), pos)
+                self.assertEqual(mdp.is_walkable(pos), pos in valid_positions)
+                for orientation_idx, orientation in enumerate(Direction.ALL_DIRECTIONS):
+                    for action_idx, action in enumerate(Action.ALL_ACTIONS):
+                        # Same outcome as searching the valid positions directly
+                        expected_pos = Action.move_in_direction(pos, action) if action in Action.MOTION_ACTIONS else pos
+                        if expected_pos not in valid_positions:
+                            expected_pos = pos
+                        expected_orientation = action if action in Direction.ALL_DIRECTIONS else orientation
+                        self.assertEqual(mdp._move_if_direction(pos, orientation, action), (expected_pos, expected_orientation))
+                        new_pos_idx, new_orientation_idx = mdp.movement_table[pos_idx, orientation_idx, action_idx]
+                        self.assertEqual(mdp.get_position_from_index(new_pos_idx), expected_pos)
+                        self.assertEqual(Direction.INDEX_TO_DIRECTION[new_orientation_idx], expected_orientation)
+
+        # Positions outside of the grid are not walkable
+        self.assertFalse(mdp.is_walkable((-1, 0)))
+        self.assertEqual(mdp._move_if_direction((-1, 0), Direction.NORTH, Direction.EAST), ((-1, 0), Direction.EAST))
+
     def test_four_player_mdp(self):
         try:
             OvercookedGridworld.from_layout_name("multiplayer_schelling")
         except AssertionError as e:
             print("Loading > 2 player map failed with error:", e)
 
+    def test_many_player_collisions(self):
+        mdp = OvercookedGridworld.from_layout_name("multiplayer_schelling")
+        old_positions = ((1, 1), (2, 1), (3, 1), (4, 1))
+        # Moving in a line, into the cell another player leaves, is not a collision
+        self.assertFalse(mdp.is_transition_collision(old_positions, ((2, 1), (3, 1), (4, 1), (5, 1))))
+        # Any two players swapping places or ending on the same cell is
+        self.assertTrue(mdp.is_transition_collision(old_positions, ((1, 1), (2, 1), (4, 1), (3, 1))))
+        self.assertTrue(mdp.is_transition_collision(old_positions, ((1, 1), (2, 2), (2, 2), (4, 1))))
+        self.assertTrue(mdp.is_joint_position_collision(((1, 1), (2, 1), (3, 1), (1, 1))))
+        self.assertFalse(mdp.is_joint_position_collision(old_positions))
+
+        # Joint positions are counted and indexed without listing all of them
+        valid_positions = mdp.get_valid_player_positions()
+        num_valid_joint_positions = mdp.num_valid_joint_player_positions()
+        self.assertEqual(num_valid_joint_positions, factorial(len(valid_positions)) // factorial(len(valid_positions) - 4))
+        self.assertEqual(mdp.get_valid_joint_player_positions_at(0), tuple(valid_positions[:4]))
+        self.assertEqual(mdp.get_valid_joint_player_positions_at(num_valid_joint_positions - 1), tuple(valid_positions[:-5:-1]))
+        for joint_position in itertools.islice(mdp.iter_valid_joint_player_positions(), 0, None, 997):
+            self.assertFalse(mdp.is_joint_position_collision(joint_position))
+
+        start_state = mdp.get_random_start_state_fn(random_start_pos=True)()
+        self.assertFalse(mdp.is_joint_position_collision(start_state.player_positions))
+        encodings = mdp.lossless_state_encoding(start_state)
+        self.assertEqual(len(encodings), 4)
+        for player_idx, encoding in enumerate(encodings):
+            self.assertTrue(np.array_equal(encoding.shape, mdp.lossless_state_encoding_shape))
+            self.assertEqual(encoding[start_state.players[player_idx].position][0], 1)
+
+    def test_event_levels(self):
+        mdp = OvercookedGridworld.from_layout_name("cramped_room_tomato")
+        cheap_events = ["tomato_pickup", "tomato_drop", "potting_tomato", "onion_pickup", "onion_drop", "potting_onion",
+                        "dish_pickup", "dish_drop", "soup_pickup", "soup_delivery", "soup_drop"]
+        cheap_mask = sum(EVENT_BITS[event] for event in cheap_events)
+        np.random.seed(0)
+        state = mdp.get_standard_start_state()
+        num_events = 0
+        for _ in range(500):
+            joint_action = random_joint_action()
+            next_state, infos = mdp.get_state_transition(state, joint_action)
+            self.assertEqual(dict(infos["event_infos"]), infos["event_infos"].to_dict())
+            self.assertEqual(EventInfos.to_bitmasks(infos["event_infos"].to_dict()), infos["event_bitmasks"])
+            for event in EVENT_TYPES:
+                self.assertEqual(infos["event_infos"][event], [bool(bitmask & EVENT_BITS[event]) for bitmask in infos["event_bitmasks"]])
+            num_events += sum(len(list(EventInfos.iter_events(bitmask))) for bitmask in infos["event_bitmasks"])
+
+            # Lower levels give the same transitions, with fewer events
+            for event_level in [EVENT_LEVEL_CHEAP, EVENT_LEVEL_OFF]:
+                level_state, level_infos = mdp.get_state_transition(state, joint_action, event_level=event_level)
+                self.assertEqual(level_state, next_state)
+                self.assertEqual(level_infos["sparse_reward_by_agent"], infos["sparse_reward_by_agent"])
+                self.assertEqual(level_infos["shaped_reward_by_agent"], infos["shaped_reward_by_agent"])
+                expected_mask = cheap_mask if event_level == EVENT_LEVEL_CHEAP else 0
+                self.assertEqual(level_infos["event_bitmasks"], [bitmask & expected_mask for bitmask in infos["event_bitmasks"]])
+            state = next_state
+        self.assertGreater(num_events, 0)
+
+        # Event levels of mdps apply to the environments using them
+        env = OvercookedEnv.from_mdp(OvercookedGridworld.from_layout_name("cramped_room", event_level=EVENT_LEVEL_OFF), horizon=100, info_level=0)
+        env.run_agents(AgentPair(RandomAgent(all_actions=True), RandomAgent(all_actions=True)))
+        self.assertTrue(all(env.game_stats[event] == [[], []] for event in EVENT_TYPES))
+
     def test_potential_function(self):
         mp = MotionPlanner(self.base_mdp)
         state = self.base_mdp.get_standard_start_state()
@@ -710,6 +1168,21 @@ class TestGridworld(unittest.TestCase):
         self.assertLess(val24, val25, "Moving towards serving area with valid soup increases potential")
         self.assertEqual(sum(rewards['sparse_reward_by_agent']), 50, "Soup was not properly devivered, probably an error with MDP logic")
 
+    def test_potential_function_batch(self):
+        for layout in ["cramped_room_tomato", "multiplayer_schelling"]:
+            mdp = OvercookedGridworld.from_layout_name(layout)
+            mp = MotionPlanner(mdp)
+            start_state_fn = mdp.get_random_start_state_fn(random_start_pos=True, rnd_obj_prob_thresh=0.6)
+            states = []
+            for _ in range(3):
+                state = start_state_fn()
+                for _ in range(100):
+                    states.append(state)
+                    state, _ = mdp.get_state_transition(state, tuple(Action.INDEX_TO_ACTION[a] for a in np.random.randint(Action.NUM_ACTIONS, size=mdp.num_players)))
+            for gamma in [0.99, 0.9]:
+                expected = [mdp.potential_function(state, mp, gamma) for state in states]
+                self.assertTrue(np.allclose(mdp.potential_function_batch(states, mp, gamma, chunk_size=64), expected))
+
 
 
 
@@ -734,11 +1207,149 @@ class TestFeaturizations(unittest.TestCase):
         obs = self.base_mdp.lossless_state_encoding(s)[0]
         self.assertTrue(np.array_equal(obs.shape, self.base_mdp.lossless_state_encoding_shape), "{} vs {}".format(obs.shape, self.base_mdp.lossless_state_encoding_shape))
 
+    def test_lossless_state_featurization_views(self):
+        mdp = OvercookedGridworld.from_layout_name("multiplayer_schelling")
+        state = mdp.get_random_start_state_fn(random_start_pos=True, rnd_obj_prob_thresh=0.8)()
+        encodings = mdp.lossless_state_encoding(state, horizon=state.timestep + 10)
+        self.assertTrue(np.all(encodings[0][:, :, -1] == 1))
+
+        # Every view holds the same named layers, only in a different order
+        layers_by_name = lambda primary_agent_idx: dict(zip(mdp.lossless_state_encoding_layers(primary_agent_idx), np.moveaxis(encodings[primary_agent_idx], -1, 0)))
+        for primary_agent_idx in range(1, mdp.num_players):
+            for layer_id, layer in layers_by_name(0).items():
+                self.assertTrue(np.array_equal(layers_by_name(primary_agent_idx)[layer_id], layer), layer_id)
+            self.assertEqual(mdp.lossless_state_encoding_layers(primary_agent_idx)[0], "player_{}_loc".format(primary_agent_idx))
+
+        # Writing into a reused output array gives the same encodings
+        out = np.full((mdp.num_players,) + tuple(mdp.lossless_state_encoding_shape), 7)
+        mdp.lossless_state_encoding(mdp.get_standard_start_state(), out=out)
+        out_encodings = mdp.lossless_state_encoding(state, horizon=state.timestep + 10, out=out)
+        for encoding, out_encoding in zip(encodings, out_encodings):
+            self.assertTrue(np.array_equal(encoding, out_encoding))
+
+    def test_lossless_state_featurization_batch(self):
+        for layout in ["cramped_room_tomato", "multiplayer_schelling"]:
+            mdp = OvercookedGridworld.from_layout_name(layout)
+            start_state_fn = mdp.get_random_start_state_fn(random_start_pos=True, rnd_obj_prob_thresh=0.8)
+            states = []
+            for _ in range(3):
+                state = start_state_fn()
+                for _ in range(100):
+                    states.append(state)
+                    state, _ = mdp.get_state_transition(state, tuple(Action.INDEX_TO_ACTION[a] for a in np.random.randint(Action.NUM_ACTIONS, size=mdp.num_players)))
+
+            expected = np.array([mdp.lossless_state_encoding(state, horizon=80) for state in states])
+            encodings = mdp.lossless_state_encoding_batch(states, horizon=80)
+            self.assertEqual(encodings.shape, (len(states), mdp.num_players) + tuple(mdp.lossless_state_encoding_shape))
+            self.assertTrue(np.array_equal(encodings, expected))
+            rows = OvercookedStateCodec(mdp).encode_batch(states)
+            self.assertTrue(np.array_equal(mdp.lossless_state_encoding_batch(rows, horizon=80), expected))
+
+    def test_lossless_state_featurization_sparse(self):
+        mdp = OvercookedGridworld.from_layout_name("multiplayer_schelling")
+        static_encoding = mdp.lossless_state_encoding_static()
+        state = mdp.get_random_start_state_fn(random_start_pos=True, rnd_obj_prob_thresh=0.8)()
+        for horizon in [400, state.timestep + 10]:
+            encodings = mdp.lossless_state_encoding(state, horizon)
+            sparse_encodings = mdp.lossless_state_encoding_sparse(state, horizon)
+            for encoding, (indices, values, urgent) in zip(encodings, sparse_encodings):
+                self.assertEqual(len(values), np.count_nonzero(encoding[:, :, :5 * mdp.num_players]) + np.count_nonzero(encoding[:, :, -10:-1]))
+                self.assertEqual(urgent, horizon < 400)
+                dense_encoding = OvercookedGridworld.lossless_state_encoding_from_sparse((indices, values, urgent), static_encoding)
+                self.assertTrue(np.array_equal(dense_encoding, encoding))
+
+    def test_lossless_state_featurization_dtypes(self):
+        mdp = OvercookedGridworld.from_layout_name("cramped_room_tomato")
+        state = mdp.get_random_start_state_fn(random_start_pos=True, rnd_obj_prob_thresh=0.8)()
+        encodings = np.array(mdp.lossless_state_encoding(state, horizon=state.timestep + 10))
+        static_encoding = mdp.lossless_state_encoding_static()
+        sparse_encoding = mdp.lossless_state_encoding_sparse(state, horizon=state.timestep + 10)[0]
+        for dtype, layout in itertools.product([bool, np.uint8, np.int16, np.float32], ["HWC", "CHW"]):
+            expected = encodings.astype(dtype)
+            if layout == "CHW":
+                expected = np.moveaxis(expected, -1, 1)
+            obs = mdp.lossless_state_encoding(state, horizon=state.timestep + 10, dtype=dtype, layout=layout)
+            self.assertTrue(all(o.dtype == dtype and o.flags.c_contiguous for o in obs))
+            self.assertTrue(np.array_equal(np.array(obs), expected), (dtype, layout))
+            batch = mdp.lossless_state_encoding_batch([state, state], horizon=state.timestep + 10, dtype=dtype, layout=layout)
+            self.assertTrue(batch.dtype == dtype and batch.flags.c_contiguous)
+            self.assertTrue(np.array_equal(batch[1], expected))
+            dense_encoding = OvercookedGridworld.lossless_state_encoding_from_sparse(sparse_encoding, mdp.lossless_state_encoding_static(dtype, layout), layout=layout)
+            self.assertTrue(np.array_equal(dense_encoding, expected[0]))
+        self.assertTrue(np.array_equal(static_encoding, mdp.lossless_state_encoding_static(layout="CHW").transpose(1, 2, 0)))
+
+    def test_lossless_state_featurization_delta(self):
+        mdp = OvercookedGridworld.from_layout_name("cramped_room_tomato")
+        env = OvercookedEnv.from_mdp(mdp, horizon=100, info_level=0)
+        trajs = env.get_rollouts(AgentPair(RandomAgent(all_actions=True), RandomAgent(all_actions=True)), num_games=2, info=False)
+        states = [state for ep_states in trajs["ep_states"] for state in ep_states]
+        encoder = LosslessEncodingDeltaEncoder(mdp, horizon=100, keyframe_interval=30)
+        messages = []
+        for i, state in enumerate(states):
+            if i % 100 == 0:
+                encoder.reset()
+            messages.append(encoder.encode(state))
+        self.assertEqual([i for i, message in enumerate(messages) if message.is_keyframe], [0, 30, 60, 90, 100, 130, 160, 190])
+        dense_bytes = np.array(mdp.lossless_state_encoding(states[0], dtype=np.int16)).nbytes
+        self.assertLess(sum(message.num_bytes for message in messages if not message.is_keyframe), 0.1 * dense_bytes * len(messages))
+
+        # A decoder joining mid-stream skips the messages before the next keyframe
+        for start in [0, 45]:
+            decoder = LosslessEncodingDeltaDecoder()
+            for state, message in zip(states[start:], messages[start:]):
+                obs = decoder.decode(message)
+                if obs is not None:
+                    self.assertTrue(all(np.array_equal(a, b) for a, b in zip(obs, mdp.lossless_state_encoding(state, horizon=100))))
+            self.assertIsNotNone(obs)
+
+        decoder = LosslessEncodingDeltaDecoder()
+        decoder.decode(messages[0])
+        with self.assertRaises(ValueError):
+            decoder.decode(messages[2])
+        self.assertIsNone(decoder.decode(messages[3]))
+
     def test_state_featurization_shape(self):
         s = self.base_mdp.get_standard_start_state()
         obs = self.base_mdp.featurize_state(s, self.mlam)[0]
         self.assertTrue(np.array_equal(obs.shape, self.base_mdp.featurize_state_shape), "{} vs {}".format(obs.shape, self.base_mdp.featurize_state_shape))
 
+    def test_state_featurization_batch(self):
+        trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=1, info=False)
+        states = list(trajs["ep_states"][0])
+        expected = np.array([self.base_mdp.featurize_state(state, self.mlam) for state in states])
+        featurized_observations = self.base_mdp.featurize_state_batch(states, self.mlam, chunk_size=64)
+        self.assertEqual(featurized_observations.shape, (len(states), 2, self.base_mdp.featurize_state_shape[0]))
+        self.assertEqual(featurized_observations.dtype, np.float32)
+        self.assertTrue(np.array_equal(featurized_observations, expected))
+
+    def test_many_player_state_featurization(self):
+        mdp = OvercookedGridworld.from_layout_name("multiplayer_schelling")
+        # Featurizations only use the motion planner, the joint motion planner of a 4 player layout is too large to compute
+        mlam = SimpleNamespace(motion_planner=MotionPlanner(mdp))
+        np.random.seed(0)
+        states = [mdp.get_standard_start_state()]
+        for _ in range(50):
+            joint_action = tuple(Action.INDEX_TO_ACTION[a_idx] for a_idx in np.random.randint(len(Action.ALL_ACTIONS), size=mdp.num_players))
+            states.append(mdp.get_state_transition(states[-1], joint_action)[0])
+
+        num_players, num_player_features = mdp.num_players, 29
+        for state in states:
+            features = mdp.featurize_state(state, mlam)
+            self.assertEqual(len(features), num_players)
+            own_features = [player_features[:num_player_features] for player_features in features]
+            for i, player_features in enumerate(features):
+                self.assertTrue(np.array_equal(player_features.shape, mdp.featurize_state_shape))
+                others = [j for j in range(num_players) if j != i]
+                # Features of the other players, then their positions relative to the player, in index order
+                others_features = player_features[num_player_features:num_players * num_player_features]
+                self.assertTrue(np.array_equal(others_features, np.concatenate([own_features[j] for j in others])))
+                rel_positions = player_features[num_players * num_player_features:-2].reshape(-1, 2)
+                self.assertTrue(np.array_equal(rel_positions, [np.subtract(state.players[j].position, state.players[i].position) for j in others]))
+                self.assertTrue(np.array_equal(player_features[-2:], state.players[i].position))
+
+        featurized_observations = mdp.featurize_state_batch(states, mlam, chunk_size=16)
+        self.assertTrue(np.array_equal(featurized_observations, np.array([mdp.featurize_state(state, mlam) for state in states])))
+
     def test_lossless_state_featurization(self):
         trajs = self.env.get_rollouts(self.greedy_human_model_pair, num_games=5)
         featurized_observations = [[self.base_mdp.lossless_state_encoding(state) for state in ep_states] for ep_states in trajs["ep_states"]]
@@ -788,6 +1399,102 @@ class TestOvercookedEnvironment(unittest.TestCase):
         action_plan = [random_joint_action() for _ in range(10)]
         self.env.execute_plan(self.base_mdp.get_standard_start_state(), action_plan)
 
+    def test_step_n(self):
+        np.random.seed(0)
+        for layout in ["cramped_room", "multiplayer_schelling"]:
+            mdp = OvercookedGridworld.from_layout_name(layout)
+            start_state_fn = mdp.get_random_start_state_fn(random_start_pos=True, rnd_obj_prob_thresh=0.5)
+            for _ in range(5):
+                # Long runs of repeated joint actions, many of them with everybody staying
+                joint_actions = []
+                while len(joint_actions) < 450:
+                    joint_action = tuple(Action.INDEX_TO_ACTION[a] for a in np.random.randint(Action.NUM_ACTIONS, size=mdp.num_players))
+                    if np.random.rand() < 0.3:
+                        joint_action = (stay,) * mdp.num_players
+                    joint_actions.extend([joint_action] * np.random.randint(1, 30))
+
+                start_state = start_state_fn()
+                env = OvercookedEnv.from_mdp(mdp, start_state_fn=lambda: start_state, horizon=400, info_level=0)
+                fast_env = OvercookedEnv.from_mdp(mdp, start_state_fn=lambda: start_state, horizon=400, info_level=0)
+                total_sparse_reward = 0
+                for joint_action in joint_actions:
+                    if env.is_done():
+                        break
+                    total_sparse_reward += env.step(joint_action)[1]
+
+                fast_total_sparse_reward, idx = 0, 0
+                while idx < len(joint_actions) and not fast_env.is_done():
+                    _, sparse_reward, done, info = fast_env.step_n(joint_actions[idx:idx + np.random.randint(1, 60)])
+                    fast_total_sparse_reward += sparse_reward
+                    idx += info["num_steps"]
+                self.assertTrue(done)
+                self.assertEqual(info["episode"]["ep_length"], 400)
+                self.assertEqual(fast_env.state, env.state)
+                self.assertEqual(fast_env.state.timestep, env.state.timestep)
+                self.assertEqual(fast_total_sparse_reward, total_sparse_reward)
+                for key, stats in env.game_stats.items():
+                    self.assertEqual(np.array(fast_env.game_stats[key]).tolist(), np.array(stats).tolist(), key)
+
+    def test_advance_until_event(self):
+        state = self.base_mdp.get_standard_start_state().deepcopy()
+        soup = SoupState.get_soup((2, 0), num_onions=3, finished=False)
+        soup.begin_cooking()
+        state.add_object(soup)
+        self.env.state = state
+
+        # Staying is skipped until the soup is done
+        next_state, _, done, info = self.env.advance_until_event((stay, stay))
+        self.assertFalse(done)
+        self.assertEqual(info["num_steps"], soup.cook_time)
+        self.assertTrue(next_state.get_object((2, 0)).is_ready)
+        self.assertEqual(next_state.player_positions, state.player_positions)
+
+        # Turning only takes a single step
+        _, _, _, info = self.env.advance_until_event((w, stay))
+        self.assertEqual(info["num_steps"], 1)
+        self.assertEqual(self.env.state.players[0].pos_and_or, ((1, 2), w))
+
+        # Walking into a wall and interacting with an empty counter does nothing, so it's repeated until max_steps
+        next_state, _, _, info = self.env.advance_until_event((w, interact), max_steps=50)
+        self.assertEqual(info["num_steps"], 50)
+        self.assertEqual(next_state.timestep, soup.cook_time + 51)
+
+    def test_snapshot_restore(self):
+        np.random.seed(0)
+        mdp = OvercookedGridworld.from_layout_name("cramped_room")
+        env = OvercookedEnv.from_mdp(mdp, horizon=400, info_level=0)
+        # Interacting a lot so that branches log different events
+        random_joint_action = lambda: tuple(Action.INDEX_TO_ACTION[a] for a in np.random.choice(Action.NUM_ACTIONS, size=2, p=[0.12, 0.12, 0.12, 0.12, 0.08, 0.44]))
+        game_stats_copy = lambda: { k : [list(v_i) for v_i in v] if k in EVENT_TYPES else list(v) for k, v in env.game_stats.items() }
+
+        for _ in range(100):
+            env.step(random_joint_action())
+        token = env.snapshot()
+        state, game_stats = env.state, game_stats_copy()
+
+        # Restoring snapshots taken on other branches as well as ancestors
+        branch_tokens, branch_game_stats = [], []
+        for _ in range(5):
+            for _ in range(150):
+                env.step(random_joint_action())
+            branch_tokens.append(env.snapshot())
+            branch_game_stats.append(game_stats_copy())
+            env.restore(token)
+            self.assertEqual(env.state, state)
+            self.assertEqual(env.state.timestep, 100)
+            self.assertEqual(game_stats_copy(), game_stats)
+        self.assertGreater(len(set(str(stats) for stats in branch_game_stats)), 1)
+        for branch_token, stats in reversed(list(zip(branch_tokens, branch_game_stats))):
+            env.restore(branch_token)
+            self.assertEqual(env.state.timestep, 250)
+            self.assertEqual(game_stats_copy(), stats)
+
+        # Restoring after a reset
+        env.reset()
+        env.restore(token)
+        self.assertEqual(env.state, state)
+        self.assertEqual(game_stats_copy(), game_stats)
+
     def test_run_agents(self):
         start_state = self.env.state
         self.env.run_agents(self.rnd_agent_pair)
@@ -800,6 +1507,74 @@ class TestOvercookedEnvironment(unittest.TestCase):
             print(e.with_traceback())
             self.fail("Failed to get rollouts from environment:\n{}".format(e))
 
+    def test_branch_rollouts(self):
+        np.random.seed(0)
+        env = OvercookedEnv.from_mdp(self.base_mdp, horizon=400, info_level=0)
+        agent_pair = AgentPair(RandomAgent(all_actions=True), RandomAgent(all_actions=True))
+        agent_pair.set_mdp(self.base_mdp)
+        for _ in range(300):
+            env._run_agents_step(agent_pair)
+        token, state, game_stats = env.snapshot(), env.state, env._copy_game_stats()
+
+        stay_pair = AgentPair(FixedPlanAgent([]), FixedPlanAgent([]))
+        random_state = np.random.get_state()
+        trajectories = env.branch_rollouts(token, [1, 2, 1, stay_pair], 50, agent_pair=agent_pair)
+        # Seeding branches doesn't change the global random state
+        self.assertTrue(all(np.array_equal(a, b) for a, b in zip(np.random.get_state(), random_state)))
+        self.assertEqual(list(trajectories["ep_lengths"]), [50] * 4)
+        self.assertTrue(all(states[0] == state and states[0].timestep == 300 for states in trajectories["ep_states"]))
+        self.assertTrue(all(dones[-1] and not any(dones[:-1]) for dones in trajectories["ep_dones"]))
+        self.assertEqual(list(trajectories["ep_actions"][0]), list(trajectories["ep_actions"][2]))
+        self.assertNotEqual(list(trajectories["ep_actions"][0]), list(trajectories["ep_actions"][1]))
+        self.assertTrue(all(joint_action == (stay, stay) for joint_action in trajectories["ep_actions"][3]))
+        # Episode game stats include the shared prefix
+        branch_game_stats = trajectories["ep_infos"][3][-1]["episode"]["ep_game_stats"]
+        self.assertEqual(branch_game_stats["onion_pickup"], game_stats["onion_pickup"])
+        # The environment is left as it was
+        self.assertEqual(env.state, state)
+        self.assertEqual(env._copy_game_stats()["onion_pickup"], game_stats["onion_pickup"])
+
+        # Branches from a state end with the environment
+        trajectories = env.branch_rollouts(state, [3, 4], 200, agent_pair=agent_pair, include_final_state=True)
+        self.assertEqual(list(trajectories["ep_lengths"]), [100, 100])
+        self.assertEqual(trajectories["ep_states"][0][-1].timestep, 400)
+        self.assertEqual(trajectories["ep_infos"][0][-2]["episode"]["ep_length"], 400)
+
+    def test_observation_cache(self):
+        state = self.base_mdp.get_standard_start_state()
+        encoding_size = sum(obs.nbytes for obs in self.base_mdp.lossless_state_encoding(state))
+        env = OvercookedEnv.from_mdp(self.base_mdp, horizon=400, info_level=0, obs_cache_max_bytes=2 * encoding_size)
+        self.assertEqual(env.copy().obs_cache_max_bytes, 2 * encoding_size)
+
+        obs = env.lossless_state_encoding_mdp(state)
+        self.assertTrue(all(np.array_equal(a, b) for a, b in zip(obs, self.base_mdp.lossless_state_encoding(state))))
+        self.assertFalse(obs[0].flags.writeable)
+        # The same state at a different timestep is a hit, unless it's in a different horizon-urgency bucket
+        later_state = state.deepcopy()
+        later_state.timestep = 100
+        self.assertIs(env.lossless_state_encoding_mdp(later_state), obs)
+        self.assertEqual((env.obs_cache.hits, env.obs_cache.misses), (1, 1))
+        later_state.timestep = 390
+        urgent_obs = env.lossless_state_encoding_mdp(later_state)
+        self.assertTrue(np.all(urgent_obs[0][:, :, -1] == 1))
+        self.assertEqual((env.obs_cache.hits, env.obs_cache.misses), (1, 2))
+
+        # Least recently used entries are evicted once the memory cap is hit
+        self.assertIs(env.lossless_state_encoding_mdp(state), obs)
+        env.step((n, s))
+        env.lossless_state_encoding_mdp(env.state)
+        self.assertEqual(len(env.obs_cache), 2)
+        self.assertLessEqual(env.obs_cache.num_bytes, 2 * encoding_size)
+        self.assertIs(env.lossless_state_encoding_mdp(state), obs)
+        self.assertIsNot(env.lossless_state_encoding_mdp(later_state), urgent_obs)
+
+        # Resets with the same mdp keep the cache, restoring a different one clears it
+        env.reset()
+        self.assertEqual(len(env.obs_cache), 2)
+        other_env = OvercookedEnv.from_mdp(OvercookedGridworld.from_layout_name("cramped_room"), horizon=400, info_level=0)
+        env.restore(other_env.snapshot())
+        self.assertEqual(len(env.obs_cache), 0)
+
     def test_one_player_env(self):
         mdp = OvercookedGridworld.from_layout_name("cramped_room_single")
         env = OvercookedEnv.from_mdp(mdp, horizon=12)
@@ -999,6 +1774,15 @@ class TestGymEnvironment(unittest.TestCase):
         self.rnd_agent_pair = AgentPair(FixedPlanAgent([]), FixedPlanAgent([]))
         np.random.seed(0)
 
+    def test_observation_space(self):
+        for dtype in [np.uint8, bool, int]:
+            gym_env = Overcooked()
+            gym_env.custom_init(self.env, lambda mdp, state: mdp.lossless_state_encoding(state, dtype=dtype, layout="CHW"))
+            obs = gym_env.reset()["both_agent_obs"][0]
+            self.assertEqual(gym_env.observation_space.shape, obs.shape)
+            self.assertEqual(gym_env.observation_space.dtype, np.float32 if dtype is int else dtype)
+            self.assertTrue(gym_env.observation_space.contains(obs.astype(gym_env.observation_space.dtype)))
+
     # TODO: write more tests here
 
 if __name__ == '__main__':
@@ -1,4 +1,5 @@
-import unittest
+import unittest, itertools
+import numpy as np
 from overcooked_ai_py.planning.planners import MediumLevelActionManager
 from overcooked_ai_py.mdp.actions import Direction, Action
 from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld, PlayerState, ObjectState, SoupState, OvercookedState
@@ -121,6 +122,21 @@ class TestMotionPlanner(unittest.TestCase):
         dist = planner.get_gridworld_pos_distance(start, end)
         self.assertEqual(dist, 3)
 
+    def test_min_cost_to_feature(self):
+        planner = ml_action_manager_simple.joint_motion_planner.motion_planner
+        feature_pos_lists = [simple_mdp.get_pot_locations(), simple_mdp.get_serving_locations(),
+                             simple_mdp.terrain_pos_dict['X'], simple_mdp.terrain_pos_dict['X'][::-1], []]
+        for start_pos, start_or in itertools.product(simple_mdp.get_valid_player_positions(), Direction.ALL_DIRECTIONS):
+            start = (start_pos, start_or)
+            for feature_pos_list in feature_pos_lists:
+                # Minimum over all valid motion goals, preferring earlier features on ties
+                min_dist, best_feature = np.Inf, None
+                for feature_pos in feature_pos_list:
+                    for goal in planner.motion_goals_for_pos[feature_pos]:
+                        if planner.is_valid_motion_start_goal_pair(start, goal) and planner.get_gridworld_distance(start, goal) < min_dist:
+                            min_dist, best_feature = planner.get_gridworld_distance(start, goal), feature_pos
+                self.assertEqual(planner.min_cost_to_feature(start, feature_pos_list, with_argmin=True), (min_dist + 1, best_feature))
+
     def test_simple_mdp(self):
         planner = ml_action_manager_simple.joint_motion_planner.motion_planner
         self.simple_mdp_already_at_goal(planner)
@@ -199,6 +215,19 @@ class TestJointMotionPlanner(unittest.TestCase):
         optimal_finshing_times = (2, 3)
         self.assertEqual(finshing_times, optimal_finshing_times)
 
+    def test_derive_state_with_logged_interact(self):
+        jm_planner = ml_action_manager_simple.joint_motion_planner
+        start_state = OvercookedState(
+            [P((1, 1), n, Obj('onion', (1, 1))), P((3, 1), n)],
+            {}, all_orders=simple_mdp.start_all_orders
+        )
+        # The last interact puts the onion in the pot, which would log a potting event
+        end_pos_and_ors = (((2, 1), n), ((3, 1), n))
+        end_state = jm_planner.derive_state(start_state, end_pos_and_ors, [(e, stay), (n, stay), (interact, stay)])
+        self.assertFalse(end_state.players[0].has_object())
+        self.assertEqual(end_state.get_object((2, 0)).ingredients, ['onion'])
+        self.assertTrue(start_state.players[0].has_object())
+
     def test_with_start_orientations_simple_mdp(self):
         jm_planner = or_ml_action_manager_simple.joint_motion_planner
         self.simple_mdp_suite(jm_planner)
@@ -0,0 +1,74 @@
+import sys, time, argparse
+import numpy as np
+from overcooked_ai_py.mdp.actions import Action
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld
+
+# Benchmark for the memory footprint of stored OvercookedStates and the raw step throughput of
+# OvercookedGridworld.get_state_transition. Not collected by the test runner, run it directly:
+#
+#   python state_benchmark.py --layout cramped_room --num_steps 5000
+
+
+def deep_sizeof(objs):
+    """
+    Total number of bytes used by all objects reachable from `objs`. Every object is only
+    counted once, so memory that is shared between states is not double counted.
+    """
+    seen = set()
+    stack = list(objs)
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or obj is None or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for slots in (getattr(cls, '__slots__', ()) for cls in type(obj).__mro__):
+            for slot in ((slots,) if isinstance(slots, str) else slots):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+    return total
+
+
+def random_rollout(mdp, num_steps, seed=0):
+    """Rolls out uniformly random joint actions, returning all visited states"""
+    rng = np.random.RandomState(seed)
+    state = mdp.get_standard_start_state()
+    states = [state]
+    for _ in range(num_steps):
+        joint_action = tuple(Action.INDEX_TO_ACTION[i] for i in rng.randint(Action.NUM_ACTIONS, size=mdp.num_players))
+        state, _ = mdp.get_state_transition(state, joint_action)
+        states.append(state)
+    return states
+
+
+def run_benchmark(layout_name, num_steps):
+    mdp = OvercookedGridworld.from_layout_name(layout_name)
+
+    start_time = time.time()
+    states = random_rollout(mdp, num_steps)
+    elapsed = time.time() - start_time
+
+    bytes_per_state = deep_sizeof(states) / len(states)
+    return {
+        "layout": layout_name,
+        "steps_per_sec": num_steps / elapsed,
+        "bytes_per_state": bytes_per_state
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--layout", default="cramped_room")
+    parser.add_argument("--num_steps", type=int, default=5000)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.layout, args.num_steps)
+    print("Layout: {layout}\nSteps/sec: {steps_per_sec:.1f}\nBytes per stored state: {bytes_per_state:.1f}".format(**results))
@@ -0,0 +1,64 @@
+import os, shutil, tempfile, unittest
+import numpy as np
+from overcooked_ai_py.mdp.actions import Action
+from overcooked_ai_py.mdp.overcooked_mdp import OvercookedGridworld
+from overcooked_ai_py.mdp.tabular_overcooked_mdp import TabularOvercookedGridworld
+
+
+class TestTabularOvercookedGridworld(unittest.TestCase):
+
+    def setUp(self):
+        # A single player layout without free counters, which has few enough reachable states to enumerate
+        self.mdp = OvercookedGridworld.from_grid(["XPX", "O1S", "XDX"], { "start_all_orders" : [{ "ingredients" : ["onion"] }], "cook_time" : 2 })
+        self.tabular_mdp = TabularOvercookedGridworld.from_mdp(self.mdp)
+        self.save_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.save_dir)
+
+    def test_transitions_match_mdp(self):
+        tab = self.tabular_mdp
+        self.assertEqual(tab.get_state(0), self.mdp.get_standard_start_state())
+        self.assertEqual(tab.next_state_ids.shape, (tab.num_states, Action.NUM_ACTIONS))
+        for state_id in range(tab.num_states):
+            state = tab.get_state(state_id)
+            self.assertEqual(tab.get_state_id(state), state_id)
+            for joint_action_idx, joint_action in enumerate(tab.joint_actions):
+                next_state, infos = self.mdp.get_state_transition(state, joint_action)
+                next_state_id = tab.get_next_state_id(state_id, joint_action)
+                self.assertEqual(next_state_id, tab.get_state_id(next_state))
+                self.assertEqual(tab.sparse_rewards[state_id, joint_action_idx], sum(infos["sparse_reward_by_agent"]))
+                self.assertEqual(tab.shaped_rewards[state_id, joint_action_idx], sum(infos["shaped_reward_by_agent"]))
+                self.assertEqual(tab.transition_matrix(joint_action_idx)[state_id, next_state_id], 1)
+
+    def test_value_iteration(self):
+        values, _ = self.tabular_mdp.value_iteration(gamma=1, horizon=40)
+        self.assertGreater(values[0], 0)
+
+        # Following the optimal discounted policy gets rewards, but no more than the finite horizon optimum
+        _, joint_action_idxs = self.tabular_mdp.value_iteration(gamma=0.95)
+        state, total_reward = self.mdp.get_standard_start_state(), 0
+        for t in range(40):
+            state_id = self.tabular_mdp.get_state_id(state)
+            state, infos = self.mdp.get_state_transition(state, self.tabular_mdp.joint_actions[joint_action_idxs[state_id]])
+            total_reward += sum(infos["sparse_reward_by_agent"])
+        self.assertGreater(total_reward, 0)
+        self.assertLessEqual(total_reward, values[0])
+
+    def test_save_and_load(self):
+        TabularOvercookedGridworld.from_mdp(self.mdp, save_dir=self.save_dir, chunk_size=7)
+        loaded = TabularOvercookedGridworld.load(self.save_dir, self.mdp)
+        self.assertEqual(loaded.num_states, self.tabular_mdp.num_states)
+        self.assertTrue(np.array_equal(loaded.states, self.tabular_mdp.states))
+        self.assertTrue(np.array_equal(loaded.next_state_ids, self.tabular_mdp.next_state_ids))
+        self.assertTrue(np.array_equal(loaded.sparse_rewards, self.tabular_mdp.sparse_rewards))
+        self.assertEqual(loaded.get_state_id(self.tabular_mdp.get_state(3)), 3)
+
+    def test_max_states(self):
+        with self.assertRaises(ValueError):
+            TabularOvercookedGridworld.from_mdp(OvercookedGridworld.from_layout_name("cramped_room"), max_states=100,
+                                                save_dir=os.path.join(self.save_dir, "cramped_room"))
+
+
+if __name__ == '__main__':
+    unittest.main()